@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import fcntl
+import pickle
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Settings
+DATA_FOLDER = "data"
+MANIFEST_FILE = "manifest.json"
+ARRAY_DTYPE = np.float32  # float matrices (dense and sparse) are stored with this dtype unless asked otherwise
+CSR_PARTS = ("data", "indices", "indptr")
+VERIFY_CHECKSUMS = os.environ.get("ARTIFACT_VERIFY", "0") == "1"  # re-hash artifacts on every load
+
+
+def _folder(folder_name):
+    return os.path.join(DATA_FOLDER, folder_name)
+
+def _checksum(path):
+    # a sparse matrix is a directory of .npy parts, hashed in a fixed order
+    paths = [os.path.join(path, f"{part}.npy") for part in CSR_PARTS] if os.path.isdir(path) else [path]
+    digest = hashlib.sha256()
+    for part_path in paths:
+        with open(part_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f"{part}.npy")) for part in CSR_PARTS)
+    return os.path.getsize(path)
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    if os.path.isdir(tmp_path) and os.path.isdir(path):
+        # os.replace can't overwrite a non-empty directory, move the old one aside first
+        old_path = f"{path}.{os.getpid()}.old"
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(tmp_path, path)
+
+@contextmanager
+def _manifest_lock(folder_name):
+    # several gunicorn workers may register artifacts of the same session at once
+    with open(os.path.join(_folder(folder_name), f"{MANIFEST_FILE}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_manifest(folder_name):
+    try:
+        with open(os.path.join(_folder(folder_name), MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _register(folder_name, name, entry):
+    with _manifest_lock(folder_name):
+        manifest = load_manifest(folder_name)
+        manifest[name] = entry
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=4)
+        _atomic_write(os.path.join(_folder(folder_name), MANIFEST_FILE), write)
+
+
+def save_artifact(data, folder_name, name, dtype=ARRAY_DTYPE):
+    """
+    Stores data as the artifact name of a session folder and records it in the folder's manifest:
+    numpy arrays as .npy (floating arrays cast to dtype, pass dtype=None to keep them), sparse matrices
+    as a directory with the CSR data/indices/indptr arrays as .npy, dataframes as parquet,
+    lists/dicts/strings/numbers as JSON and anything else as a pickle.
+    """
+    os.makedirs(_folder(folder_name), exist_ok=True)
+    if sparse.issparse(data):
+        data = data.tocsr()
+        if dtype is not None and np.issubdtype(data.dtype, np.floating):
+            data = data.astype(dtype, copy=False)
+        data.sort_indices()
+        kind, file_name = "csr", f"{name}.csr"
+        def write(tmp_path):
+            os.makedirs(tmp_path)
+            for part in CSR_PARTS:
+                with open(os.path.join(tmp_path, f"{part}.npy"), "wb") as f:
+                    np.save(f, getattr(data, part))
+        shape, stored_dtype = list(data.shape), str(data.dtype)
+    elif isinstance(data, np.ndarray):
+        if dtype is not None and np.issubdtype(data.dtype, np.floating):
+            data = data.astype(dtype, copy=False)
+        kind, file_name = "array", f"{name}.npy"
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(data))
+        shape, stored_dtype = list(data.shape), str(data.dtype)
+    elif isinstance(data, pd.DataFrame):
+        kind, file_name = "dataframe", f"{name}.parquet"
+        write = lambda tmp_path: data.to_parquet(tmp_path, index=False)
+        shape, stored_dtype = list(data.shape), {column: str(column_dtype) for column, column_dtype in data.dtypes.items()}
+    elif isinstance(data, (list, tuple, dict, str, int, float, bool)) or data is None:
+        kind, file_name = "json", f"{name}.json"
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, default=_json_default)
+        shape = [len(data)] if isinstance(data, (list, tuple, dict)) else []
+        stored_dtype = type(data).__name__
+    else:
+        kind, file_name = "pickle", f"{name}.pkl"
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f)
+        shape, stored_dtype = [], type(data).__name__
+
+    path = os.path.join(_folder(folder_name), file_name)
+    _atomic_write(path, write)
+    register_artifact(folder_name, name, file_name, kind, shape, stored_dtype)
+    return path
+
+def register_artifact(folder_name, name, file_name, kind, shape, dtype):
+    """Adds a file that was written into the session folder by other means to the manifest."""
+    path = os.path.join(_folder(folder_name), file_name)
+    _register(folder_name, name, {
+        "file": file_name,
+        "kind": kind,
+        "shape": shape,
+        "dtype": dtype,
+        "bytes": _size(path),
+        "sha256": _checksum(path),
+        "written_at": time.time(),
+    })
+
+def artifact_path(folder_name, name):
+    """Path of the file backing an artifact, the legacy <name>.pkl for folders written before the manifest."""
+    entry = load_manifest(folder_name).get(name)
+    file_name = entry["file"] if entry else f"{name}.pkl"
+    return os.path.join(_folder(folder_name), file_name)
+
+def verify_artifact(folder_name, name):
+    entry = load_manifest(folder_name).get(name)
+    if entry is None:
+        raise KeyError(f"Artifact {name} is not in the manifest of {folder_name}")
+    return _checksum(os.path.join(_folder(folder_name), entry["file"])) == entry["sha256"]
+
+def load_artifact(folder_name, name, mmap_mode="r", verify=VERIFY_CHECKSUMS):
+    """
+    Loads an artifact of a session folder. Arrays are memory-mapped read-only by default, so workers
+    serving the same session share the pages; pass mmap_mode=None to get a private in-memory copy.
+    """
+    entry = load_manifest(folder_name).get(name)
+    if entry is None:
+        # session written before the manifest existed
+        with open(os.path.join(_folder(folder_name), f"{name}.pkl"), "rb") as f:
+            return pickle.load(f)
+    if verify and not verify_artifact(folder_name, name):
+        raise ValueError(f"Checksum mismatch for artifact {name} in {folder_name}")
+
+    path = os.path.join(_folder(folder_name), entry["file"])
+    kind = entry["kind"]
+    if kind == "array":
+        return np.load(path, mmap_mode=mmap_mode)
+    if kind == "csr":
+        data, indices, indptr = (np.load(os.path.join(path, f"{part}.npy"), mmap_mode=mmap_mode) for part in CSR_PARTS)
+        return sparse.csr_matrix((data, indices, indptr), shape=tuple(entry["shape"]), copy=False)
+    if kind == "dataframe":
+        return pd.read_parquet(path)
+    if kind == "json":
+        with open(path, "r") as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_json(data, folder_name, filename):
+    folder_path = _folder(folder_name)
+    os.makedirs(folder_path, exist_ok=True)
+    file_path = os.path.join(folder_path, filename)
+    with open(file_path, "w") as f:
+        json.dump(data, f, indent=4)
+
+def load_json(folder_name, filename):
+    file_path = os.path.join(_folder(folder_name), filename)
+    with open(file_path, "r") as f:
+        return json.load(f)
@@ -1,18 +1,98 @@
 print("Starting importing necessary modules...")
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, has_request_context
 from flask_cors import CORS
 import os
+import json
+import numpy as np
 import pandas as pd
 import time
 from datetime import datetime, timedelta
 import threading
 
-from utils import *
+# only light modules are imported at boot, TensorFlow/Keras (utils) load on the first endpoint that needs them
+from startup import timed_import, startup_report
 from cleanup import start_cleanup_thread
+from jobs import JobConflictError, submit_job, load_job
+from artifacts import ARRAY_DTYPE, save_artifact, load_artifact, load_manifest, artifact_path, save_json, load_json
+from session_cache import session_cache
+from data_processing import (
+    EVENT_LOG_FILE,
+    create_attribute_pools,
+    create_feature_indices,
+    create_feature_names,
+    ingest_xes,
+    load_event_log,
+    train_test_split_encoding,
+)
+from decision_tree import save_tree, tree_to_json, train_dt, calculate_metrics
+import inference
+from label_store import DISTILL_TOP_K, LabelStore, as_label_store, save_label_store, load_label_store
+from tree_history import TREE_FILE, get_tree_history, reset_tree_history, tree_cache_path
 
 app = Flask(__name__)
 CORS(app)
 
+def ml():
+    """The utils module with the TensorFlow models, imported by the first request that trains or predicts."""
+    return timed_import("utils", trigger=request.path if has_request_context() else "startup")
+
+# session artifacts are served from the in-memory cache, writes go to disk and refresh the cache
+def get_data(folder_name, name):
+    path = artifact_path(folder_name, name)
+    return session_cache.get(folder_name, name, path, lambda: load_artifact(folder_name, name))
+
+def get_event_log(folder_name):
+    path = os.path.join("data", folder_name, EVENT_LOG_FILE)
+    return session_cache.get(folder_name, EVENT_LOG_FILE, path, lambda: load_event_log(folder_name))
+
+def get_nn(folder_name, file_name):
+    path = os.path.join("models", folder_name, file_name)
+    return session_cache.get(folder_name, file_name, path, lambda: ml().load_nn(folder_name, file_name))
+
+def get_tree(folder_name):
+    """The current version of the session's distilled tree, with its edit history replayed."""
+    return session_cache.get(folder_name, TREE_FILE, tree_cache_path(folder_name), lambda: get_tree_history(folder_name).materialize())
+
+def get_tree_json(folder_name):
+    """The nested JSON of the current tree for the frontend, only built on request and cached as text."""
+    return session_cache.get(folder_name, f"{TREE_FILE}.json", tree_cache_path(folder_name), lambda: json.dumps(tree_to_json(get_tree(folder_name))))
+
+def store_data(data, folder_name, name, dtype=ARRAY_DTYPE):
+    path = save_artifact(data, folder_name, name, dtype=dtype)
+    # cache what is on disk (memory-mapped, float32 unless dtype says otherwise), not the in-memory original
+    session_cache.put(folder_name, name, path, load_artifact(folder_name, name))
+
+def store_nn(model, folder_name, file_name):
+    ml().save_nn(model, folder_name, file_name)
+    session_cache.put(folder_name, file_name, os.path.join("models", folder_name, file_name), model)
+
+def store_dt(dt, folder_name, file_name):
+    path = os.path.join("models", folder_name, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_tree(dt, path)
+    session_cache.put(folder_name, file_name, path, dt)
+
+def store_labels(store, folder_name, name):
+    save_label_store(store, folder_name, name, save=store_data)
+
+def get_distilled_labels(folder_name):
+    """LabelStores (y_distilled, y_distilled_tree) for finetune_nn, built from the dense arrays of sessions distilled before the label store."""
+    if "y_distilled_tree_label_store" in load_manifest(folder_name):
+        return load_label_store(folder_name, "y_distilled", load=get_data), load_label_store(folder_name, "y_distilled_tree", load=get_data)
+    y_distilled, y_distilled_tree = get_data(folder_name, "y_distilled"), get_data(folder_name, "y_distilled_tree")
+    return as_label_store(y_distilled, y_distilled.shape[1]), LabelStore.from_labels(np.argmax(y_distilled_tree, axis=1), y_distilled_tree.shape[1])
+
+# long running endpoints can be run as background jobs by sending "async": true
+def submit_async(job_type, folder_name, data):
+    params = {key: value for key, value in data.items() if key != "async"}
+    try:
+        job = submit_job(job_type, folder_name, params)
+    except JobConflictError as e:
+        return jsonify({"error": str(e), "job": e.job}), 409
+    except Exception as e:
+        return jsonify({"error": f"Error submitting job: {str(e)}"}), 500
+    return jsonify(job), 202
+
 @app.before_request
 def log_method_path():
     print(f"{request.method} {request.path}")
@@ -27,9 +107,8 @@ def hello_world():
 @app.route("/api/load_xes", methods=["POST"])
 def load_xes():
     if "file" not in request.files:
-        file_path = os.path.join("data", "cancer_screening.xes")
         try:
-            df = load_xes_to_df("event_log.xes", "cs")
+            summary = ingest_xes("event_log.xes", "cs")
         except FileNotFoundError:
             return jsonify({"error": "File not found for processing"}), 500
         except Exception as e:
@@ -52,34 +131,29 @@ def load_xes():
             return jsonify({"error": f"Failed to save file: {str(e)}"}), 500
 
         try:
-            df = load_xes_to_df("event_log.xes", folder_name)
+            summary = ingest_xes("event_log.xes", folder_name)
         except FileNotFoundError:
             return jsonify({"error": "Saved file not found for processing"}), 500
         except Exception as e:
             return jsonify({"error": f"Error loading XES file: {str(e)}"}), 500
     
     try:
-        columns = df.columns.tolist()
+        columns = list(summary["columns"])
         columns.remove("case_id")
         columns.remove("activity")
         columns.remove("time:timestamp")
-    except KeyError as e:
-        return jsonify({"error": f"Missing expected column in data frame: {str(e)}"}), 500
+    except ValueError as e:
+        return jsonify({"error": f"Missing expected column in event log: {str(e)}"}), 500
     except Exception as e:
-        return jsonify({"error": f"Error processing data frame: {str(e)}"}), 500
+        return jsonify({"error": f"Error processing event log: {str(e)}"}), 500
 
-    try:
-        stats = {
-            "num_cases": df["case_id"].nunique(),
-            "num_events": len(df),
-            "events_per_case": df.groupby("case_id").size().mean(),
-            "attributes": columns
-        }
-        return jsonify(stats)
-    except KeyError as e:
-        return jsonify({"error": f"Missing expected column in data frame: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": f"Error processing data frame: {str(e)}"}), 500
+    stats = {
+        "num_cases": summary["num_cases"],
+        "num_events": summary["num_events"],
+        "events_per_case": summary["num_events"] / summary["num_cases"] if summary["num_cases"] else 0.0,
+        "attributes": columns
+    }
+    return jsonify(stats)
 
 
 
@@ -91,11 +165,13 @@ def process_and_train():
     folder_name = data.get("folder_name")
     if not folder_name:
         return jsonify({"error": "Missing folder_name in request data"}), 400
+    if data.get("async", False):
+        return submit_async("process_and_train", folder_name, data)
 
     try:
-        df = load_data(folder_name, "event_log_df.pkl")
+        df = get_event_log(folder_name)
     except FileNotFoundError:
-        return jsonify({"error": "Data file event_log_df.pkl not found in folder"}), 500
+        return jsonify({"error": "Event log not found in folder, upload an XES file first"}), 500
     except Exception as e:
         return jsonify({"error": f"Error loading data: {str(e)}"}), 500
 
@@ -105,6 +181,7 @@ def process_and_train():
         test_size = data.get("test_split", 0.3)
         prefix_length = data.get("prefix_length", 3)
         shuffle = data.get("shuffle", False)
+        sparse_output = data.get("sparse", False)
 
         X_train, y_train, X_test, y_test = train_test_split_encoding(
             df,
@@ -113,15 +190,16 @@ def process_and_train():
             test_size=test_size,
             prefix_length=prefix_length,
             shuffle=shuffle,
+            sparse_output=sparse_output,
         )
     except Exception as e:
         return jsonify({"error": f"Error during train/test split and encoding: {str(e)}"}), 500
 
     try:
-        save_data(X_train, folder_name, "X_train.pkl")
-        save_data(y_train, folder_name, "y_train.pkl")
-        save_data(X_test, folder_name, "X_test.pkl")
-        save_data(y_test, folder_name, "y_test.pkl")
+        store_data(X_train, folder_name, "X_train")
+        store_data(y_train, folder_name, "y_train")
+        store_data(X_test, folder_name, "X_test")
+        store_data(y_test, folder_name, "y_test")
     except Exception as e:
         return jsonify({"error": f"Error saving train/test data: {str(e)}"}), 500
 
@@ -140,9 +218,9 @@ def process_and_train():
         return jsonify({"error": f"Error creating features: {str(e)}"}), 500
 
     try:
-        save_data(class_names, folder_name, "class_names.pkl")
-        save_data(feature_names, folder_name, "feature_names.pkl")
-        save_data(feature_indices, folder_name, "feature_indices.pkl")
+        store_data(class_names, folder_name, "class_names")
+        store_data(feature_names, folder_name, "feature_names")
+        store_data(feature_indices, folder_name, "feature_indices")
     except Exception as e:
         return jsonify({"error": f"Error saving feature metadata: {str(e)}"}), 500
 
@@ -150,9 +228,9 @@ def process_and_train():
         hidden_units = data.get("hidden_units", [512, 256, 128, 64])
         epochs = data.get("epochs", 5)
         learning_rate = data.get("learning_rate", 0.001)
-        batch_size = data.get("batch_size", 32)
+        batch_size = data.get("batch_size")  # None uses the input pipeline's default
 
-        model = train_nn(
+        model = ml().train_nn(
             X_train,
             y_train,
             folder_name=folder_name,
@@ -161,12 +239,18 @@ def process_and_train():
             epochs=epochs,
             learning_rate=learning_rate,
             batch_size=batch_size,
+            pipeline=data.get("pipeline"),
+            lr_scaling=data.get("lr_scaling"),
+            shuffle_buffer=data.get("shuffle_buffer"),
+            cache=data.get("cache_dataset"),
+            patience=data.get("patience"),
         )
+        session_cache.put(folder_name, "nn.keras", os.path.join("models", folder_name, "nn.keras"), model)
     except Exception as e:
         return jsonify({"error": f"Error training model: {str(e)}"}), 500
 
     try:
-        y_pred = model.predict(X_test)
+        y_pred = inference.predict(folder_name, "nn.keras", artifact="X_test")
         nn_evaluation = calculate_metrics(y_test, y_pred)
         save_json(nn_evaluation, folder_name, "nn_evaluation.json")
     except Exception as e:
@@ -189,20 +273,22 @@ def distill_tree():
     folder_name = data.get("folder_name")
     if not folder_name:
         return jsonify({"error": "Missing folder_name in request data"}), 400
+    if data.get("async", False):
+        return submit_async("distill_tree", folder_name, data)
 
     ccp_alpha = data.get("ccp_alpha", 0.001)
     max_depth = data.get("max_depth", None)
     min_samples_split = data.get("min_samples_split", 2)
     min_samples_leaf = data.get("min_samples_leaf", 1)
+    splitter = data.get("splitter", "exact")  # split search of nodes regrown by later edits, "exact" or "hist"
+    max_bins = data.get("max_bins", 256)
     model_to_use = data.get("model_to_use", "original")
     model_name = "nn" if model_to_use == "original" else "nn_modified"
+    soft_label_k = data.get("soft_label_k", DISTILL_TOP_K)
 
-    try:
-        nn = load_nn(folder_name, f"{model_name}.keras")
-    except FileNotFoundError:
+    # the network stays in the inference server, this worker never loads TensorFlow
+    if not os.path.exists(os.path.join("models", folder_name, f"{model_name}.keras")):
         return jsonify({"error": f"Neural network model '{model_name}' not found"}), 500
-    except Exception as e:
-        return jsonify({"error": f"Error loading neural network: {str(e)}"}), 500
 
     try:
         nn_evaluation = load_json(folder_name, f"{model_name}_evaluation.json")
@@ -212,25 +298,26 @@ def distill_tree():
         return jsonify({"error": f"Error loading nn evaluation: {str(e)}"}), 500
 
     try:
-        X_train = load_data(folder_name, "X_train.pkl")
-        X_test = load_data(folder_name, "X_test.pkl")
-        y_test = load_data(folder_name, "y_test.pkl")
-        class_names = load_data(folder_name, "class_names.pkl")
-        feature_names = load_data(folder_name, "feature_names.pkl")
-        feature_indices = load_data(folder_name, "feature_indices.pkl")
+        X_train = get_data(folder_name, "X_train")
+        X_test = get_data(folder_name, "X_test")
+        y_test = get_data(folder_name, "y_test")
+        class_names = get_data(folder_name, "class_names")
+        feature_names = get_data(folder_name, "feature_names")
+        feature_indices = get_data(folder_name, "feature_indices")
     except FileNotFoundError as e:
         return jsonify({"error": f"Required data file not found: {str(e)}"}), 500
     except Exception as e:
         return jsonify({"error": f"Error loading data files: {str(e)}"}), 500
 
     try:
-        y_distilled = nn.predict(X_train)
-        y_encoded = np.argmax(y_distilled, axis=1)
+        # only the labels and top-k probabilities come back, never the full softmax matrix
+        y_encoded, top_k_indices, top_k_values = inference.predict_labels(
+            folder_name, f"{model_name}.keras", artifact="X_train", top_k=soft_label_k)
     except Exception as e:
         return jsonify({"error": f"Error during neural network prediction: {str(e)}"}), 500
 
     try:
-        dt_distilled = train_dt(
+        dt_distilled, y_distilled_tree = train_dt(
             X_train,
             y_encoded,
             class_names=class_names,
@@ -240,22 +327,19 @@ def distill_tree():
             max_depth=max_depth,
             min_samples_split=min_samples_split,
             min_samples_leaf=min_samples_leaf,
+            return_train_predictions=True,
+            splitter=splitter,
+            max_bins=max_bins,
         )
     except Exception as e:
         return jsonify({"error": f"Error training decision tree: {str(e)}"}), 500
 
     try:
-        y_distilled_tree = dt_distilled.predict(X_train)
-        y_distilled_tree = to_categorical(
-            y_distilled_tree, num_classes=len(dt_distilled.class_names)
-        )
-    except Exception as e:
-        return jsonify({"error": f"Error processing distilled tree predictions: {str(e)}"}), 500
-
-    try:
-        tree_json = save_dt(dt_distilled, folder_name, "tree.json")
-        save_data(y_distilled, folder_name, "y_distilled.pkl")
-        save_data(y_distilled_tree, folder_name, "y_distilled_tree.pkl")
+        reset_tree_history(folder_name)
+        store_dt(dt_distilled, folder_name, TREE_FILE)
+        store_labels(LabelStore(y_encoded, len(class_names), top_k_indices, top_k_values), folder_name, "y_distilled")
+        # stored last, its entry marks a session with label stores
+        store_labels(LabelStore.from_labels(y_distilled_tree, len(class_names)), folder_name, "y_distilled_tree")
     except Exception as e:
         return jsonify({"error": f"Error saving distilled tree data: {str(e)}"}), 500
 
@@ -271,7 +355,6 @@ def distill_tree():
             "status": "tree distilled",
             "dt_evaluation": dt_evaluation,
             "nn_evaluation": nn_evaluation,
-            "tree": tree_json,
             "params": data,
         }
     )
@@ -285,10 +368,8 @@ def load_tree():
     if not folder_name:
         return jsonify({"error": "Missing folder_name in request data"}), 400
 
-    dt_path = os.path.join("models", folder_name, "tree.json")
     try:
-        with open(dt_path, "r") as f:
-            tree = json.load(f)
+        tree_json = get_tree_json(folder_name)
     except FileNotFoundError:
         return jsonify({"error": "Decision tree file not found"}), 404
     except json.JSONDecodeError:
@@ -303,13 +384,10 @@ def load_tree():
     except Exception as e:
         return jsonify({"error": f"Error loading evaluation data: {str(e)}"}), 500
 
-    return jsonify(
-        {
-            "status": "tree loaded",
-            "dt_evaluation": dt_evaluation,
-            "tree": tree,
-        }
-    )
+    # the tree is already serialized, splice it in instead of decoding and re-encoding it
+    body = json.dumps({"status": "tree loaded", "dt_evaluation": dt_evaluation, "tree": None})
+    body = body[:-len("null}")] + tree_json + "}"
+    return app.response_class(body, mimetype="application/json")
 
 
 @app.route("/api/modify", methods=["POST"])
@@ -326,35 +404,42 @@ def modify():
         return jsonify({"error": "Missing required parameters: folder_name and/or node_id"}), 400
 
     try:
-        X_test = load_data(folder_name, "X_test.pkl")
-        y_test = load_data(folder_name, "y_test.pkl")
+        X_test = get_data(folder_name, "X_test")
+        y_test = get_data(folder_name, "y_test")
         nn_evaluation = load_json(folder_name, "nn_evaluation.json")
-        tree = load_dt(folder_name, "tree.json")
+        tree = get_tree(folder_name)
     except FileNotFoundError as e:
         return jsonify({"error": f"Required file not found: {str(e)}"}), 404
     except Exception as e:
         return jsonify({"error": f"Error loading data or tree: {str(e)}"}), 500
 
     try:
+        # keeps the test predictions of the cached tree in sync, so only rows of the edited subtree are re-predicted
+        evaluation = tree.track_evaluation(X_test, y_test)
         if mode == "discard":
             direction = data.get("direction", "auto")
-            tree.delete_branch(node_id, direction)
+            operation = tree.delete_branch(node_id, direction)
         elif mode == "retrain":
-            X_train = load_data(folder_name, "X_train.pkl")
-            y_train = load_data(folder_name, "y_train.pkl")
+            X_train = get_data(folder_name, "X_train")
+            y_train = get_data(folder_name, "y_train")
             y_encoded = np.argmax(y_train, axis=1)
-            tree.delete_node(X_train, y_encoded, node_id)
+            operation = tree.delete_node(X_train, y_encoded, node_id)
         else:
             return jsonify({"error": f"Invalid mode: {mode}"}), 400
     except Exception as e:
+        # the cached tree may be half edited, reload it from disk next time
+        session_cache.invalidate(folder_name, TREE_FILE)
         return jsonify({"error": f"Error modifying decision tree: {str(e)}"}), 500
 
     try:
-        y_pred = tree.predict(X_test)
-        dt_evaluation = calculate_metrics(y_test, y_pred)
+        # only the operation is appended to the edit log, the tree file is not rewritten
+        if operation is not None:
+            get_tree_history(folder_name).record(tree, operation)
+        dt_evaluation = evaluation.metrics()
         save_json(dt_evaluation, folder_name, "dt_evaluation.json")
-        tree_json = save_dt(tree, folder_name, "tree.json")
+        session_cache.put(folder_name, TREE_FILE, tree_cache_path(folder_name), tree)
     except Exception as e:
+        session_cache.invalidate(folder_name, TREE_FILE)
         return jsonify({"error": f"Error during evaluation or saving: {str(e)}"}), 500
 
     return jsonify(
@@ -362,12 +447,94 @@ def modify():
             "status": "decision tree modified",
             "nn_evaluation": nn_evaluation,
             "dt_evaluation": dt_evaluation,
-            "tree": tree_json,
+            "version": tree.version,
             "params": data,
         }
     )
 
 
+def _checkout_tree(folder_name, move):
+    """Moves the head of the tree history with move(history) and re-evaluates the tree it now points at."""
+    try:
+        history = get_tree_history(folder_name)
+        version = move(history)
+        if version is None:
+            return jsonify({"error": "Nothing to undo or redo"}), 409
+        tree = history.materialize(version)
+        X_test = get_data(folder_name, "X_test")
+        y_test = get_data(folder_name, "y_test")
+        nn_evaluation = load_json(folder_name, "nn_evaluation.json")
+    except FileNotFoundError as e:
+        return jsonify({"error": f"Required file not found: {str(e)}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error loading tree version: {str(e)}"}), 500
+
+    try:
+        dt_evaluation = tree.track_evaluation(X_test, y_test).metrics()
+        save_json(dt_evaluation, folder_name, "dt_evaluation.json")
+        session_cache.put(folder_name, TREE_FILE, tree_cache_path(folder_name), tree)
+    except Exception as e:
+        return jsonify({"error": f"Error during evaluation or saving: {str(e)}"}), 500
+
+    return jsonify(
+        {
+            "status": "tree version checked out",
+            "version": version,
+            "latest_version": history.latest(),
+            "nn_evaluation": nn_evaluation,
+            "dt_evaluation": dt_evaluation,
+        }
+    )
+
+@app.route("/api/undo", methods=["POST"])
+def undo():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    folder_name = request.json.get("folder_name")
+    if not folder_name:
+        return jsonify({"error": "Missing folder_name in request data"}), 400
+    return _checkout_tree(folder_name, lambda history: history.undo())
+
+@app.route("/api/redo", methods=["POST"])
+def redo():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    folder_name = request.json.get("folder_name")
+    if not folder_name:
+        return jsonify({"error": "Missing folder_name in request data"}), 400
+    return _checkout_tree(folder_name, lambda history: history.redo())
+
+@app.route("/api/checkout", methods=["POST"])
+def checkout():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.json
+    folder_name = data.get("folder_name")
+    version = data.get("version")
+    if not folder_name or version is None:
+        return jsonify({"error": "Missing required parameters: folder_name and/or version"}), 400
+    return _checkout_tree(folder_name, lambda history: history.checkout(int(version)))
+
+@app.route("/api/tree_history", methods=["POST"])
+def tree_history():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    folder_name = request.json.get("folder_name")
+    if not folder_name:
+        return jsonify({"error": "Missing folder_name in request data"}), 400
+    try:
+        history = get_tree_history(folder_name)
+        versions = history.versions()
+        head = history.head()
+    except FileNotFoundError:
+        return jsonify({"error": "Decision tree file not found"}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error loading tree history: {str(e)}"}), 500
+    return jsonify({"head": head, "versions": versions})
+
+
 @app.route("/api/finetune", methods=["POST"])
 def finetune():
     if not request.is_json:
@@ -377,20 +544,21 @@ def finetune():
     folder_name = data.get("folder_name")
     if not folder_name:
         return jsonify({"error": "Missing folder_name in request data"}), 400
+    if data.get("async", False):
+        return submit_async("finetune", folder_name, data)
 
     finetuning_mode = data.get("finetuning_mode", "changed_complete")
     epochs = data.get("epochs", 3)
     learning_rate = data.get("learning_rate", 0.001)
-    batch_size = data.get("batch_size", 32)
+    batch_size = data.get("batch_size")
 
     try:
-        X_train = load_data(folder_name, "X_train.pkl")
-        X_test = load_data(folder_name, "X_test.pkl")
-        y_test = load_data(folder_name, "y_test.pkl")
-        y_distilled = load_data(folder_name, "y_distilled.pkl")
-        y_distilled_tree = load_data(folder_name, "y_distilled_tree.pkl")
-        nn = load_nn(folder_name, "nn.keras")
-        dt_distilled = load_dt(folder_name, "tree.json")
+        X_train = get_data(folder_name, "X_train")
+        X_test = get_data(folder_name, "X_test")
+        y_test = get_data(folder_name, "y_test")
+        y_distilled, y_distilled_tree = get_distilled_labels(folder_name)
+        nn = get_nn(folder_name, "nn.keras")
+        dt_distilled = get_tree(folder_name)
         nn_evaluation = load_json(folder_name, "nn_evaluation.json")
         dt_evaluation = load_json(folder_name, "dt_evaluation.json")
     except FileNotFoundError as e:
@@ -399,14 +567,16 @@ def finetune():
         return jsonify({"error": f"Error loading files: {str(e)}"}), 500
 
     try:
-        y_modified = dt_distilled.predict(X_train)
-        y_modified = to_categorical(y_modified, num_classes=len(dt_distilled.class_names))
+        y_modified = LabelStore.from_labels(dt_distilled.predict(X_train), y_test.shape[1])
     except Exception as e:
         return jsonify({"error": f"Error generating modified labels: {str(e)}"}), 500
 
     try:
-        nn_modified = finetune_nn(
-            nn,
+        # fine-tune a copy, the cached original network stays untouched
+        nn_modified = ml().clone_model(nn)
+        nn_modified.set_weights(nn.get_weights())
+        nn_modified = ml().finetune_nn(
+            nn_modified,
             X_train,
             y_modified,
             epochs=epochs,
@@ -417,13 +587,18 @@ def finetune():
             X_test=X_test,
             y_test=y_test,
             mode=finetuning_mode,
+            lr_scaling=data.get("lr_scaling"),
+            shuffle_buffer=data.get("shuffle_buffer"),
+            cache=data.get("cache_dataset"),
+            folder_name=folder_name,
+            patience=data.get("patience"),
         )
     except Exception as e:
         return jsonify({"error": f"Error during fine-tuning: {str(e)}"}), 500
 
     try:
-        save_nn(nn_modified, folder_name, "nn_modified.keras")
-        y_pred = nn_modified.predict(X_test)
+        store_nn(nn_modified, folder_name, "nn_modified.keras")
+        y_pred = inference.predict(folder_name, "nn_modified.keras", artifact="X_test")
         nn_modified_evaluation = calculate_metrics(y_test, y_pred)
         save_json(nn_modified_evaluation, folder_name, "nn_modified_evaluation.json")
     except Exception as e:
@@ -440,6 +615,60 @@ def finetune():
     )
 
 
+@app.route("/api/job_status", methods=["POST"])
+def job_status():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.json
+    folder_name = data.get("folder_name")
+    job_id = data.get("job_id")
+    if not folder_name or not job_id:
+        return jsonify({"error": "Missing required parameters: folder_name and/or job_id"}), 400
+
+    job = load_job(folder_name, job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    job.pop("result")
+    return jsonify(job)
+
+
+@app.route("/api/job_result", methods=["POST"])
+def job_result():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.json
+    folder_name = data.get("folder_name")
+    job_id = data.get("job_id")
+    if not folder_name or not job_id:
+        return jsonify({"error": "Missing required parameters: folder_name and/or job_id"}), 400
+
+    job = load_job(folder_name, job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if job["status"] in ("queued", "running"):
+        return jsonify({"status": job["status"], "progress": job["progress"]}), 202
+    if job["result"] is None:
+        return jsonify({"error": job["error"]}), job["status_code"] or 500
+    return jsonify(job["result"]), job["status_code"]
+
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify(session_cache.stats())
+
+
+@app.route("/api/inference_stats", methods=["GET"])
+def inference_stats():
+    try:
+        return jsonify(inference.server_stats())
+    except Exception as e:
+        return jsonify({"error": f"Error reaching the inference server: {str(e)}"}), 500
+
+
+@app.route("/api/startup_report", methods=["GET"])
+def startup_report_endpoint():
+    return jsonify(startup_report())
+
 
 if __name__ == "__main__":
     os.makedirs("data", exist_ok=True)
@@ -0,0 +1,230 @@
+import io
+import argparse
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+from sklearn.preprocessing import OneHotEncoder, MinMaxScaler
+from data_processing import transform_samples, create_attribute_pools, create_feature_names, create_feature_indices
+from fairness import fairness_metrics
+from trace_generator import Decision
+
+
+def generate_benchmark_df(num_cases=5000, num_activities=20, max_case_length=30, seed=0):
+    """Builds a random event log with the columns used by the cs/hb experiments."""
+    rng = np.random.default_rng(seed)
+    case_lengths = rng.integers(1, max_case_length + 1, size=num_cases)
+    case_ids = np.repeat(np.arange(num_cases), case_lengths)
+    num_events = len(case_ids)
+    activities = np.array([f"activity {i}" for i in range(num_activities)])
+    df = pd.DataFrame({
+        "case_id": case_ids,
+        "activity": activities[rng.integers(0, num_activities, size=num_events)],
+        "gender": np.repeat(rng.choice(["male", "female", "non conforming"], size=num_cases), case_lengths),
+        "age": np.repeat(rng.integers(20, 85, size=num_cases), case_lengths),
+        "time_delta": rng.exponential(600, size=num_events),
+    })
+    # interleave the cases' events so the grouping has to reorder the log
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def _fit_encoders(df, categorical_attributes, numerical_attributes):
+    class_names = sorted(df["activity"].unique().tolist() + ["<PAD>"])
+    activity_encoder = OneHotEncoder(sparse_output=False, handle_unknown="ignore", categories=[class_names])
+    activity_encoder.fit(df[['activity']])
+    attribute_encoders = {}
+    for attr in categorical_attributes:
+        encoder = OneHotEncoder(sparse_output=False, handle_unknown="ignore", categories=[sorted(df[attr].unique())])
+        encoder.fit(df[[attr]])
+        attribute_encoders[attr] = encoder
+    numerical_scalers = {}
+    for attr in numerical_attributes:
+        scaler = MinMaxScaler()
+        scaler.fit(df[[attr]])
+        numerical_scalers[attr] = scaler
+    return activity_encoder, attribute_encoders, numerical_scalers
+
+
+def _transform_samples_loop(df, activity_encoder, attribute_encoders, numerical_scalers,
+                            categorical_attributes, numerical_attributes, prefix_length):
+    """Per-case reference encoder (the implementation transform_samples used to have)."""
+    grouped = df.groupby('case_id')
+    cases = []
+    for case_id, group in grouped:
+        activities = activity_encoder.transform(group[['activity']])
+        attributes = {attr: attribute_encoders[attr].transform(group[[attr]]) for attr in categorical_attributes}
+        group = group.copy()
+        for attr in numerical_attributes:
+            group[attr] = numerical_scalers[attr].transform(group[[attr]])
+        cases.append((activities, attributes, group[numerical_attributes].values))
+
+    X, y = [], []
+    pad_activity = activity_encoder.transform([["<PAD>"]])
+    pad_attributes = {attr: np.zeros((1, enc.categories_[0].shape[0])) for attr, enc in attribute_encoders.items()}
+    pad_numerical = np.zeros((1, len(numerical_attributes)))
+
+    for activities, attributes, numerical in cases:
+        padded_activities = np.vstack([pad_activity] * prefix_length + [activities])
+        padded_attributes = {attr: np.vstack([pad_attributes[attr]] * prefix_length + [attributes[attr]])
+                             for attr in sorted(attributes)}
+        padded_numerical = np.vstack([pad_numerical] * prefix_length + [numerical])
+
+        for i in range(len(activities)):
+            x_activities = padded_activities[i:i + prefix_length]
+            if categorical_attributes:
+                x_attributes = np.hstack([padded_attributes[attr][i + prefix_length] for attr in categorical_attributes])
+            else:
+                x_attributes = np.array([])
+            if numerical_attributes:
+                x_numerical = padded_numerical[i + prefix_length]
+            else:
+                x_numerical = np.array([])
+            X.append(np.hstack([x_activities.flatten(), x_attributes, x_numerical]))
+            y.append(activities[i])
+
+    return np.array(X), np.array(y)
+
+
+def _time(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def benchmark_transform_samples(num_cases=5000, prefix_length=3, repeats=3):
+    categorical_attributes = ["gender"]
+    numerical_attributes = ["age", "time_delta"]
+    df = generate_benchmark_df(num_cases=num_cases)
+    encoders = _fit_encoders(df, categorical_attributes, numerical_attributes)
+    args = (df, *encoders, categorical_attributes, numerical_attributes, prefix_length)
+
+    loop_time, (X_loop, y_loop) = _time(lambda: _transform_samples_loop(*args), repeats)
+    batch_time, (X_batch, y_batch) = _time(lambda: transform_samples(*args), repeats)
+
+    assert X_loop.dtype == X_batch.dtype and np.array_equal(X_loop, X_batch), "X differs from the reference encoder"
+    assert y_loop.dtype == y_batch.dtype and np.array_equal(y_loop, y_batch), "y differs from the reference encoder"
+    print(f"transform_samples: {len(df)} events, {len(X_batch)} samples, {X_batch.shape[1]} features")
+    print(f"loop: {loop_time:.3f}s, batched: {batch_time:.3f}s, speedup: {loop_time / batch_time:.1f}x")
+    print("--------------------------------------------------------------------------------------------------")
+
+
+def _matrix_bytes(X):
+    if hasattr(X, "indptr"):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def benchmark_sparse_encoding(num_cases=5000, num_activities=300, prefix_length=3, repeats=3):
+    categorical_attributes = ["gender"]
+    numerical_attributes = ["age", "time_delta"]
+    df = generate_benchmark_df(num_cases=num_cases, num_activities=num_activities)
+    encoders = _fit_encoders(df, categorical_attributes, numerical_attributes)
+    args = (df, *encoders, categorical_attributes, numerical_attributes, prefix_length)
+
+    dense_time, (X_dense, _) = _time(lambda: transform_samples(*args), repeats)
+    sparse_time, (X_sparse, _) = _time(lambda: transform_samples(*args, sparse_output=True), repeats)
+
+    assert np.array_equal(X_sparse.toarray(), X_dense), "sparse X differs from the dense encoding"
+    dense_mb, sparse_mb = _matrix_bytes(X_dense) / 2**20, _matrix_bytes(X_sparse) / 2**20
+    print(f"sparse encoding: {X_dense.shape[0]} samples, {X_dense.shape[1]} features, {num_activities} activities")
+    print(f"dense: {dense_mb:.1f} MB in {dense_time:.3f}s, csr: {sparse_mb:.1f} MB in {sparse_time:.3f}s, "
+          f"memory reduction: {dense_mb / sparse_mb:.1f}x")
+    print("--------------------------------------------------------------------------------------------------")
+
+
+def _get_fairness_metrics_loop(y, protected_attribute, event_index, feature_name, numerical_thresholds):
+    """Reference metrics of one (feature, event, model) combination (the implementation utils used to have)."""
+    if y.ndim == 2:
+        y = np.argmax(y, axis=1)
+    y_binary = np.zeros_like(y)
+    y_binary[y == event_index] = 1
+    if np.sum(y_binary == 1) < 1:
+        return 0, 1
+    if feature_name in numerical_thresholds:
+        threshold = numerical_thresholds[feature_name]
+        unprivileged_mask = protected_attribute <= threshold
+        privileged_mask = protected_attribute > threshold
+    else:
+        unprivileged_mask = protected_attribute == 0
+        privileged_mask = protected_attribute == 1
+    selection_rate_unprivileged = np.mean(y_binary[unprivileged_mask]) if np.any(unprivileged_mask) else 0
+    selection_rate_privileged = np.mean(y_binary[privileged_mask]) if np.any(privileged_mask) else 0
+    if selection_rate_privileged == 0:
+        disp_impact = float("inf") if selection_rate_unprivileged != 0 else 0
+    else:
+        disp_impact = selection_rate_unprivileged / selection_rate_privileged
+    return abs(selection_rate_unprivileged - selection_rate_privileged), disp_impact
+
+
+def _comparable_fairness_loop(predictions, X, critical_decisions, feature_indices, class_names, feature_names, numerical_thresholds):
+    """Reference fairness evaluation, masking and argmaxing once per (decision, feature, event, model)."""
+    stat_par_results, disp_imp_results = {}, {}
+    for decision in critical_decisions:
+        previous = decision.previous if isinstance(decision.previous, list) else [decision.previous]
+        previous_indices = [feature_names.index("-1. Event = " + prev) for prev in previous]
+        for attribute in decision.attributes:
+            for feature_index in feature_indices.get(attribute, []):
+                for event in decision.possible_events:
+                    outer_key = (feature_names[feature_index], event)
+                    stat_par_results[outer_key], disp_imp_results[outer_key] = {}, {}
+                    for name, y in predictions.items():
+                        event_index = class_names.index(event)
+                        filter_mask = np.any(X[:, previous_indices] == 1, axis=1)
+                        X_filtered = X[filter_mask]
+                        stat_par, disp_imp = _get_fairness_metrics_loop(y[filter_mask], X_filtered[:, feature_index], event_index,
+                                                                        feature_names[feature_index], numerical_thresholds)
+                        stat_par_results[outer_key][name] = stat_par
+                        disp_imp_results[outer_key][name] = disp_imp
+    return stat_par_results, disp_imp_results
+
+
+def benchmark_fairness(num_cases=5000, prefix_length=3, repeats=3, num_models=3, seed=0):
+    categorical_attributes = ["gender"]
+    numerical_attributes = ["age", "time_delta"]
+    df = generate_benchmark_df(num_cases=num_cases)
+    encoders = _fit_encoders(df, categorical_attributes, numerical_attributes)
+    X, _ = transform_samples(df, *encoders, categorical_attributes, numerical_attributes, prefix_length)
+    class_names = sorted(df["activity"].unique().tolist() + ["<PAD>"])
+    attribute_pools = create_attribute_pools(df, categorical_attributes)
+    feature_names = create_feature_names(class_names, attribute_pools, numerical_attributes, prefix_length)
+    feature_indices = create_feature_indices(class_names, attribute_pools, numerical_attributes, prefix_length)
+    critical_decisions = [
+        Decision(attributes=["gender"], possible_events=[f"activity {i}" for i in range(1, 6)], previous=["activity 0", "activity 7"]),
+        Decision(attributes=["age"], possible_events=["activity 8", "activity 9"], previous="activity 6"),
+        Decision(attributes=["gender", "age"], possible_events=["activity 10"], previous=["activity 11", "activity 12", "<PAD>"]),
+    ]
+    numerical_thresholds = {"age": 0.5}
+    rng = np.random.default_rng(seed)
+    predictions = {f"model {m}": rng.dirichlet(np.ones(len(class_names)), size=X.shape[0]) for m in range(num_models)}
+    args = (predictions, X, critical_decisions, feature_indices, class_names, feature_names, numerical_thresholds)
+
+    with redirect_stdout(io.StringIO()):
+        loop_time, loop_results = _time(lambda: _comparable_fairness_loop(*args), repeats)
+        batch_time, batch_results = _time(lambda: fairness_metrics(*args), repeats)
+
+    assert loop_results == batch_results, "fairness metrics differ from the reference implementation"
+    print(f"fairness: {X.shape[0]} samples, {len(loop_results[0])} (feature, event) pairs, {num_models} models")
+    print(f"loop: {loop_time:.3f}s, batched: {batch_time:.3f}s, speedup: {loop_time / batch_time:.1f}x")
+    print("--------------------------------------------------------------------------------------------------")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_cases', type=int, default=5000, help='Number of cases to generate (default: 5000)')
+    parser.add_argument('--prefix_length', type=int, default=3, help='Value for n-gram (default: 3)')
+    parser.add_argument('--repeats', type=int, default=3, help='Repetitions per measurement (default: 3)')
+    parser.add_argument('--num_activities', type=int, default=300, help='Activities for the sparse encoding benchmark (default: 300)')
+    args = parser.parse_args()
+
+    benchmark_transform_samples(num_cases=args.num_cases, prefix_length=args.prefix_length, repeats=args.repeats)
+    benchmark_sparse_encoding(num_cases=args.num_cases, num_activities=args.num_activities,
+                              prefix_length=args.prefix_length, repeats=args.repeats)
+    benchmark_fairness(num_cases=args.num_cases, prefix_length=args.prefix_length, repeats=args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,21 @@ import os
 import pickle
 import numpy as np
 import pandas as pd
-import pm4py
 
 from typing import List
-from sklearn.preprocessing import OneHotEncoder, MinMaxScaler
-from sklearn.model_selection import KFold, train_test_split
-from trace_generator import Case, TraceGenerator
+from trace_generator import Case, SimulatedLog, TraceGenerator
 from tqdm import tqdm 
-from plotting import plot_attributes
+from session_cache import session_cache
+from xes_io import stream_xes_to_parquet, read_event_log, write_xes
+from artifacts import register_artifact
 
-from scipy.stats import norm, truncnorm
+from scipy import sparse
+# pm4py, sklearn, scipy.stats and plotting are imported in the functions that use them, the backend
+# imports this module on every worker boot and most endpoints need none of them (see startup.py)
+
+# Settings
+EVENT_LOG_FILE = "event_log.parquet"
+LEGACY_EVENT_LOG_FILE = "event_log_df.pkl"
 
 def load_data(folder_name, file_name):
     file_path = os.path.join('data', folder_name, file_name)
@@ -25,23 +30,44 @@ def save_data(data, folder_name, file_name):
     file_path = os.path.join(full_path, file_name)
     with open(file_path, 'wb') as file:
         pickle.dump(data, file)
+    session_cache.invalidate(folder_name, file_name)
 
 def load_csv_to_df(file_name):
     file_path = os.path.join('raw_data', file_name)
     return pd.read_csv(file_path)
 
-def load_xes_to_df(file_name, folder_name, num_cases=None):
+def ingest_xes(file_name, folder_name, num_cases=None):
+    """
+    Streams data/<folder_name>/<file_name> into data/<folder_name>/event_log.parquet with bounded memory
+    and returns the summary (num_cases, num_events, columns) without loading the log.
+    """
     file_path = os.path.join("data", folder_name, file_name)
-    df = pm4py.read_xes(file_path)
-    df.rename(columns={'case:concept:name': 'case_id', 'concept:name': 'activity'}, inplace=True)
-    columns = ['case_id', 'activity'] + [col for col in df.columns if col not in ['case_id', 'activity']]
-    df = df[columns]
-    df = df.loc[:, ~df.columns.duplicated()]
-    if num_cases:
-        df = df[df['case_id'].isin(df['case_id'].unique()[-num_cases:])]
-    df = process_df_timestamps(df)
-    if folder_name:
-        save_data(df, folder_name, "event_log_df.pkl")
+    summary = stream_xes_to_parquet(file_path, os.path.join("data", folder_name, EVENT_LOG_FILE), num_cases=num_cases)
+    register_artifact(folder_name, "event_log", EVENT_LOG_FILE, "dataframe",
+                      [summary["num_events"], len(summary["columns"])], "parquet")
+    # load_event_log prefers the parquet log, a pickled log from an earlier upload is stale
+    legacy_path = os.path.join("data", folder_name, LEGACY_EVENT_LOG_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    session_cache.invalidate(folder_name, EVENT_LOG_FILE)
+    session_cache.invalidate(folder_name, LEGACY_EVENT_LOG_FILE)
+    return summary
+
+def load_event_log(folder_name):
+    """Loads the event log of a folder, the parquet log written by ingest_xes or a pickled event_log_df.pkl."""
+    parquet_path = os.path.join("data", folder_name, EVENT_LOG_FILE)
+    if not os.path.exists(parquet_path):
+        return load_data(folder_name, LEGACY_EVENT_LOG_FILE)
+    df = read_event_log(parquet_path)
+    # sorted categories, so groupby/factorize order cases and activities like the old object columns
+    for column in ["case_id", "activity"]:
+        categories = df[column].cat.remove_unused_categories().cat.categories
+        df[column] = df[column].cat.set_categories(sorted(categories))
+    return df
+
+def load_xes_to_df(file_name, folder_name, num_cases=None):
+    ingest_xes(file_name, folder_name, num_cases=num_cases)
+    df = load_event_log(folder_name)
     pd.set_option('display.max_columns', None)  # Display all columns
     print(df.head(20))
     return df
@@ -49,15 +75,14 @@ def load_xes_to_df(file_name, folder_name, num_cases=None):
 def generate_processed_data(process_model, categorical_attributes=[], numerical_attributes=[], num_cases=1000, prefix_length=3, folder_name=None):
     print("generating event traces:")
     trace_generator = TraceGenerator(process_model=process_model)
-    cases = trace_generator.generate_traces(num_cases=num_cases)
+    df = simulated_log_to_dataframe(trace_generator.simulate(num_cases=num_cases))
     print("example trace:")
-    print(cases[:1])
+    print(df[df['case_id'] == df['case_id'].iloc[0]])
     print("event pool:")
     print(trace_generator.get_events())
     print("--------------------------------------------------------------------------------------------------")
 
     print("processing nn data:")
-    df = cases_to_dataframe(cases)
     save_data(df, folder_name, "df.pkl")
     
     X, y, class_names, feature_names, feature_indices = process_df(df, categorical_attributes, numerical_attributes, prefix_length=prefix_length)
@@ -116,7 +141,7 @@ def process_df_timestamps(df):
     print(time_column)
     df[time_column] = pd.to_datetime(df[time_column])
     df = df.sort_values(by=['case_id', time_column]).reset_index(drop=True)
-    df['time_delta'] = df.groupby('case_id')[time_column].diff().dt.total_seconds()
+    df['time_delta'] = df.groupby('case_id', observed=True)[time_column].diff().dt.total_seconds()
     df['time_delta'] = df['time_delta'].fillna(0)  # Set time_delta to 0 for the first event in each case
     df['time_of_day'] = df[time_column].dt.hour / 24 + df[time_column].dt.minute / 1440 + df[time_column].dt.second / 86400
     df['day_of_week'] = df[time_column].dt.dayofweek  # Monday=0, Sunday=6
@@ -127,60 +152,32 @@ def cases_to_dataframe(cases: List[Case]) -> pd.DataFrame:
     Converts a list of Case objects into a pandas DataFrame with columns:
     'case_id', 'activity', and one column for each case attribute (categorical and numerical).
     """
-    rows = []
-    for case in cases:
-        for event in case.events:
-            row = {
-                'case_id': case.case_id,
-                'activity': event.activity,
-                'time': event.timestamp
-            }
-            row.update(case.categorical_attributes)
-            row.update(case.numerical_attributes)
-            rows.append(row)
-    
-    df = pd.DataFrame(rows)
-    df_to_xes(df)
+    lengths = np.array([len(case.events) for case in cases], dtype=np.int64)
+    case_rows = np.repeat(np.arange(len(cases)), lengths)
+    columns = {
+        'case_id': np.array([case.case_id for case in cases])[case_rows],
+        'activity': [event.activity for case in cases for event in case.events],
+        'time': pd.to_datetime([event.timestamp for case in cases for event in case.events]),
+    }
+    # one value per case, repeated for its events (numerical attributes win on name clashes like before)
+    attributes = dict.fromkeys(attr for case in cases for attr in [*case.categorical_attributes, *case.numerical_attributes])
+    for attr in attributes:
+        values = [case.numerical_attributes.get(attr, case.categorical_attributes.get(attr, np.nan)) for case in cases]
+        columns[attr] = pd.Series(values).to_numpy()[case_rows]
+    df = pd.DataFrame(columns)
     df = process_df_timestamps(df)
     return df
 
-def df_to_xes(df: pd.DataFrame):
-    import pandas as pd
-    from pm4py.objects.log.obj import EventLog, Trace, Event
-    from pm4py.objects.log.exporter.xes import exporter as xes_exporter
+def simulated_log_to_dataframe(log: SimulatedLog) -> pd.DataFrame:
+    """Event log dataframe of a TraceGenerator.simulate result, without going through Case objects."""
+    return process_df_timestamps(log.to_dataframe())
+
+def df_to_xes(df: pd.DataFrame, file_path="cancer_screening.xes"):
     """
     Converts a pandas DataFrame to an XES file format and saves it.
     """
-    log = EventLog()
-
-    # Get the list of extra columns excluding the standard ones
-    standard_cols = {'case_id', 'activity', 'time'}
-    extra_cols = [col for col in df.columns if col not in standard_cols]
-
-    # Group by case_id to create traces
-    for case_id, group in df.groupby('case_id'):
-        trace = Trace()
-        trace.attributes["concept:name"] = case_id
-        
-        # Sort events by time within the case
-        group = group.sort_values(by='time')
-        
-        for _, row in group.iterrows():
-            event = Event()
-            event["concept:name"] = row['activity']
-            event["time:timestamp"] = row['time']
-            
-            # Add additional categorical and numerical attributes to event
-            for col in extra_cols:
-                event[col] = row[col]
-            
-            trace.append(event)
-            
-        log.append(trace)
-
-    # Export to XES file
-    xes_exporter.apply(log, "cancer_screening.xes")
-    print("XES log saved to 'output_log.xes'")
+    write_xes(df, file_path)
+    print(f"XES log saved to '{file_path}'")
 
 def process_df(df, categorical_attributes, numerical_attributes, prefix_length=3):
     """Processes dataframe data for neural network training"""
@@ -203,19 +200,19 @@ def process_df(df, categorical_attributes, numerical_attributes, prefix_length=3
     print(f"feature_names: {feature_names}")
     print(f"feature_indices: {feature_indices}")
 
+    from sklearn.preprocessing import OneHotEncoder, MinMaxScaler
+
     # one-hot encode activities
     activity_encoder = OneHotEncoder(sparse_output=False, handle_unknown="ignore", categories=[class_names])
-    activity_ohe = activity_encoder.fit_transform(df[['activity']])
-    pad_activity_idx = activity_encoder.categories_[0].tolist().index("<PAD>")
+    activity_encoder.fit(df[['activity']])
     
     # one-hot encode categorical case attributes dynamically
     attribute_encoders = {}
-    attributes_ohe_dict = {}
     for attr in categorical_attributes:
         print(attr)
         print(attribute_pools[attr])
         encoder = OneHotEncoder(sparse_output=False, handle_unknown="ignore", categories=[attribute_pools[attr]])
-        attributes_ohe_dict[attr] = encoder.fit_transform(df[[attr]])
+        encoder.fit(df[[attr]])
         attribute_encoders[attr] = encoder
 
     # Scale numerical attributes between 0 and 1 based on training data's min/max values
@@ -225,60 +222,11 @@ def process_df(df, categorical_attributes, numerical_attributes, prefix_length=3
         scaler.fit(df[[attr]])
         numerical_scalers[attr] = scaler
 
-    # group by case_id and create sequences
-    grouped = df.groupby('case_id')
-    cases = []
-    for case_id, group in tqdm(grouped, desc="preparing cases"):
-        activities = activity_encoder.transform(group[['activity']])
-        attributes = {attr: attribute_encoders[attr].transform(group[[attr]]) for attr in categorical_attributes}
-        # Scale numerical attributes within the group
-        for attr in numerical_attributes:
-            group[attr] = numerical_scalers[attr].transform(group[[attr]])
-        cases.append((activities, attributes, group[numerical_attributes].values))
-    pd.set_option('display.max_columns', None)  # Display all columns
-    print(grouped.head(20))
-
     # Generate n-grams with padding
-    X, y = [], []
-    pad_activity = activity_encoder.transform([["<PAD>"]])  # Get one-hot for <PAD>
-    pad_attributes = {attr: np.zeros((1, attributes_ohe_dict[attr].shape[1])) for attr in categorical_attributes}
-    pad_numerical = np.zeros((1, len(numerical_attributes)))  # Padding for numerical features
-
-    for activities, attributes, numerical in tqdm(cases, desc="encoding cases"):
-        # Pad activities
-        padded_activities = np.vstack([pad_activity] * prefix_length + [activities])
-        
-        # Pad categorical attributes
-        padded_attributes = {attr: np.vstack([pad_attributes[attr]] * prefix_length + [attributes[attr]])
-                            for attr in sorted(attributes)}
-
-        # Pad numerical attributes
-        padded_numerical = np.vstack([pad_numerical] * prefix_length + [numerical])
-
-        for i in range(len(activities)):  # Start from 0 and include all real activities
-            x_activities = padded_activities[i:i + prefix_length]
-            if categorical_attributes:
-                x_attributes = np.hstack([
-                    padded_attributes[attr][i + prefix_length] 
-                    for attr in categorical_attributes
-                ])
-            else:
-                x_attributes = np.array([])
-
-            if numerical_attributes:
-                x_numerical = padded_numerical[i + prefix_length]
-            else:
-                x_numerical = np.array([])
-
-            x_combined = np.hstack([x_activities.flatten(), x_attributes, x_numerical])  # Combine activities, attributes, and numerical features
-            
-            y_next_activity = activities[i]  # Predict the actual next activity
-            X.append(x_combined)
-            y.append(y_next_activity)
-    
-    # Convert to numpy arrays
-    X = np.array(X)
-    y = np.array(y)
+    X, y = encode_prefix_windows(
+        df, activity_encoder, attribute_encoders, numerical_scalers,
+        categorical_attributes, numerical_attributes, prefix_length
+    )
 
     n = 10
     print("example nn inputs:")
@@ -288,61 +236,106 @@ def process_df(df, categorical_attributes, numerical_attributes, prefix_length=3
 
     return X, y, class_names, feature_names, feature_indices
 
-def enrich_df(df: pd.DataFrame, rules: list, folder_name: str):
-    def generate_value(distribution, rng):
-        """Generates a value based on the specified distribution."""
-        if distribution['type'] == 'discrete':
-            values, weights = zip(*distribution['values'])
-            return rng.choice(values, p=np.array(weights) / sum(weights))
-        elif distribution['type'] == 'normal':
-            mean, std = distribution['mean'], distribution['std']
-            a, b = distribution.get('min', -np.inf), distribution.get('max', np.inf)
-
-            if np.isinf(a) and np.isinf(b):
-                return norm.rvs(loc=mean, scale=std, random_state=rng)
-            else:
-                # Scale the bounds relative to the mean and standard deviation
-                a, b = (a - mean) / std, (b - mean) / std
-                return truncnorm.rvs(a, b, loc=mean, scale=std, random_state=rng)
+def _sample_distribution(distribution, rng, size):
+    """Draws size values of a rule distribution in one call."""
+    from scipy.stats import norm, truncnorm
+    if distribution['type'] == 'discrete':
+        values, weights = zip(*distribution['values'])
+        return rng.choice(values, size=size, p=np.array(weights) / sum(weights))
+    elif distribution['type'] == 'normal':
+        mean, std = distribution['mean'], distribution['std']
+        a, b = distribution.get('min', -np.inf), distribution.get('max', np.inf)
+
+        if np.isinf(a) and np.isinf(b):
+            return norm.rvs(loc=mean, scale=std, size=size, random_state=rng)
         else:
-            raise ValueError("Unsupported distribution type.")
-
-    rng = np.random.default_rng()
-
-    # Identify unique cases in the log
-    case_ids = df['case_id'].unique()
-
-    # Initialize a dictionary to hold the generated attributes for each case
-    case_attributes = {rule['attribute']: {} for rule in rules}
+            # Scale the bounds relative to the mean and standard deviation
+            a, b = (a - mean) / std, (b - mean) / std
+            return truncnorm.rvs(a, b, loc=mean, scale=std, size=size, random_state=rng)
+    else:
+        raise ValueError("Unsupported distribution type.")
 
-    for case_id in tqdm(case_ids, desc="enriching cases"):
-        # Extract events for the current case
-        case_events = df[df['case_id'] == case_id]['activity'].tolist()
+def match_subsequences(case_codes, activity_codes, num_activities, subsequences):
+    """
+    Finds the cases that contain each subsequence as consecutive activities. case_codes and
+    activity_codes are integer codes of the events, sorted by case and in log order within a case,
+    subsequences are lists of activity codes (None for activities that don't occur in the log).
+    Every window length is hashed once (base num_activities) and all subsequences of that length are
+    looked up together. Returns one sorted array of matching case codes per subsequence.
+    """
+    num_events = len(activity_codes)
+    all_cases = np.unique(case_codes)
+    matches = [np.empty(0, dtype=np.int64) for _ in subsequences]
+
+    by_length = {}
+    for index, subsequence in enumerate(subsequences):
+        if len(subsequence) == 0:
+            matches[index] = all_cases  # the empty sequence is part of every case
+        elif None not in subsequence and len(subsequence) <= num_events:
+            by_length.setdefault(len(subsequence), []).append(index)
+
+    for length, indices in by_length.items():
+        windows = np.lib.stride_tricks.sliding_window_view(activity_codes, length)
+        window_cases = case_codes[:len(windows)]
+        inside = window_cases == case_codes[length - 1:]  # windows that don't cross a case boundary
+
+        if float(num_activities) ** length >= 2 ** 63:
+            # hashes would overflow int64, compare the windows directly
+            for index in indices:
+                hit = inside & np.all(windows == subsequences[index], axis=1)
+                matches[index] = np.unique(window_cases[hit])
+            continue
+
+        weights = num_activities ** np.arange(length - 1, -1, -1, dtype=np.int64)
+        hashes = windows @ weights
+        targets = np.array([np.dot(subsequences[index], weights) for index in indices], dtype=np.int64)
+        unique_targets = np.unique(targets)
+        position = np.searchsorted(unique_targets, hashes).clip(max=len(unique_targets) - 1)
+        hit = inside & (unique_targets[position] == hashes)
+        hit_targets, hit_cases = position[hit], window_cases[hit]
+        for index, target in zip(indices, targets):
+            matches[index] = np.unique(hit_cases[hit_targets == np.searchsorted(unique_targets, target)])
+
+    return matches
+
+def enrich_df(df: pd.DataFrame, rules: list, folder_name: str, seed=None):
+    """
+    Adds the attributes of the rules to the cases that contain the rule's subsequence (later rules
+    overwrite earlier ones for the same attribute). The log is integer coded and grouped once, values
+    are drawn per rule for all matched cases at once.
+    """
+    rng = np.random.default_rng(seed)
 
-        for rule in rules:
-            subsequence = rule['subsequence']
-            attribute = rule['attribute']
-            distribution = rule['distribution']
+    # integer-code cases and activities once, events grouped by case in log order
+    case_codes, case_ids = pd.factorize(df['case_id'])
+    activity_codes, activities = pd.factorize(df['activity'])
+    order = np.argsort(case_codes, kind='stable')
+    order = order[case_codes[order] >= 0]
+    activity_lookup = {activity: code for code, activity in enumerate(activities)}
+    # missing activities get their own code, so they never match and never extend a match
+    sequence_codes = np.where(activity_codes < 0, len(activities), activity_codes)[order].astype(np.int64)
 
-            # Check if the subsequence is present in the case's events
-            if any(
-                case_events[i:i + len(subsequence)] == subsequence
-                for i in range(len(case_events) - len(subsequence) + 1)
-            ):
-                # Generate a value based on the distribution
-                case_attributes[attribute][case_id] = generate_value(distribution, rng)
-                #print(f"Matched: {subsequence} to {case_attributes[attribute][case_id]}")
+    subsequences = [[activity_lookup.get(activity) for activity in rule['subsequence']] for rule in rules]
+    matches = match_subsequences(case_codes[order], sequence_codes, len(activities) + 1, subsequences)
 
     # Add generated attributes as new columns to the DataFrame
+    case_attributes = {rule['attribute']: np.full(len(case_ids), np.nan, dtype=object) for rule in rules}
+    for rule, matched_cases in tqdm(zip(rules, matches), total=len(rules), desc="enriching cases"):
+        if len(matched_cases):
+            case_attributes[rule['attribute']][matched_cases] = _sample_distribution(rule['distribution'], rng, len(matched_cases))
+
     for attribute, values in case_attributes.items():
-        df[attribute] = df['case_id'].map(values)
+        row_values = np.full(len(df), np.nan, dtype=object)
+        row_values[case_codes >= 0] = values[case_codes[case_codes >= 0]]
+        df[attribute] = pd.Series(row_values, index=df.index).infer_objects()
     
     # plot these for evaluation of the success
-    #plot_attributes(df, rules, folder_name)
+    #from plotting import plot_attributes; plot_attributes(df, rules, folder_name)
 
     return df
 
 def mine_bpm(file_name, folder_name):
+    import pm4py
     print("Mining BPM...")
     pd.set_option('display.max_columns', None)
     file_path = os.path.join("raw_data", file_name)
@@ -360,7 +353,8 @@ def mine_bpm(file_name, folder_name):
         pm4py.save_vis_dfg(dfg, start_activities, end_activities, os.path.join(output_dir, f"dfg_{variant}.png"), format='png')
     print("--------------------------------------------------------------------------------------------------")
 
-def _prepare_data_splits(train_df, test_df, categorical_attributes, numerical_attributes, critical_decisions=[], prefix_length=3):
+def _prepare_data_splits(train_df, test_df, categorical_attributes, numerical_attributes, critical_decisions=[], prefix_length=3, sparse_output=False):
+    from sklearn.preprocessing import OneHotEncoder, MinMaxScaler
     numerical_thresholds = {}
 
     # Sort attributes consistently
@@ -388,11 +382,11 @@ def _prepare_data_splits(train_df, test_df, categorical_attributes, numerical_at
     # Transform train and test data
     X_train, y_train = transform_samples(
         train_df, activity_encoder, attribute_encoders, numerical_scalers,
-        categorical_attributes, numerical_attributes, prefix_length
+        categorical_attributes, numerical_attributes, prefix_length, sparse_output=sparse_output
     )
     X_test, y_test = transform_samples(
         test_df, activity_encoder, attribute_encoders, numerical_scalers,
-        categorical_attributes, numerical_attributes, prefix_length, train=False
+        categorical_attributes, numerical_attributes, prefix_length, train=False, sparse_output=sparse_output
     )
     
     # Compute thresholds for numerical attributes from critical decisions
@@ -405,26 +399,30 @@ def _prepare_data_splits(train_df, test_df, categorical_attributes, numerical_at
 
     return X_train, y_train, X_test, y_test, numerical_thresholds
 
-def k_fold_cross_validation(df, categorical_attributes, numerical_attributes, critical_decisions, prefix_length=3, k=10):
-    grouped = df.groupby('case_id')
+def k_fold_case_splits(df, k=10):
+    """(train case ids, test case ids) of every fold, the same splits k_fold_cross_validation encodes."""
+    from sklearn.model_selection import KFold
+    grouped = df.groupby('case_id', observed=True)
     case_ids = list(grouped.groups.keys())
     kf = KFold(n_splits=k, shuffle=True, random_state=0)
-    
-    for fold, (train_idx, test_idx) in enumerate(kf.split(case_ids)):
+    return [([case_ids[i] for i in train_idx], [case_ids[i] for i in test_idx]) for train_idx, test_idx in kf.split(case_ids)]
+
+def encode_fold(df, train_case_ids, test_case_ids, categorical_attributes, numerical_attributes, critical_decisions, prefix_length=3, sparse_output=False):
+    train_df = df[df['case_id'].isin(train_case_ids)]
+    test_df = df[df['case_id'].isin(test_case_ids)]
+    return _prepare_data_splits(
+        train_df, test_df, categorical_attributes, numerical_attributes, critical_decisions, prefix_length, sparse_output
+    )
+
+def k_fold_cross_validation(df, categorical_attributes, numerical_attributes, critical_decisions, prefix_length=3, k=10, sparse_output=False):
+    for fold, (train_case_ids, test_case_ids) in enumerate(k_fold_case_splits(df, k)):
         print(f"Processing fold {fold + 1}/{k}")
-        train_case_ids = [case_ids[i] for i in train_idx]
-        test_case_ids = [case_ids[i] for i in test_idx]
-        
-        train_df = df[df['case_id'].isin(train_case_ids)]
-        test_df = df[df['case_id'].isin(test_case_ids)]
-        
-        yield _prepare_data_splits(
-            train_df, test_df, categorical_attributes, numerical_attributes, critical_decisions, prefix_length
-        )
-
-def train_test_split_encoding(df, categorical_attributes, numerical_attributes, test_size=0.3, prefix_length=3, shuffle=False):
+        yield encode_fold(df, train_case_ids, test_case_ids, categorical_attributes, numerical_attributes, critical_decisions, prefix_length, sparse_output)
+
+def train_test_split_encoding(df, categorical_attributes, numerical_attributes, test_size=0.3, prefix_length=3, shuffle=False, sparse_output=False):
+    from sklearn.model_selection import train_test_split
     # Group by case_id for splitting
-    grouped = df.groupby('case_id')
+    grouped = df.groupby('case_id', observed=True)
     case_ids = list(grouped.groups.keys())
     
     train_ids, test_ids = train_test_split(case_ids, test_size=test_size, random_state=0, shuffle=shuffle)
@@ -433,57 +431,94 @@ def train_test_split_encoding(df, categorical_attributes, numerical_attributes,
     test_df = df[df['case_id'].isin(test_ids)]
     
     X_train, y_train, X_test, y_test, _ = _prepare_data_splits(
-        train_df, test_df, categorical_attributes, numerical_attributes, prefix_length=prefix_length
+        train_df, test_df, categorical_attributes, numerical_attributes, prefix_length=prefix_length, sparse_output=sparse_output
     )
     return X_train, y_train, X_test, y_test
 
 def transform_samples(df, activity_encoder, attribute_encoders, numerical_scalers,
-                  categorical_attributes, numerical_attributes, prefix_length, train=True):
+                  categorical_attributes, numerical_attributes, prefix_length, train=True, dtype=np.float64, sparse_output=False):
     """
     Generate n-gram sequences from the dataset.
     """
-    grouped = df.groupby('case_id')
-    cases = []
-
-    # Prepare data for each case
-    for case_id, group in tqdm(grouped, desc="Preparing train cases" if train else "Processing test cases"):
-        activities = activity_encoder.transform(group[['activity']])
-        attributes = {attr: attribute_encoders[attr].transform(group[[attr]]) for attr in categorical_attributes}
-        
-        # Scale numerical attributes
+    print("Encoding train cases" if train else "Encoding test cases")
+    return encode_prefix_windows(
+        df, activity_encoder, attribute_encoders, numerical_scalers,
+        categorical_attributes, numerical_attributes, prefix_length, dtype=dtype, sparse_output=sparse_output
+    )
+
+def encode_prefix_windows(df, activity_encoder, attribute_encoders, numerical_scalers,
+                          categorical_attributes, numerical_attributes, prefix_length, dtype=np.float64, sparse_output=False):
+    """
+    Batched prefix-window encoder. Builds the whole X/y matrices at once instead of
+    stacking one sample per event, the output is identical to the per-case loop
+    (cases in sorted case_id order, events in log order within a case).
+    With sparse_output X is a CSR matrix holding only the non-zero entries, y stays dense.
+    """
+    class_names = activity_encoder.categories_[0]
+    num_classes = len(class_names)
+    pad_idx = class_names.tolist().index("<PAD>")
+    attribute_widths = [len(attribute_encoders[attr].categories_[0]) for attr in categorical_attributes]
+    num_features = prefix_length * num_classes + sum(attribute_widths) + len(numerical_attributes)
+
+    # order rows like groupby('case_id'): sorted cases, stable within a case
+    case_codes, _ = pd.factorize(df['case_id'], sort=True)
+    keep = np.flatnonzero(case_codes >= 0)
+    order = keep[np.argsort(case_codes[keep], kind='stable')]
+    case_codes = case_codes[order]
+    num_samples = len(order)
+
+    y = np.zeros((num_samples, num_classes), dtype=dtype)
+    if sparse_output:
+        # collect (row, column, value) triplets and build the CSR matrix once at the end
+        entries = []
+        def put(rows, columns, values):
+            entries.append((rows, columns, np.broadcast_to(np.asarray(values, dtype=dtype), rows.shape)))
+    else:
+        X = np.zeros((num_samples, num_features), dtype=dtype)
+        def put(rows, columns, values):
+            X[rows, columns] = values
+
+    if num_samples > 0:
+        # integer-code activities once, unknown activities become -1 (all-zero one-hot)
+        activity_codes = pd.Categorical(df['activity'].to_numpy()[order], categories=class_names).codes.astype(np.int64)
+
+        # insert prefix_length <PAD> codes in front of every case and take sliding windows
+        case_index = np.cumsum(np.r_[0, case_codes[1:] != case_codes[:-1]])
+        padded_positions = np.arange(num_samples) + (case_index + 1) * prefix_length
+        padded_codes = np.full(num_samples + (case_index[-1] + 1) * prefix_length, pad_idx, dtype=np.int64)
+        padded_codes[padded_positions] = activity_codes
+        windows = np.lib.stride_tricks.sliding_window_view(padded_codes, prefix_length)[padded_positions - prefix_length]
+
+        # scatter the one-hot values into the preallocated matrices
+        rows = np.arange(num_samples)
+        for step in range(prefix_length):
+            codes = windows[:, step]
+            valid = codes >= 0
+            put(rows[valid], step * num_classes + codes[valid], 1)
+        valid = activity_codes >= 0
+        y[rows[valid], activity_codes[valid]] = 1
+
+        offset = prefix_length * num_classes
+        for attr, width in zip(categorical_attributes, attribute_widths):
+            categories = attribute_encoders[attr].categories_[0]
+            codes = pd.Categorical(df[attr].to_numpy()[order], categories=categories).codes.astype(np.int64)
+            valid = codes >= 0
+            put(rows[valid], offset + codes[valid], 1)
+            offset += width
+
         for attr in numerical_attributes:
-            group[attr] = numerical_scalers[attr].transform(group[[attr]])
-        cases.append((activities, attributes, group[numerical_attributes].values))
-    
-    # Generate n-grams with padding
-    X, y = [], []
-    pad_activity = activity_encoder.transform([["<PAD>"]])
-    pad_attributes = {attr: np.zeros((1, enc.categories_[0].shape[0])) for attr, enc in attribute_encoders.items()}
-    pad_numerical = np.zeros((1, len(numerical_attributes)))
-
-    for activities, attributes, numerical in cases:
-        padded_activities = np.vstack([pad_activity] * prefix_length + [activities])
-        padded_attributes = {attr: np.vstack([pad_attributes[attr]] * prefix_length + [attributes[attr]])
-                             for attr in sorted(attributes)}
-        padded_numerical = np.vstack([pad_numerical] * prefix_length + [numerical])
-
-        for i in range(len(activities)):
-            x_activities = padded_activities[i:i + prefix_length]
-
-            if categorical_attributes:
-                x_attributes = np.hstack([padded_attributes[attr][i + prefix_length] for attr in categorical_attributes])
-            else:
-                x_attributes = np.array([])
-
-            if numerical_attributes:
-                x_numerical = padded_numerical[i + prefix_length]
-            else:
-                x_numerical = np.array([])
-
-            x_combined = np.hstack([x_activities.flatten(), x_attributes, x_numerical])
-            y_next_activity = activities[i]
-            
-            X.append(x_combined)
-            y.append(y_next_activity)
-    
-    return np.array(X), np.array(y)
+            values = numerical_scalers[attr].transform(df[[attr]])[order, 0]
+            nonzero = values != 0
+            put(rows[nonzero], np.full(nonzero.sum(), offset), values[nonzero])
+            offset += 1
+
+    if not sparse_output:
+        return X, y
+    if entries:
+        rows, columns, values = (np.concatenate(parts) for parts in zip(*entries))
+    else:
+        rows, columns, values = np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, dtype)
+    X = sparse.csr_matrix((values, (rows, columns)), shape=(num_samples, num_features), dtype=dtype)
+    X.sort_indices()
+    return X, y
+
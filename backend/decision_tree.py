@@ -1,10 +1,18 @@
 from dataclasses import dataclass
 import numpy as np
+import os
 import json
 import copy
+import shutil
 
 from collections import Counter
-from sklearn.metrics import accuracy_score
+from scipy import sparse
+from session_cache import session_cache
+
+# Settings
+TREE_FORMAT = "flat_tree"
+TREE_FORMAT_VERSION = 1  # bumped whenever the arrays or meta.json of the flat tree format change
+TREE_ARRAYS = ("node_id", "feature", "threshold", "left", "right", "output", "num_samples", "depth", "removed_offsets", "removed_features")
 
 @dataclass
 class Node:
@@ -20,11 +28,188 @@ class Node:
         self.output = output                
         self.depth = depth
 
+@dataclass
+class FlatTree:
+    """Array-backed form of the Node graph, parallel arrays indexed by position like sklearn's tree_."""
+    node_id: np.ndarray
+    feature: np.ndarray
+    threshold: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    output: np.ndarray
+    num_samples: np.ndarray
+
+    def apply(self, X, rows=None):
+        """Returns the position of the leaf every sample (or every sample in rows) ends up in, walking all samples level by level."""
+        rows = np.arange(X.shape[0]) if rows is None else rows
+        positions = np.zeros(len(rows), dtype=np.int64)
+        active = np.arange(len(rows))
+        while active.size:
+            nodes = positions[active]
+            internal = self.feature[nodes] >= 0
+            active, nodes = active[internal], nodes[internal]
+            go_left = _gather(X, rows[active], self.feature[nodes]) < self.threshold[nodes]
+            positions[active] = np.where(go_left, self.left[nodes], self.right[nodes])
+        return positions
+
+    def subtree_end(self):
+        """Position after the last node of every subtree, pre-order puts a subtree in one contiguous block."""
+        end = np.arange(1, len(self.node_id) + 1)
+        for position in range(len(self.node_id) - 1, -1, -1):
+            if self.feature[position] >= 0:
+                end[position] = end[self.right[position]]
+        return end
+
+def _gather(X, rows, columns):
+    """X[rows[i], columns[i]] for every i, X may be a numpy array or a scipy sparse matrix."""
+    if sparse.issparse(X):
+        return np.asarray(X[rows, columns]).ravel()
+    return X[rows, columns]
+
+def _column(X, feature_index, rows=None):
+    """Dense values of one feature (restricted to rows)."""
+    if sparse.issparse(X):
+        X = X if rows is None else X[rows]
+        return X[:, [feature_index]].toarray().ravel()
+    return X[:, feature_index] if rows is None else X[rows, feature_index]
+
+def _csc_column(X, feature_index):
+    """Dense values of one column of a CSC matrix straight from its index arrays, None if it has no entries."""
+    start, end = X.indptr[feature_index], X.indptr[feature_index + 1]
+    if start == end:
+        return None
+    values = np.zeros(X.shape[0], dtype=X.dtype)
+    values[X.indices[start:end]] = X.data[start:end]
+    return values
+
+def _partition_rows(X, node, rows, start=0, flat=None, leaves=None):
+    """
+    Sorts rows by the leaf of the subtree at node they reach. Returns the sorted rows, the positions of
+    their leaves in the subtree's FlatTree and the (start, end) range of every node of the subtree, offset by start.
+    flat (the subtree's pre-order FlatTree) and leaves (the leaf position of every row) are computed if not given.
+    """
+    flat = flatten_tree(node) if flat is None else flat
+    leaves = flat.apply(X, rows=rows) if leaves is None else leaves
+    order = np.argsort(leaves, kind="stable")
+    # pre-order positions make every subtree a contiguous run of leaves
+    offsets = start + np.concatenate([[0], np.cumsum(np.bincount(leaves, minlength=len(flat.node_id)))])
+    subtree_end = flat.subtree_end()
+    ranges = {node_id: (int(offsets[position]), int(offsets[subtree_end[position]])) for position, node_id in enumerate(flat.node_id.tolist())}
+    return rows[order], flat.output[leaves[order]], ranges
+
+def _positions(flat, node_ids):
+    """Positions in flat of the given node ids."""
+    lookup = np.full(int(flat.node_id.max(initial=-1)) + 1, -1, dtype=np.int64)
+    lookup[flat.node_id] = np.arange(len(flat.node_id))
+    return lookup[node_ids]
+
+def _preorder_nodes(root):
+    nodes = []
+    stack = [root] if root is not None else []
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        if node.output is None:
+            stack.append(node.right)
+            stack.append(node.left)
+    return nodes
+
+def flatten_tree(root):
+    """Converts a Node graph into a FlatTree (pre-order, iterative)."""
+    return _flatten_nodes(_preorder_nodes(root))
+
+def _flatten_nodes(nodes):
+    position = {id(node): i for i, node in enumerate(nodes)}
+
+    internal = [node.output is None for node in nodes]
+    return FlatTree(
+        node_id=np.array([node.node_id for node in nodes], dtype=np.int64),
+        feature=np.array([node.feature_index if is_internal else -1 for node, is_internal in zip(nodes, internal)], dtype=np.int64),
+        threshold=np.array([node.threshold if is_internal else np.nan for node, is_internal in zip(nodes, internal)], dtype=np.float64),
+        left=np.array([position[id(node.left)] if is_internal else -1 for node, is_internal in zip(nodes, internal)], dtype=np.int64),
+        right=np.array([position[id(node.right)] if is_internal else -1 for node, is_internal in zip(nodes, internal)], dtype=np.int64),
+        output=np.array([-1 if is_internal else node.output for node, is_internal in zip(nodes, internal)], dtype=np.int64),
+        num_samples=np.array([node.num_samples for node in nodes], dtype=np.int64),
+    )
+
+class TreeEvaluation:
+    """
+    Predictions and confusion counts of a tree on a labelled sample set (the test split), kept in sync
+    with edits: samples are ordered by the leaf they reach like the training index, so an edit re-routes
+    only the rows of the edited subtree and updates the confusion matrix by the difference.
+    """
+
+    def __init__(self, tree, X, y):
+        self.X = X
+        self.y_true = np.argmax(y, axis=1) if y.ndim == 2 else np.asarray(y)
+        self.num_classes = max(y.shape[1] if y.ndim == 2 else 0, int(tree.flat.output.max()) + 1, int(self.y_true.max(initial=-1)) + 1)
+        self.order, predictions, self.ranges = _partition_rows(X, tree.root, np.arange(X.shape[0]))
+        self.y_pred = np.empty(X.shape[0], dtype=np.int64)
+        self.y_pred[self.order] = predictions
+        self.confusion = np.zeros((self.num_classes, self.num_classes), dtype=np.int64)
+        self._count(self.order, self.y_pred[self.order], 1)
+
+    def matches(self, X, y):
+        return X is self.X and X.shape[0] == len(self.y_true)
+
+    def _count(self, rows, predictions, sign):
+        cells = self.y_true[rows] * self.num_classes + predictions
+        self.confusion += sign * np.bincount(cells, minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+
+    def reroute(self, old_node, new_node):
+        """Re-routes the rows that reached old_node through the subtree now at new_node (may be the same, edited node)."""
+        sample_range = self.ranges.get(old_node.node_id)
+        stack = [old_node]
+        while stack:
+            current = stack.pop()
+            self.ranges.pop(current.node_id, None)
+            if current.output is None:
+                stack.extend([current.right, current.left])
+        if sample_range is None:
+            return
+        start, end = sample_range
+        rows, predictions, ranges = _partition_rows(self.X, new_node, self.order[start:end], start)
+        self._count(rows, self.y_pred[rows], -1)
+        self._count(rows, predictions, 1)
+        self.order[start:end] = rows
+        self.y_pred[rows] = predictions
+        self.ranges.update(ranges)
+
+    def metrics(self):
+        """Accuracy and support-weighted precision/recall/F1 (zero_division=0) like calculate_metrics, from the confusion counts."""
+        true_positives = np.diag(self.confusion).astype(np.float64)
+        support = self.confusion.sum(axis=1)
+        predicted = self.confusion.sum(axis=0)
+        total = support.sum()
+        precision = np.divide(true_positives, predicted, out=np.zeros_like(true_positives), where=predicted > 0)
+        recall = np.divide(true_positives, support, out=np.zeros_like(true_positives), where=support > 0)
+        denominator = 2 * true_positives + (predicted - true_positives) + (support - true_positives)
+        f1 = np.divide(2 * true_positives, denominator, out=np.zeros_like(true_positives), where=denominator > 0)
+        weights = support / total if total else np.zeros_like(true_positives)
+        return {
+            "accuracy": float(true_positives.sum() / total) if total else 0.0,
+            "precision": float(weights @ precision),
+            "recall": float(weights @ recall),
+            "f1_score": float(weights @ f1),
+        }
+
 class DecisionTreeClassifier:
     
-    def __init__(self, id_counter=0, feature_names=None, feature_indices=None, class_names=None):
+    def __init__(self, id_counter=0, feature_names=None, feature_indices=None, class_names=None, splitter="exact", max_bins=256):
         self.id_counter = id_counter
         self.root = None
+        if splitter not in ("exact", "hist"):
+            raise ValueError("Splitter must be 'exact' or 'hist'.")
+        if max_bins < 2:
+            raise ValueError("max_bins must be at least 2.")
+        self.splitter = splitter
+        self.max_bins = max_bins
+        self._flat = None
+        self._nodes = None
+        self._sample_order = None
+        self._sample_ranges = {}
+        self._evaluation = None
+        self.version = None  # version in the session's edit history, set by tree_history
         self.feature_names = feature_names
         self.feature_indices = feature_indices
         if isinstance(class_names, np.ndarray):
@@ -32,6 +217,38 @@ class DecisionTreeClassifier:
         else:
             self.class_names = class_names
 
+    @property
+    def root(self):
+        return self._root
+
+    @root.setter
+    def root(self, node):
+        self._root = node
+        self._flat = None
+        self._nodes = None
+        self._sample_order = None
+        self._sample_ranges = {}
+        self._evaluation = None
+
+    @property
+    def flat(self):
+        """Compiled array form of the tree, rebuilt lazily after the tree was edited."""
+        if self._flat is None:
+            self._flat = flatten_tree(self.root)
+        return self._flat
+
+    def _invalidate(self):
+        self._flat = None
+
+    def track_evaluation(self, X, y):
+        """
+        Starts keeping the predictions and confusion counts on (X, y) up to date through edits and returns
+        the TreeEvaluation, whose metrics() then cost nothing per edit. Reuses the current one for the same X.
+        """
+        if self._evaluation is None or not self._evaluation.matches(X, y):
+            self._evaluation = TreeEvaluation(self, X, y)
+        return self._evaluation
+
     def count_nodes(self):
         """Count the total number of nodes in the decision tree."""
         def _count_nodes_recursive(node):
@@ -45,13 +262,27 @@ class DecisionTreeClassifier:
     def fit(self, X, y):
         """Builds the decision tree from the training data."""
         self.root = self._grow_tree(X, y)
+        self.index_samples(X)
 
     def predict(self, X):
         """Predict class labels for samples in X."""
-        return np.array([self._predict_sample(sample, self.root) for sample in X])
+        return self.flat.output[self.flat.apply(X)]
+
+    def predict_proba(self, X):
+        """Predict class probabilities for samples in X. Leaves hold a single class, so rows are one-hot."""
+        outputs = self.predict(X)
+        num_classes = len(self.class_names) if self.class_names is not None else self.flat.output.max() + 1
+        proba = np.zeros((len(outputs), num_classes), dtype=np.float32)
+        proba[np.arange(len(outputs)), outputs] = 1
+        return proba
+
+    def apply(self, X):
+        """Returns the node_id of the leaf each sample in X ends up in."""
+        return self.flat.node_id[self.flat.apply(X)]
 
     def score(self, X, y):
         """Evaluate the model using accuracy."""
+        from sklearn.metrics import accuracy_score
         predictions = self.predict(X)
         return accuracy_score(y, predictions)
 
@@ -88,9 +319,12 @@ class DecisionTreeClassifier:
 
         return "\n".join(lines)
 
-    def _grow_tree(self, X, y, depth=0, max_depth=None, removed_features=[], recursive_removal=True):
-        """Recursively grows the decision tree."""
-        num_samples, num_features = X.shape
+    def _grow_tree(self, X, y, depth=0, max_depth=None, removed_features=[], recursive_removal=True, rows=None):
+        """Recursively grows the decision tree on the rows of X (all rows if none are given)."""
+        if rows is None:
+            rows = np.arange(X.shape[0])
+        num_samples, num_features = len(rows), X.shape[1]
+        y_all, y = y, y[rows]
         unique_classes = np.unique(y)
         node_id = self.id_counter
         self.id_counter += 1
@@ -100,56 +334,97 @@ class DecisionTreeClassifier:
             return Node(node_id, num_samples=num_samples, output=self._majority_class(y), depth=depth, removed_features=removed_features)
 
         # Find the best split
-        best_feature, best_threshold = self._best_split(X, y, num_features, removed_features)
+        best_feature, best_threshold = self._best_split(X, y, num_features, removed_features, rows=rows)
         if best_feature is None:
             return Node(node_id, num_samples=num_samples, output=self._majority_class(y), depth=depth, removed_features=removed_features)
 
         # Create the left and right subtrees
         removed_features = removed_features if recursive_removal else []
-        left_indices = X[:, best_feature] < best_threshold
-        right_indices = X[:, best_feature] >= best_threshold
-        right_subtree = self._grow_tree(X[right_indices], y[right_indices], max_depth=max_depth, depth=depth+1, removed_features=removed_features)
-        left_subtree = self._grow_tree(X[left_indices], y[left_indices], max_depth=max_depth, depth=depth+1, removed_features=removed_features)
+        values = _column(X, best_feature, rows)
+        left_rows = rows[values < best_threshold]
+        right_rows = rows[values >= best_threshold]
+        right_subtree = self._grow_tree(X, y_all, max_depth=max_depth, depth=depth+1, removed_features=removed_features, rows=right_rows)
+        left_subtree = self._grow_tree(X, y_all, max_depth=max_depth, depth=depth+1, removed_features=removed_features, rows=left_rows)
 
         return Node(node_id, num_samples=num_samples, feature_index=best_feature, threshold=best_threshold, left=left_subtree, right=right_subtree, depth=depth, removed_features=removed_features)
 
 
-    def _best_split(self, X, y, num_features, removed_features):
-        """Find the best feature and threshold to split the data, ignoring removed features."""
+    def _best_split(self, X, y, num_features, removed_features, rows=None):
+        """Find the best feature and threshold to split the data (restricted to rows), ignoring removed features."""
         best_gini = float("inf")
         best_feature, best_threshold = None, None
 
+        classes, y_codes = np.unique(y, return_inverse=True)
+        if len(y_codes) < 2:
+            return best_feature, best_threshold
+        removed_features = set(removed_features)
+        if sparse.issparse(X):
+            # slice the node's rows once, columns without entries are all zero and can't split
+            X, rows = (X if rows is None else X[rows]).tocsc(), None
+
         for feature_index in range(num_features):
             # Skip removed features
             if feature_index in removed_features:
                 continue
 
-            thresholds, classes = zip(*sorted(zip(X[:, feature_index], y)))
-            num_left = Counter()
-            num_right = Counter(classes)
-
-            for i in range(1, len(classes)):
-                c = classes[i - 1]
-                num_left[c] += 1
-                num_right[c] -= 1
-
-                if i == 0 or i == len(classes):
-                    continue  # Skip invalid splits (empty set)
+            if sparse.issparse(X):
+                values = _csc_column(X, feature_index)
+                if values is None:
+                    continue
+            else:
+                values = X[:, feature_index] if rows is None else X[rows, feature_index]
+            if self.splitter == "hist":
+                split = self._hist_split(values, y_codes, len(classes))
+            else:
+                split = self._exact_split(values, y_codes, len(classes))
+            if split is None:
+                continue  # Constant feature, no valid split
 
-                gini_left = 1 - sum((num_left[x] / i) ** 2 for x in num_left)
-                gini_right = 1 - sum((num_right[x] / (len(classes) - i)) ** 2 for x in num_right)
+            gini, threshold = split
+            if gini < best_gini:
+                best_gini = gini
+                best_feature = feature_index
+                best_threshold = threshold
 
-                gini = (i * gini_left + (len(classes) - i) * gini_right) / len(classes)
+        return best_feature, best_threshold
 
-                if thresholds[i] == thresholds[i - 1]:
-                    continue  # Skip duplicate threshold
+    def _exact_split(self, values, y_codes, num_classes):
+        """Evaluates every threshold of one feature with a single argsort and cumulative class counts."""
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        class_counts = np.zeros((len(values), num_classes), dtype=np.int64)
+        class_counts[np.arange(len(values)), y_codes[order]] = 1
+        num_left = np.cumsum(class_counts, axis=0)[:-1]
+
+        gini = _weighted_gini(num_left, num_left[-1] + class_counts[-1])
+        gini[values[1:] == values[:-1]] = np.inf  # Skip duplicate thresholds
+        i = np.argmin(gini)
+        if np.isinf(gini[i]):
+            return None
+        return gini[i], (values[i + 1] + values[i]) / 2  # Average for split
 
-                if gini < best_gini:
-                    best_gini = gini
-                    best_feature = feature_index
-                    best_threshold = (thresholds[i] + thresholds[i - 1]) / 2  # Average for split
+    def _hist_split(self, values, y_codes, num_classes):
+        """Evaluates the thresholds between non-empty bins of one feature using per-bin class counts."""
+        values = values.astype(np.float64, copy=False)
+        low, high = values.min(), values.max()
+        if low == high:
+            return None
+        edges = np.linspace(low, high, self.max_bins + 1)[1:-1]
+        bins = np.searchsorted(edges, values, side="right")
+        class_counts = np.bincount(bins * num_classes + y_codes, minlength=self.max_bins * num_classes)
+        class_counts = class_counts.reshape(self.max_bins, num_classes)
+
+        # one-hot and scaled features mostly fill a few bins, only split between occupied ones
+        occupied = np.flatnonzero(class_counts.sum(axis=1))
+        if len(occupied) < 2:
+            return None
+        class_counts = class_counts[occupied]
+        num_left = np.cumsum(class_counts, axis=0)[:-1]
 
-        return best_feature, best_threshold
+        gini = _weighted_gini(num_left, num_left[-1] + class_counts[-1])
+        i = np.argmin(gini)
+        left = bins <= occupied[i]
+        return gini[i], (values[left].max() + values[~left].min()) / 2
 
     def _predict_sample(self, sample, node):
         """Predicts the class for a single sample."""
@@ -165,57 +440,51 @@ class DecisionTreeClassifier:
         return Counter(y).most_common(1)[0][0]
     
     def change_feature(self, node_id, feature_index, threshold, flip=False):
-        _, node, _ = self._find_node(self.root, node_id)
+        """Change the split of the node with the given id, flip swaps its children."""
+        _, node, _ = self._find_node(node_id)
+        if node is None:
+            raise ValueError(f"Node with id {node_id} not found.")
+        if node.output is not None:
+            raise ValueError(f"Node {node_id} is a leaf and has no split to change.")
+        node = self._copy_path(node_id)
         node.feature_index = feature_index
         node.threshold = threshold
         if flip:
             node.right, node.left = node.left, node.right
+            self._parents[node.left.node_id] = (node, 'left')
+            self._parents[node.right.node_id] = (node, 'right')
+        self._drop_sample_ranges(node.left)
+        self._drop_sample_ranges(node.right)
+        self._invalidate()
+        if self._evaluation is not None:
+            self._evaluation.reroute(node, node)
+        return {"op": "change_feature", "node_id": node_id, "feature_index": feature_index, "threshold": threshold, "flip": flip}
 
     def delete_branch(self, node_id, direction=None):
         """Delete the branch of the tree starting at the node with the given direction."""
-        parent_node, node, parent_direction = self._find_node(self.root, node_id)
+        parent_node, node, parent_direction = self._find_node(node_id)
         if node is None:
             raise ValueError(f"Node with id {node_id} not found.")
-        
+        if node.output is not None:
+            raise ValueError(f"Node {node_id} has no children to delete.")
+
         # if direction is given, set parent child to the other branch
         if direction == 'left':
-            if parent_direction == 'left':
-                parent_node.left = node.right
-            elif parent_direction == 'right':
-                parent_node.right = node.right
-            elif parent_direction == None:
-                self.root = node.right
+            remaining = node.right
         elif direction == 'right':
-            if parent_direction == 'left':
-                parent_node.left = node.left
-            elif parent_direction == 'right':
-                parent_node.right = node.left
-            elif parent_direction == None:
-                self.root = node.left
+            remaining = node.left
         # if no direction is given, compare num_samples and delete the one 
         elif direction == 'auto':
-            if node.left is not None and node.right is not None:
-                if node.left.num_samples < node.right.num_samples:
-                    if parent_direction == 'left':
-                        parent_node.left = node.right
-                    elif parent_direction == 'right':
-                        parent_node.right = node.right
-                    elif parent_direction == None:
-                        self.root = node.right
-                else:
-                    if parent_direction == 'left':
-                        parent_node.left = node.left
-                    elif parent_direction == 'right':
-                        parent_node.right = node.left
-                    elif parent_direction == None:
-                        self.root = node.left
-            else:
-                raise ValueError(f"Node {node_id} has no children to delete.")
+            remaining = node.right if node.left.num_samples < node.right.num_samples else node.left
         else:
             raise ValueError("Direction must be 'left', 'right', or 'auto'.")
+        if parent_node is not None:
+            parent_node = self._copy_path(parent_node.node_id)
+        self._replace_subtree(parent_node, parent_direction, node, remaining)
+        return {"op": "delete_branch", "node_id": node_id, "direction": "left" if remaining is node.right else "right"}
 
     def modify_node(self, node_id, feature_index=None, threshold=None):
-        _, node, _ = self._find_node(self.root, node_id)
+        _, node, _ = self._find_node(node_id)
 
         if node is None:
             print(f"Node with id {node_id} not found.")
@@ -225,13 +494,20 @@ class DecisionTreeClassifier:
             print(f"Node with id {node_id} is a leaf node.")
             return
 
+        node = self._copy_path(node_id)
         node.feature_index = feature_index if feature_index is not None else node.feature_index
         node.threshold = threshold if threshold is not None else node.threshold
+        self._drop_sample_ranges(node.left)
+        self._drop_sample_ranges(node.right)
+        self._invalidate()
+        if self._evaluation is not None:
+            self._evaluation.reroute(node, node)
+        return {"op": "modify_node", "node_id": node_id, "feature_index": feature_index, "threshold": threshold}
 
     def delete_node(self, X, y, node_id, recursive_removal=True):
         """Delete the node with the specified node_id and regrow the subtree."""
         # Find the node and the parent node
-        parent_node, node_to_delete, direction = self._find_node(self.root, node_id)
+        parent_node, node_to_delete, direction = self._find_node(node_id)
         
         if node_to_delete is None:
             print(f"Node with id {node_id} not found.")
@@ -250,16 +526,62 @@ class DecisionTreeClassifier:
         print(f"Depth: {depth}, Max Depth: {max_depth}")
         node_id = node_to_delete.node_id
         
-        # Regrow the tree from the point where the node was removed
-        X_sub, y_sub = self._get_data_for_subtree(X, y, node_id)
-        new_sub_tree = self._grow_tree(X_sub, y_sub, depth=depth, max_depth=max_depth, removed_features=removed_features, recursive_removal=recursive_removal)
-        
-        if direction == 'left':
-            parent_node.left = new_sub_tree
-        elif direction == 'right':
-            parent_node.right = new_sub_tree
-        elif direction == None:
-            self.root = new_sub_tree
+        # Regrow the tree from the point where the node was removed, on the cached rows of the node
+        rows = np.sort(self._get_sample_rows(X, node_id))  # keep log order for majority-class ties
+        start, end = self._sample_ranges[node_id]
+        new_sub_tree = self._grow_tree(X, y, depth=depth, max_depth=max_depth, removed_features=removed_features, recursive_removal=recursive_removal, rows=rows)
+        if parent_node is not None:
+            parent_node = self._copy_path(parent_node.node_id)
+        self._replace_subtree(parent_node, direction, node_to_delete, new_sub_tree)
+        self._partition_samples(X, new_sub_tree, start, end)
+        # the regrown subtree is stored, replaying it must not need the training data
+        return {"op": "delete_node", "node_id": node_id, "subtree": subtree_to_records(new_sub_tree), "id_counter": self.id_counter}
+
+    def replace_subtree(self, node_id, new_node):
+        """Puts new_node (a subtree grown elsewhere) in place of the node with node_id."""
+        parent_node, node, direction = self._find_node(node_id)
+        if node is None:
+            raise ValueError(f"Node with id {node_id} not found.")
+        if parent_node is not None:
+            parent_node = self._copy_path(parent_node.node_id)
+        self._replace_subtree(parent_node, direction, node, new_node)
+
+    def apply_operation(self, operation):
+        """Replays an operation returned by one of the edit methods."""
+        op = operation["op"]
+        if op == "delete_branch":
+            self.delete_branch(operation["node_id"], operation["direction"])
+        elif op == "delete_node":
+            self.replace_subtree(operation["node_id"], records_to_subtree(operation["subtree"]))
+            self.id_counter = max(self.id_counter, operation["id_counter"])
+        elif op == "change_feature":
+            self.change_feature(operation["node_id"], operation["feature_index"], operation["threshold"], operation["flip"])
+        elif op == "modify_node":
+            self.modify_node(operation["node_id"], operation["feature_index"], operation["threshold"])
+        else:
+            raise ValueError(f"Unknown tree operation: {op}")
+
+    def _copy_path(self, node_id):
+        """
+        Replaces the nodes from the root down to node_id by shallow copies and returns the copy of the node.
+        Edits only change copied nodes, so earlier versions of the tree stay intact and share every untouched subtree.
+        """
+        path = self._path_to_node(node_id)
+        parent_copy, direction = None, None
+        for node, next_direction in path + [(self._nodes[node_id], None)]:
+            node_copy = copy.copy(node)
+            if parent_copy is None:
+                self._root = node_copy
+            else:
+                setattr(parent_copy, direction, node_copy)
+            self._nodes[node_copy.node_id] = node_copy
+            self._parents[node_copy.node_id] = (parent_copy, direction)
+            if node_copy.output is None:
+                self._parents[node_copy.left.node_id] = (node_copy, 'left')
+                self._parents[node_copy.right.node_id] = (node_copy, 'right')
+            parent_copy, direction = node_copy, next_direction
+        self._invalidate()
+        return parent_copy
     
     def print_tree_metrics(self, X, y, node):
         if node == None:
@@ -281,45 +603,104 @@ class DecisionTreeClassifier:
     
     def collect_events(self, node_id):
         """Collect all unique events in the subtree rooted at the node with node_id."""
-        _, node, _ = self._find_node(self.root, node_id)
+        _, node, _ = self._find_node(node_id)
         if node is None:
             raise ValueError(f"Node with id {node_id} not found.")
-        unique_classes = set()
 
-        def _collect_events_recursive(node):
-            if node is None:
-                return
-            if node.output is not None:
-                unique_classes.add(node.output)
-                return
-            _collect_events_recursive(node.right)
-            _collect_events_recursive(node.left)
-        
-        # start the recursion from the node
-        _collect_events_recursive(node)
-        
         # transform class indices into class names
         if self.class_names is None:
             raise ValueError("class_names attribute is not set in the tree.")
-        class_names = [self.class_names[class_index] for class_index in unique_classes]
+        class_names = [self.class_names[class_index] for class_index in sorted(self._classes[node_id])]
         
         return class_names
 
     # Find a node and return its parent, itself and the direction
     def find_node(self, node_id):
-        parent, node, direction = self._find_node(self.root, node_id)
+        parent, node, direction = self._find_node(node_id)
         return node
 
-    def _find_node(self, node, node_id, parent=None, direction=None):
-        if node.node_id == node_id:
-            return parent, node, direction
-        if node.left is not None:
-            found_parent, found_node, found_direction = self._find_node(node.left, node_id, node, 'left')
-            if found_node is not None:
-                return found_parent, found_node, found_direction
-        if node.right is not None:
-            return self._find_node(node.right, node_id, node, 'right')
-        return None, None, None
+    def _find_node(self, node_id):
+        self._ensure_index()
+        node = self._nodes.get(node_id)
+        if node is None:
+            return None, None, None
+        parent, direction = self._parents[node_id]
+        return parent, node, direction
+
+    def _ensure_index(self):
+        """Builds the node_id -> node, node_id -> (parent, direction) and node_id -> reachable classes maps."""
+        if self._nodes is None:
+            self._nodes, self._parents, self._classes = {}, {}, {}
+            if self._root is not None:
+                self._index_subtree(self._root, None, None)
+
+    def _index_subtree(self, node, parent, direction):
+        """Adds a subtree to the index, children before parents so reachable classes can be merged."""
+        self._parents[node.node_id] = (parent, direction)
+        stack = [(node, False)]
+        while stack:
+            current, expanded = stack.pop()
+            self._nodes[current.node_id] = current
+            if current.output is not None:
+                self._classes[current.node_id] = frozenset([current.output])
+            elif expanded:
+                self._classes[current.node_id] = self._classes[current.left.node_id] | self._classes[current.right.node_id]
+            else:
+                stack.append((current, True))
+                for child, child_direction in ((current.right, 'right'), (current.left, 'left')):
+                    self._parents[child.node_id] = (current, child_direction)
+                    stack.append((child, False))
+
+    def _unindex_subtree(self, node, keep=None):
+        """Removes a subtree from the index, except for the subtree rooted at keep."""
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current is keep:
+                continue
+            del self._nodes[current.node_id]
+            del self._parents[current.node_id]
+            del self._classes[current.node_id]
+            self._sample_ranges.pop(current.node_id, None)
+            if current.output is None:
+                stack.extend([current.right, current.left])
+
+    def _update_classes(self, node):
+        """Re-merges the reachable classes from node up to the root, stopping once nothing changes."""
+        while node is not None:
+            classes = self._classes[node.left.node_id] | self._classes[node.right.node_id]
+            if classes == self._classes[node.node_id]:
+                break
+            self._classes[node.node_id] = classes
+            node, _ = self._parents[node.node_id]
+
+    def _replace_subtree(self, parent_node, direction, old_node, new_node):
+        """Hooks new_node in where old_node was and updates the index for the changed part only."""
+        self._ensure_index()
+        if direction == 'left':
+            parent_node.left = new_node
+        elif direction == 'right':
+            parent_node.right = new_node
+        elif direction == None:
+            self._root = new_node
+
+        # new_node is either a child of old_node (delete_branch) or a freshly grown subtree (delete_node)
+        reused = self._nodes.get(new_node.node_id) is new_node
+        sample_range = self._sample_ranges.get(old_node.node_id)
+        self._unindex_subtree(old_node, keep=new_node if reused else None)
+        if reused:
+            self._parents[new_node.node_id] = (parent_node, direction)
+            # the rows of old_node now all reach new_node, its descendants get re-partitioned on demand
+            self._drop_sample_ranges(new_node)
+            if sample_range is not None:
+                self._sample_ranges[new_node.node_id] = sample_range
+        else:
+            self._index_subtree(new_node, parent_node, direction)
+        if parent_node is not None:
+            self._update_classes(parent_node)
+        self._invalidate()
+        if self._evaluation is not None:
+            self._evaluation.reroute(old_node, new_node)
 
     def _collect_used_feature_indices(self, node):
         for attributes, indices in self.feature_indices.items():
@@ -337,65 +718,82 @@ class DecisionTreeClassifier:
             output = output + right_result + left_result
         return output
 
-    # Collect data for the subtree rooted at the node
-    def _get_data_for_subtree(self, X, y, node_id, node=None):
+    def _path_to_node(self, node_id):
+        """Returns the (ancestor, direction) pairs from the root down to the node with node_id."""
+        _, node, _ = self._find_node(node_id)
         if node is None:
-            node = self.root  # Start from the root node
-        
-        # If we found the node with the matching node_id, return the data
-        if node.node_id == node_id:
-            return X, y
-        
-        # If it's a leaf node and we haven't found the node_id, return None
-        if node.output is not None:
             return None
-        
-        # Otherwise, traverse down the tree based on the conditions
-        if node.feature_index is not None and node.threshold is not None:
-            # Split data based on the feature and threshold at the current node
-            left_indices = X[:, node.feature_index] < node.threshold
-            right_indices = X[:, node.feature_index] >= node.threshold
-            
-            # Recursively check the left and right subtrees
-            if node.left:
-                left_result = self._get_data_for_subtree(X[left_indices], y[left_indices], node_id, node.left)
-                if left_result is not None:
-                    return left_result
-            if node.right:
-                right_result = self._get_data_for_subtree(X[right_indices], y[right_indices], node_id, node.right)
-                if right_result is not None:
-                    return right_result
-
-        return None  # If the node_id is not found
-
-    def _build_ancestor_map(self, node, parent_id=None, ancestor_map={}):
-        if node is None:
-            return
+        path = []
+        parent, direction = self._parents[node_id]
+        while parent is not None:
+            path.append((parent, direction))
+            parent, direction = self._parents[parent.node_id]
+        return path[::-1]
 
-        # Initialize the ancestor list for this node
-        if node.node_id not in ancestor_map:
-            ancestor_map[node.node_id] = set()
-
-        # If the node has a parent, add the parent and its ancestors to the current node's ancestor list
-        if parent_id is not None:
-            ancestor_map[node.node_id].add(parent_id)
-            ancestor_map[node.node_id].update(ancestor_map[parent_id])
-
-        # Recursively build the map for left and right children
-        self._build_ancestor_map(node.left, node.node_id, ancestor_map)
-        self._build_ancestor_map(node.right, node.node_id, ancestor_map)
+    # Collect data for the subtree rooted at the node
+    def _get_data_for_subtree(self, X, y, node_id):
+        rows = self._get_sample_rows(X, node_id)
+        if rows is None:
+            return None  # If the node_id is not found
+        return X[rows], y[rows]
 
-        return ancestor_map
+    def index_samples(self, X, leaf_ids=None):
+        """
+        Records which training rows reach each node, as one permutation of the rows where every node owns a contiguous range.
+        leaf_ids (the node_id of the leaf every row reaches, e.g. sklearn's apply) saves walking the rows down the tree.
+        """
+        self._sample_order = np.arange(X.shape[0])
+        self._sample_ranges = {}
+        if self.root is None:
+            return
+        if leaf_ids is None:
+            self._partition_samples(X, self.root, 0, X.shape[0])
+        else:
+            flat = flatten_tree(self.root)
+            self._sample_order, _, self._sample_ranges = _partition_rows(
+                X, self.root, self._sample_order, flat=flat, leaves=_positions(flat, leaf_ids))
+
+    def leaf_outputs(self, leaf_ids):
+        """Class predicted for every row from the node_id of the leaf it reaches, predict without walking the tree."""
+        return self.flat.output[_positions(self.flat, leaf_ids)]
+
+    def _partition_samples(self, X, node, start, end):
+        """Sorts the rows in _sample_order[start:end] by the leaf of the subtree at node they reach and stores the node ranges."""
+        self._sample_order[start:end], _, ranges = _partition_rows(X, node, self._sample_order[start:end], start)
+        self._sample_ranges.update(ranges)
+
+    def _drop_sample_ranges(self, node):
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            self._sample_ranges.pop(current.node_id, None)
+            if current.output is None:
+                stack.extend([current.right, current.left])
+
+    def _get_sample_rows(self, X, node_id):
+        """Training rows that reach the node, a view into the cached permutation (rebuilt when X does not match)."""
+        path = self._path_to_node(node_id)
+        if path is None:
+            return None
+        if self._sample_order is None or len(self._sample_order) != X.shape[0]:
+            self.index_samples(X)
+
+        if node_id not in self._sample_ranges:
+            # re-partition below the closest ancestor that still has a valid range
+            for ancestor, _ in reversed(path):
+                if ancestor.node_id in self._sample_ranges:
+                    self._partition_samples(X, ancestor, *self._sample_ranges[ancestor.node_id])
+                    break
+        start, end = self._sample_ranges[node_id]
+        return self._sample_order[start:end]
 
     def filter_nodes(self, node_list):
-        # build the ancestor map for each node
-        ancestor_map = self._build_ancestor_map(self.root)
-
         # filter out nodes whose ancestors are in the list
         filtered_nodes = []
         node_set = set(node_list)
         for node_id in node_list:
-            if not any(ancestor in node_set for ancestor in ancestor_map.get(node_id, [])):
+            path = self._path_to_node(node_id) or []
+            if not any(ancestor.node_id in node_set for ancestor, _ in path):
                 filtered_nodes.append(node_id)
 
         return filtered_nodes
@@ -431,6 +829,52 @@ class DecisionTreeClassifier:
 
         return output
 
+def _weighted_gini(num_left, num_total):
+    """Weighted gini impurity for every candidate split given the class counts left of it."""
+    total = num_total.sum()
+    left = num_left.sum(axis=1).astype(np.float64)
+    right = total - left
+    gini_left = 1 - np.sum((num_left / left[:, None]) ** 2, axis=1)
+    gini_right = 1 - np.sum(((num_total - num_left) / right[:, None]) ** 2, axis=1)
+    return (left * gini_left + right * gini_right) / total
+
+def subtree_to_records(root):
+    """Pre-order [node_id, feature_index, threshold, num_samples, output, depth, removed_features] rows of a subtree."""
+    records = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        records.append([
+            int(node.node_id),
+            None if node.feature_index is None else int(node.feature_index),
+            None if node.threshold is None else float(node.threshold),
+            int(node.num_samples),
+            None if node.output is None else int(node.output),
+            int(node.depth),
+            [int(feature) for feature in node.removed_features],
+        ])
+        if node.output is None:
+            stack.append(node.right)
+            stack.append(node.left)
+    return records
+
+def records_to_subtree(records):
+    """Rebuilds the Node graph written by subtree_to_records, iteratively."""
+    root = None
+    pending = []  # (parent, direction) slots still waiting for their child, in pre-order
+    for node_id, feature_index, threshold, num_samples, output, depth, removed_features in records:
+        node = Node(node_id, feature_index=feature_index, threshold=threshold, num_samples=num_samples,
+                    removed_features=removed_features, output=output, depth=depth)
+        if pending:
+            parent, direction = pending.pop()
+            setattr(parent, direction, node)
+        else:
+            root = node
+        if output is None:
+            pending.append((node, 'right'))
+            pending.append((node, 'left'))
+    return root
+
 def tree_to_json(tree):
     """Converts the decision tree model along with its attributes to a JSON-serializable dictionary."""
 
@@ -445,27 +889,42 @@ def tree_to_json(tree):
         return value
 
     def node_to_dict(node):
-        """Recursively transforms a Node object into a serializable dictionary."""
-        if node is None:
-            return None
+        """Transforms a Node object into a serializable dictionary, its children are filled in by the caller."""
         return {
             'node_id': convert_to_python_type(node.node_id),
             'feature_index': convert_to_python_type(node.feature_index),
             'threshold': convert_to_python_type(node.threshold),
             'num_samples': convert_to_python_type(node.num_samples),
             'removed_features': convert_to_python_type(node.removed_features),
-            'left': node_to_dict(node.left),
-            'right': node_to_dict(node.right),
+            'left': None,
+            'right': None,
             'output': convert_to_python_type(node.output),
             'depth': convert_to_python_type(node.depth)
         }
 
+    # iterative, deep trees would hit the recursion limit
+    root = None
+    stack = [(tree.root, None, None)] if tree.root is not None else []
+    while stack:
+        node, parent, direction = stack.pop()
+        node_dict = node_to_dict(node)
+        if parent is None:
+            root = node_dict
+        else:
+            parent[direction] = node_dict
+        if node.right is not None:
+            stack.append((node.right, node_dict, 'right'))
+        if node.left is not None:
+            stack.append((node.left, node_dict, 'left'))
+
     return {
-        'root': node_to_dict(tree.root),
+        'root': root,
         'id_counter': convert_to_python_type(tree.id_counter),
         'feature_names': convert_to_python_type(tree.feature_names),
         'feature_indices': convert_to_python_type(tree.feature_indices),
-        'class_names': convert_to_python_type(tree.class_names)
+        'class_names': convert_to_python_type(tree.class_names),
+        'splitter': tree.splitter,
+        'max_bins': convert_to_python_type(tree.max_bins)
     }
 
 def save_tree_to_json(tree, file_path):
@@ -480,21 +939,16 @@ def load_tree_from_json(file_path):
     """Loads a decision tree from a JSON file and reconstructs the tree."""
     
     def dict_to_node(data):
-        """Recursively transforms a dictionary back into a Node object."""
-        if data is None:
-            return None
-        node = Node(
+        """Transforms a dictionary into a Node object, without its children."""
+        return Node(
             node_id=data['node_id'],
             feature_index=data.get('feature_index'),
             threshold=data.get('threshold'),
             num_samples=data.get('num_samples'),
             removed_features=data.get('removed_features', []),
-            left=dict_to_node(data.get('left')),
-            right=dict_to_node(data.get('right')),
             output=data.get('output'),
             depth=data.get('depth')
         )
-        return node
     
     # Load the JSON data from the file
     with open(file_path, 'r') as json_file:
@@ -505,11 +959,139 @@ def load_tree_from_json(file_path):
         feature_names=tree_dict.get('feature_names'),
         feature_indices=tree_dict.get('feature_indices'),
         class_names=tree_dict.get('class_names'),
-        id_counter=tree_dict.get('id_counter')
+        id_counter=tree_dict.get('id_counter'),
+        splitter=tree_dict.get('splitter', 'exact'),
+        max_bins=tree_dict.get('max_bins', 256)
     )
     
-    # Reconstruct the root node from the dictionary
-    tree.root = dict_to_node(tree_dict['root'])
+    # Reconstruct the root node from the dictionary, iteratively
+    root = None
+    stack = [(tree_dict['root'], None, None)] if tree_dict.get('root') is not None else []
+    while stack:
+        data, parent, direction = stack.pop()
+        node = dict_to_node(data)
+        if parent is None:
+            root = node
+        else:
+            setattr(parent, direction, node)
+        for child in ('right', 'left'):
+            if data.get(child) is not None:
+                stack.append((data[child], node, child))
+    tree.root = root
+    return tree
+
+
+def tree_to_arrays(root):
+    """
+    Parallel pre-order node arrays of the flat tree format: the FlatTree arrays plus depth, and the
+    removed_features of node i as removed_features[removed_offsets[i]:removed_offsets[i + 1]].
+    """
+    nodes = _preorder_nodes(root)
+    flat = _flatten_nodes(nodes)
+    removed_features = [[int(feature) for feature in node.removed_features] for node in nodes]
+    removed_offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    removed_offsets[1:] = np.cumsum([len(features) for features in removed_features])
+    return {
+        "node_id": flat.node_id,
+        "feature": flat.feature,
+        "threshold": flat.threshold,
+        "left": flat.left,
+        "right": flat.right,
+        "output": flat.output,
+        "num_samples": flat.num_samples,
+        "depth": np.array([node.depth for node in nodes], dtype=np.int64),
+        "removed_offsets": removed_offsets,
+        "removed_features": np.array([feature for features in removed_features for feature in features], dtype=np.int64),
+    }
+
+def arrays_to_root(arrays):
+    """Rebuilds the Node graph from the arrays of tree_to_arrays, iteratively."""
+    node_id, feature, threshold, left, right, output, num_samples, depth, removed_offsets, removed_features = (
+        arrays[name].tolist() for name in TREE_ARRAYS)
+    nodes = []
+    for i in range(len(node_id)):
+        is_internal = left[i] >= 0
+        nodes.append(Node(
+            node_id[i],
+            feature_index=feature[i] if is_internal else None,
+            threshold=threshold[i] if is_internal else None,
+            num_samples=num_samples[i],
+            removed_features=removed_features[removed_offsets[i]:removed_offsets[i + 1]],
+            output=None if is_internal else output[i],
+            depth=depth[i],
+        ))
+    for i, node in enumerate(nodes):
+        if left[i] >= 0:
+            node.left = nodes[left[i]]
+            node.right = nodes[right[i]]
+    return nodes[0] if nodes else None
+
+def _json_default(value):
+    # feature_indices and class_names may hold numpy values
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def save_tree(tree, path):
+    """
+    Saves the tree in the flat tree format: a directory with one .npy per array of tree_to_arrays and a
+    meta.json with the format version and the tree's attributes. The directory is written next to path
+    and moved into place, so readers never see a half-written tree. Paths ending in .json get the legacy
+    nested JSON instead.
+    """
+    if path.endswith(".json"):
+        return save_tree_to_json(tree, path)
+    arrays = tree_to_arrays(tree.root)
+    meta = {
+        "format": TREE_FORMAT,
+        "version": TREE_FORMAT_VERSION,
+        "num_nodes": len(arrays["node_id"]),
+        "id_counter": int(tree.id_counter),
+        "feature_names": tree.feature_names,
+        "feature_indices": tree.feature_indices,
+        "class_names": tree.class_names,
+        "splitter": tree.splitter,
+        "max_bins": int(tree.max_bins),
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name in TREE_ARRAYS:
+        np.save(os.path.join(tmp_path, f"{name}.npy"), arrays[name])
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, default=_json_default)
+    if os.path.isdir(path):
+        # os.replace can't overwrite a non-empty directory, move the old one aside first
+        old_path = f"{path}.{os.getpid()}.old"
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(tmp_path, path)
+
+def load_tree(path, mmap_mode="r"):
+    """
+    Loads a tree written by save_tree. The arrays are memory-mapped (mmap_mode=None reads them into
+    memory) and become the tree's compiled FlatTree, so predicting needs no flattening. .json paths are
+    read with load_tree_from_json.
+    """
+    if path.endswith(".json"):
+        return load_tree_from_json(path)
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if meta.get("format") != TREE_FORMAT or meta.get("version", 0) > TREE_FORMAT_VERSION:
+        raise ValueError(f"{path} is not a tree of format {TREE_FORMAT} version {TREE_FORMAT_VERSION} or older.")
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in TREE_ARRAYS}
+
+    return _tree_from_arrays(arrays, id_counter=meta["id_counter"], feature_names=meta["feature_names"],
+                             feature_indices=meta["feature_indices"], class_names=meta["class_names"],
+                             splitter=meta.get("splitter", "exact"), max_bins=meta.get("max_bins", 256))
+
+def _tree_from_arrays(arrays, **attributes):
+    """A DecisionTreeClassifier with the nodes of the flat tree arrays, which also become its compiled FlatTree."""
+    tree = DecisionTreeClassifier(**attributes)
+    tree.root = arrays_to_root(arrays)
+    tree._flat = FlatTree(**{field: arrays[field] for field in FlatTree.__dataclass_fields__})
     return tree
 
 def get_max_depth(node):
@@ -577,92 +1159,135 @@ def get_metrics(X, y, feature_index, possible_events, class_names, feature_names
     return output
 
 
-def sklearn_to_custom_tree(sklearn_tree, feature_names=None, class_names=None, feature_indices=None):
-    """Converts an sklearn decision tree to a custom DecisionTreeClassifier"""
+def sklearn_to_custom_tree(sklearn_tree, feature_names=None, class_names=None, feature_indices=None, splitter="exact", max_bins=256):
+    """
+    Converts an sklearn decision tree to a custom DecisionTreeClassifier, straight from sklearn's node
+    arrays without recursion. Nodes keep sklearn's node ids and the arrays become the tree's FlatTree.
+    splitter/max_bins are the split search the custom tree uses when it regrows nodes after edits.
+    """
     tree_ = sklearn_tree.tree_
-
-    def build_node(node_id, depth):
-        """
-        Recursively builds a custom Node from an sklearn tree node.
-        """
-        # Extract information from the sklearn tree
-        feature_index = sklearn_tree.tree_.feature[node_id]
-        threshold = sklearn_tree.tree_.threshold[node_id]
-        num_samples = sklearn_tree.tree_.n_node_samples[node_id]
-        value = sklearn_tree.tree_.value[node_id]
-        left_child = sklearn_tree.tree_.children_left[node_id]
-        right_child = sklearn_tree.tree_.children_right[node_id]
-        
-        # Check if it's a leaf node
-        if left_child == -1 and right_child == -1:
-            # Get the output class for leaf
-            index = np.argmax(value) if value.ndim > 1 else value[0]
-            output = sklearn_tree.classes_[index]
-            #print(output)
-            return Node(
-                node_id=node_id,
-                num_samples=num_samples,
-                output=output,
-                depth=depth
-            )
-        
-        # Build the current node
-        node = Node(
-            node_id=node_id,
-            feature_index=feature_index,
-            threshold=threshold,
-            num_samples=num_samples,
-            depth=depth
-        )
-        
-        # Recursively build left and right children
-        node.left = build_node(left_child, depth + 1)
-        node.right = build_node(right_child, depth + 1)
-        
-        return node
-
-    # Initialize the custom decision tree
-    custom_tree = DecisionTreeClassifier(
-        feature_names=feature_names,
-        class_names=class_names,
-        feature_indices=feature_indices
-    )
-    
-    # Build the root node
-    custom_tree.root = build_node(0,0)
-    
-    return custom_tree
+    left, right = tree_.children_left.astype(np.int64), tree_.children_right.astype(np.int64)
+    is_leaf = left == -1
+
+    # pre-order positions, sklearn's best-first builder numbers nodes in a different order
+    order = []
+    stack = [0]
+    while stack:
+        node_id = stack.pop()
+        order.append(node_id)
+        if not is_leaf[node_id]:
+            stack.append(right[node_id])
+            stack.append(left[node_id])
+    order = np.array(order, dtype=np.int64)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    depth = np.zeros(len(order), dtype=np.int64)
+    frontier = np.array([0])
+    while frontier.size:
+        parents = frontier[~is_leaf[frontier]]
+        depth[left[parents]] = depth[parents] + 1
+        depth[right[parents]] = depth[parents] + 1
+        frontier = np.concatenate([left[parents], right[parents]])
+
+    outputs = np.asarray(sklearn_tree.classes_)[np.argmax(tree_.value[:, 0, :], axis=1)]
+    arrays = {
+        "node_id": order,
+        "feature": np.where(is_leaf, -1, tree_.feature)[order].astype(np.int64),
+        # sklearn sends x <= threshold to the left, the custom tree x < threshold: the next float above gives the same split
+        "threshold": np.where(is_leaf, np.nan, np.nextafter(tree_.threshold, np.inf))[order],
+        "left": np.where(is_leaf, -1, position[np.maximum(left, 0)])[order],
+        "right": np.where(is_leaf, -1, position[np.maximum(right, 0)])[order],
+        "output": np.where(is_leaf, outputs, -1)[order].astype(np.int64),
+        "num_samples": tree_.n_node_samples[order].astype(np.int64),
+        "depth": depth[order],
+        "removed_offsets": np.zeros(len(order) + 1, dtype=np.int64),
+        "removed_features": np.zeros(0, dtype=np.int64),
+    }
+    return _tree_from_arrays(arrays, feature_names=feature_names, class_names=class_names, feature_indices=feature_indices,
+                             splitter=splitter, max_bins=max_bins)
 
 
 def copy_decision_tree(tree):
+    """Copy of the tree that shares the node graph, edits copy the nodes they change so neither tree sees the other's edits."""
     if tree is None:
         return None
-    
-    # Create a new DecisionTreeClassifier object
+
     new_tree = DecisionTreeClassifier(
         id_counter=tree.id_counter,
         feature_names=copy.deepcopy(tree.feature_names),
         feature_indices=copy.deepcopy(tree.feature_indices),
-        class_names=copy.deepcopy(tree.class_names)
+        class_names=copy.deepcopy(tree.class_names),
+        splitter=tree.splitter,
+        max_bins=tree.max_bins
     )
-    
-    def copy_node(node):
-        if node is None:
-            return None
-        
-        return Node(
-            node_id=node.node_id,
-            feature_index=node.feature_index,
-            threshold=node.threshold,
-            num_samples=node.num_samples,
-            removed_features=copy.deepcopy(node.removed_features),
-            left=copy_node(node.left),
-            right=copy_node(node.right),
-            output=node.output,
-            depth=node.depth
-        )
-
-    # Copy the root node
-    new_tree.root = copy_node(tree.root)
-    
-    return new_tree
\ No newline at end of file
+    new_tree.root = tree.root
+    return new_tree
+
+
+def train_sklearn_dt(X_train, y_train, ccp_alpha=0.001, max_depth=None, min_samples_split=2, min_samples_leaf=1):
+    from sklearn.tree import DecisionTreeClassifier as SklearnDecisionTreeClassifier
+    print("training decision tree:")
+    dt = SklearnDecisionTreeClassifier(ccp_alpha=ccp_alpha, max_depth=max_depth, 
+                                       min_samples_split=min_samples_split, 
+                                       min_samples_leaf=min_samples_leaf)
+    dt.fit(X_train, y_train)
+    print("--------------------------------------------------------------------------------------------------")
+    return dt
+
+def train_dt(X_train, y_train, ccp_alpha=0.001, max_depth=None, min_samples_split=2, min_samples_leaf=1, folder_name=None, model_name=None, feature_names=None, feature_indices=None, class_names=None, return_train_predictions=False,
+             splitter="exact", max_bins=256):
+    """
+    Fits an sklearn tree and converts it to the custom tree, which regrows edited nodes with splitter
+    ("exact" or "hist" with max_bins bins). With return_train_predictions also returns the tree's
+    predictions for X_train, read off sklearn's leaves instead of predicting X_train again.
+    """
+    sklearn_dt = train_sklearn_dt(X_train, y_train, ccp_alpha=ccp_alpha, max_depth=max_depth, min_samples_split=min_samples_split, min_samples_leaf=min_samples_leaf)
+    # sklearn compares float32 copies of X, its leaves are the custom tree's only if X already is float32
+    leaf_ids = sklearn_dt.apply(X_train) if X_train.dtype == np.float32 else None
+    dt = sklearn_to_custom_tree(sklearn_dt, feature_names=feature_names, class_names=class_names, feature_indices=feature_indices,
+                                splitter=splitter, max_bins=max_bins)
+    num_nodes = dt.count_nodes()
+    dt.id_counter = num_nodes
+    dt.index_samples(X_train, leaf_ids=leaf_ids)
+    if model_name and folder_name:
+        save_dt(dt, folder_name, model_name)
+    print("--------------------------------------------------------------------------------------------------")
+    if return_train_predictions:
+        return dt, dt.predict(X_train) if leaf_ids is None else dt.leaf_outputs(leaf_ids)
+    return dt
+
+def train_custom_dt(X_train, y_train, folder_name=None, model_name=None, feature_names=None, feature_indices=None, class_names=None, splitter="exact", max_bins=256):
+    print("training decision tree:")
+    dt = DecisionTreeClassifier(class_names=class_names, feature_names=feature_names, feature_indices=feature_indices, splitter=splitter, max_bins=max_bins)
+    dt.fit(X_train, y_train)
+    if model_name and folder_name:
+        save_dt(dt, folder_name, model_name)
+    print("--------------------------------------------------------------------------------------------------")
+    return dt
+
+def save_dt(dt, folder_name, file_name):
+    #print(f"saving {file_name}...")
+    full_path = os.path.join('models', folder_name)
+    os.makedirs(full_path, exist_ok=True)
+    file_path = os.path.join(full_path, file_name)
+    save_tree(dt, file_path)
+    session_cache.invalidate(folder_name, file_name)
+
+def load_dt(folder_name, file_name):
+    #print(f"loading {file_name}...")
+    file_path = os.path.join('models', folder_name, file_name)
+    return load_tree(file_path)
+
+def calculate_metrics(y_true, y_pred):
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+    y_true = np.argmax(y_true, axis=1)
+    if y_pred.ndim == 2:
+        y_pred = np.argmax(y_pred, axis=1)
+    metrics = {
+        "accuracy": accuracy_score(y_true, y_pred),
+        "precision": precision_score(y_true, y_pred, average="weighted", zero_division=0),
+        "recall": recall_score(y_true, y_pred, average="weighted", zero_division=0),
+        "f1_score": f1_score(y_true, y_pred, average="weighted", zero_division=0)
+    }
+    return metrics
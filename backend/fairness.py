@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Settings
+FAIRNESS_CHUNK_ROWS = 100000  # rows decoded at once by iter_fairness_dataframe
+
+# group codes of a row for one protected feature
+UNPRIVILEGED, PRIVILEGED, OTHER = 0, 1, 2
+
+
+def _dense_columns(X, columns):
+    columns = X[:, columns]
+    return columns.toarray() if sparse.issparse(columns) else np.asarray(columns)
+
+def _labels(y):
+    y = np.asarray(y)
+    return np.argmax(y, axis=1) if y.ndim == 2 else y
+
+def _event_index(class_names, event):
+    if event not in class_names:
+        raise ValueError(f"Event '{event}' not found in class_names.")
+    return list(class_names).index(event)
+
+def _previous_indices(decision, feature_names):
+    previous = decision.previous if isinstance(decision.previous, list) else [decision.previous]
+    return [feature_names.index("-1. Event = " + prev) for prev in previous]
+
+def _group_codes(protected_attribute, feature_name, numerical_thresholds):
+    """UNPRIVILEGED/PRIVILEGED/OTHER per row, with the same split get_fairness_metrics uses."""
+    if feature_name in numerical_thresholds:
+        threshold = numerical_thresholds[feature_name]
+        unprivileged_mask = protected_attribute <= threshold
+        privileged_mask = protected_attribute > threshold
+    else:
+        unprivileged_mask = protected_attribute == 0
+        privileged_mask = protected_attribute == 1
+    return np.where(unprivileged_mask, UNPRIVILEGED, np.where(privileged_mask, PRIVILEGED, OTHER))
+
+def _rates_to_metrics(positives, group_sizes, total_amount):
+    """Statistical parity and disparate impact from the positives and sizes of the (unprivileged, privileged) groups."""
+    if total_amount < 1:
+        return 0, 1
+    selection_rate_unprivileged = positives[UNPRIVILEGED] / group_sizes[UNPRIVILEGED] if group_sizes[UNPRIVILEGED] else 0
+    selection_rate_privileged = positives[PRIVILEGED] / group_sizes[PRIVILEGED] if group_sizes[PRIVILEGED] else 0
+
+    if selection_rate_privileged == 0:
+        disp_impact = float("inf") if selection_rate_unprivileged != 0 else 0
+    else:
+        disp_impact = selection_rate_unprivileged / selection_rate_privileged
+    stat_parity = abs(selection_rate_unprivileged - selection_rate_privileged)
+    return stat_parity, disp_impact
+
+
+def get_fairness_metrics(y, protected_attribute, event_index, feature_name, numerical_thresholds):
+    y = _labels(y)
+    groups = _group_codes(protected_attribute, feature_name, numerical_thresholds)
+    positives = np.bincount(groups[y == event_index], minlength=3)
+    group_sizes = np.bincount(groups, minlength=3)
+    return _rates_to_metrics(positives, group_sizes, positives.sum())
+
+
+def fairness_metrics(predictions, X, critical_decisions, feature_indices, class_names, feature_names, numerical_thresholds):
+    """
+    Statistical parity and disparate impact of several models on the critical decisions of X.
+    predictions maps a model name to its predicted probabilities (or labels) for X, every model is
+    argmaxed once. Per decision the rows after one of its previous activities are selected once, and
+    all (protected feature, model, group, class) counts come from one bincount, from which every
+    (feature, event, model) metric is read off. Returns ({(feature name, event): {model: stat_par}},
+    {(feature name, event): {model: disp_imp}}), the shape calculate_comparable_fairness returns.
+    """
+    names = list(predictions)
+    labels = np.stack([_labels(predictions[name]) for name in names])  # models x rows
+    num_models, num_classes = len(names), len(class_names)
+    stat_par_results = {}
+    disp_imp_results = {}
+
+    for decision in critical_decisions:
+        filter_mask = np.any(_dense_columns(X, _previous_indices(decision, feature_names)) == 1, axis=1)
+        rows = np.flatnonzero(filter_mask)
+        features = [feature_index for attribute in decision.attributes for feature_index in feature_indices.get(attribute, [])]
+        if not features:
+            continue
+        event_indices = [_event_index(class_names, event) for event in decision.possible_events]
+
+        protected = _dense_columns(X[rows] if len(rows) < X.shape[0] else X, features)  # rows x features
+        groups = np.stack([_group_codes(protected[:, j], feature_names[feature_index], numerical_thresholds)
+                           for j, feature_index in enumerate(features)])  # features x rows
+        # flat index of (feature, model, group, class) for every (feature, model, row)
+        cells = ((np.arange(len(features))[:, None, None] * num_models + np.arange(num_models)[None, :, None]) * 3
+                 + groups[:, None, :]) * num_classes + labels[None, :, rows]
+        counts = np.bincount(cells.ravel(), minlength=len(features) * num_models * 3 * num_classes)
+        counts = counts.reshape(len(features), num_models, 3, num_classes)
+        group_sizes = counts.sum(axis=3)  # features x models x groups
+
+        for j, feature_index in enumerate(features):
+            for event, event_index in zip(decision.possible_events, event_indices):
+                outer_key = (feature_names[feature_index], event)
+                disp_imp_results[outer_key] = {}
+                stat_par_results[outer_key] = {}
+                for m, name in enumerate(names):
+                    positives = counts[j, m, :, event_index]
+                    stat_par, disp_imp = _rates_to_metrics(positives, group_sizes[j, m], positives.sum())
+                    disp_imp_results[outer_key][name] = disp_imp
+                    stat_par_results[outer_key][name] = stat_par
+                    print(f"Statistical Parity for {feature_names[feature_index]}, {event}, {name}: {stat_par}")
+
+    return stat_par_results, disp_imp_results
+
+
+def _decode_fairness_rows(X, y, class_names, feature_names, feature_indices, event_indices):
+    """prev_act/next_act/attribute columns of a block of rows, see create_fairness_dataframe."""
+    class_names = np.asarray(class_names, dtype=object)
+    active = _dense_columns(X, event_indices) == 1
+    has_previous = active.any(axis=1)
+    previous = class_names[np.argmax(active, axis=1)] if active.shape[1] else np.full(len(has_previous), "<UNK>", dtype=object)
+    df_data = {
+        "prev_act": np.where(has_previous, previous, "<UNK>").astype(object),
+        "next_act": class_names[np.asarray(y, dtype=np.int64)],
+    }
+    for attr, indices in feature_indices.items():
+        values = _dense_columns(X, indices)
+        if len(indices) == 1:
+            df_data[attr] = values[:, 0]
+        else:
+            for j, idx in enumerate(indices):
+                df_data[feature_names[idx]] = values[:, j].astype(np.int64)
+    return pd.DataFrame(df_data)
+
+def iter_fairness_dataframe(X, y, class_names, feature_names, feature_indices, chunk_rows=FAIRNESS_CHUNK_ROWS):
+    """
+    Chunked create_fairness_dataframe: yields the dataframe in pieces of chunk_rows rows (with a running
+    index), for X matrices too large to decode at once.
+    """
+    event_indices = [i for i, name in enumerate(feature_names) if "-1. Event =" in name]
+    for start in range(0, X.shape[0], chunk_rows):
+        end = min(start + chunk_rows, X.shape[0])
+        chunk = _decode_fairness_rows(X[start:end], y[start:end], class_names, feature_names, feature_indices, event_indices)
+        chunk.index = pd.RangeIndex(start, end)
+        yield chunk
+
+def create_fairness_dataframe(X, y, class_names, feature_names, feature_indices):
+    """
+    One row per sample with the previous activity (the active bit of the -1. Event block, "<UNK>" if
+    there is none), the next activity class_names[y], numerical attributes by name and categorical
+    attributes as one 0/1 column per feature name.
+    """
+    event_indices = [i for i, name in enumerate(feature_names) if "-1. Event =" in name]
+    return _decode_fairness_rows(X, y, class_names, feature_names, feature_indices, event_indices)
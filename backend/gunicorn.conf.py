@@ -0,0 +1,29 @@
+import gc
+import os
+
+# Settings
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 9))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# import the app once in the master and fork the workers from it, they share the imported modules copy-on-write
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+# modules the master imports on top of the app when preloading, none by default: workers hand predictions
+# to the inference server and import TensorFlow/Keras ("utils") lazily, and TF doesn't support forking
+# after it was imported. Deployments that train in the web workers can opt in at their own risk
+PRELOAD_MODULES = [name for name in os.environ.get("GUNICORN_PRELOAD_MODULES", "").split(",") if name]
+
+
+def when_ready(server):
+    import inference
+    if inference.INFERENCE_SERVER:
+        # started once by the master instead of by the first worker that predicts
+        inference.start_server()
+        server.log.info(f"Inference server listening on {inference.INFERENCE_SOCKET}")
+    if not preload_app:
+        return
+    from startup import timed_import
+    for name in PRELOAD_MODULES:
+        timed_import(name, trigger="preload")
+        server.log.info(f"Preloaded {name}")
+    # keep the collector from touching (and so copying) the preloaded objects in every worker
+    gc.freeze()
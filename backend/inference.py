@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import uuid
+import fcntl
+import queue
+import threading
+import subprocess
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+from scipy import sparse
+
+from artifacts import load_artifact
+from label_store import top_k_probabilities
+from session_cache import session_cache
+from startup import timed_import
+
+# Settings
+INFERENCE_SERVER = os.environ.get("INFERENCE_SERVER", "1") == "1"  # 0 predicts inside the calling process
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET", os.path.join("data", "inference.sock"))
+INFERENCE_LOG = os.path.join("data", "inference.log")
+SHM_FOLDER = os.environ.get("INFERENCE_SHM_FOLDER", "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp")  # arrays passed between processes
+BATCH_WAIT_SECONDS = float(os.environ.get("INFERENCE_BATCH_WAIT_MS", 5)) / 1000  # how long a small request waits for others on the same model
+BATCH_MAX_ROWS = int(os.environ.get("INFERENCE_BATCH_MAX_ROWS", 8192))  # requests with more rows are predicted alone
+CHUNK_ROWS = int(os.environ.get("INFERENCE_CHUNK_ROWS", 65536))  # rows predict_labels predicts at once, only labels/top-k of a chunk are kept
+STARTUP_SECONDS = 120  # the server imports TensorFlow before it listens
+
+
+def _shm_path():
+    return os.path.join(SHM_FOLDER, f"inference_{os.getpid()}_{uuid.uuid4().hex}.npy")
+
+def _put_array(array):
+    """Writes an array to shared memory as .npy, the receiver maps it and removes the file."""
+    path = _shm_path()
+    with open(path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    return path
+
+def _take_array(path):
+    # the mapping stays valid after the file is removed, the memory is freed with the last reference
+    try:
+        return np.load(path, mmap_mode="r")
+    finally:
+        os.remove(path)
+
+def _put_input(X):
+    if sparse.issparse(X):
+        X = X.tocsr()
+        return {"kind": "csr", "shape": X.shape, "parts": [_put_array(part) for part in (X.data, X.indices, X.indptr)]}
+    return {"kind": "array", "path": _put_array(X)}
+
+def _take_input(spec):
+    if spec["kind"] == "csr":
+        data, indices, indptr = (_take_array(path) for path in spec["parts"])
+        return sparse.csr_matrix((data, indices, indptr), shape=tuple(spec["shape"]), copy=False)
+    return _take_array(spec["path"])
+
+
+class _Request:
+    def __init__(self, folder_name, model_file, X):
+        self.key = (folder_name, model_file)
+        self.X = X
+        self.rows = X.shape[0]
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Batcher:
+    """
+    Runs all predictions of the server on one thread. A request with few rows waits up to
+    BATCH_WAIT_SECONDS for more requests on the same model, and they are predicted as one batch.
+    """
+
+    def __init__(self, load_model):
+        self.load_model = load_model
+        self.queue = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "rows": 0, "predict_seconds": 0.0}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, request):
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.result
+
+    def _next_batch(self, waiting):
+        first = waiting.popleft() if waiting else self.queue.get()
+        batch, rows = [first], first.rows
+        for request in list(waiting):
+            if request.key == first.key and rows + request.rows <= BATCH_MAX_ROWS:
+                waiting.remove(request)
+                batch.append(request)
+                rows += request.rows
+        deadline = time.monotonic() + BATCH_WAIT_SECONDS
+        while rows < BATCH_MAX_ROWS:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request.key == first.key and rows + request.rows <= BATCH_MAX_ROWS:
+                batch.append(request)
+                rows += request.rows
+            else:
+                waiting.append(request)
+        return batch
+
+    def _run(self):
+        waiting = deque()  # requests for other models that arrived while a batch was collected
+        while True:
+            batch = self._next_batch(waiting)
+            try:
+                model = self.load_model(*batch[0].key)
+                inputs = [request.X for request in batch]
+                if len(inputs) == 1:
+                    X = inputs[0]
+                elif any(sparse.issparse(X) for X in inputs):
+                    X = sparse.vstack(inputs, format="csr")
+                else:
+                    X = np.concatenate(inputs)
+                start = time.perf_counter()
+                y = model.predict(X, verbose=0)
+                self.stats["predict_seconds"] += time.perf_counter() - start
+                offsets = np.cumsum([0] + [request.rows for request in batch])
+                for request, begin, end in zip(batch, offsets[:-1], offsets[1:]):
+                    request.result = y[begin:end]
+            except Exception as e:
+                for request in batch:
+                    request.error = f"{type(e).__name__}: {e}"
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["rows"] += sum(request.rows for request in batch)
+            for request in batch:
+                request.done.set()
+
+
+def _predict_labels(predict, X, top_k=0, chunk_rows=CHUNK_ROWS):
+    """Argmax labels (and top-k probabilities) of predict(X), predicted chunk by chunk so the softmax matrix never exists whole."""
+    labels = np.empty(X.shape[0], dtype=np.int32)
+    indices = values = None
+    for start in range(0, X.shape[0], chunk_rows):
+        end = min(start + chunk_rows, X.shape[0])
+        y = predict(X[start:end])
+        labels[start:end] = np.argmax(y, axis=1)
+        if top_k:
+            chunk_indices, chunk_values = top_k_probabilities(y, top_k)
+            if indices is None:
+                indices = np.empty((X.shape[0], chunk_indices.shape[1]), dtype=chunk_indices.dtype)
+                values = np.empty((X.shape[0], chunk_values.shape[1]), dtype=chunk_values.dtype)
+            indices[start:end], values[start:end] = chunk_indices, chunk_values
+    return labels, indices, values
+
+def _load_model(folder_name, model_file):
+    """Keeps the session's models resident in the server, reloaded when the .keras file changes."""
+    from utils import load_nn
+    path = os.path.join("models", folder_name, model_file)
+    return session_cache.get(folder_name, model_file, path, lambda: load_nn(folder_name, model_file))
+
+def _handle(connection, batcher):
+    with connection:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                return
+            try:
+                if message["op"] in ("predict", "predict_labels"):
+                    if message.get("artifact"):
+                        # session artifacts are memory-mapped from disk, nothing is copied
+                        X = load_artifact(message["folder_name"], message["artifact"])
+                    else:
+                        X = _take_input(message["input"])
+                    predict = lambda X: batcher.submit(_Request(message["folder_name"], message["model_file"], X))
+                    if message["op"] == "predict":
+                        connection.send({"path": _put_array(predict(X))})
+                    else:
+                        arrays = _predict_labels(predict, X, message["top_k"])
+                        connection.send({"paths": [None if array is None else _put_array(array) for array in arrays]})
+                elif message["op"] == "stats":
+                    connection.send({"stats": {**batcher.stats, "pid": os.getpid(), "cache": session_cache.stats()}})
+                else:
+                    connection.send({"error": f"Unknown operation {message['op']}"})
+            except Exception as e:
+                connection.send({"error": f"{type(e).__name__}: {e}"})
+
+def serve():
+    """Runs the inference server on INFERENCE_SOCKET, one thread per client connection."""
+    timed_import("utils", trigger="inference server")  # TensorFlow is imported once, before the socket accepts requests
+    batcher = _Batcher(_load_model)
+    if os.path.exists(INFERENCE_SOCKET):
+        os.remove(INFERENCE_SOCKET)
+    with Listener(INFERENCE_SOCKET, family="AF_UNIX") as listener:
+        print(f"Inference server listening on {INFERENCE_SOCKET}")
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=_handle, args=(connection, batcher), daemon=True).start()
+
+
+def start_server():
+    """Starts the inference server in the background unless one is answering on INFERENCE_SOCKET."""
+    os.makedirs(os.path.dirname(INFERENCE_SOCKET) or ".", exist_ok=True)
+    # several gunicorn workers may find the server missing at once, only one starts it
+    with open(f"{INFERENCE_SOCKET}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                Client(INFERENCE_SOCKET, family="AF_UNIX").close()
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+            with open(INFERENCE_LOG, "a") as log:
+                process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdout=log, stderr=subprocess.STDOUT,
+                                           start_new_session=True)
+            deadline = time.monotonic() + STARTUP_SECONDS
+            while time.monotonic() < deadline:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Inference server exited with code {process.returncode}, see {INFERENCE_LOG}")
+                try:
+                    Client(INFERENCE_SOCKET, family="AF_UNIX").close()
+                    return
+                except (FileNotFoundError, ConnectionRefusedError):
+                    time.sleep(0.2)
+            raise RuntimeError(f"Inference server did not start within {STARTUP_SECONDS}s, see {INFERENCE_LOG}")
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _connect():
+    try:
+        return Client(INFERENCE_SOCKET, family="AF_UNIX")
+    except (FileNotFoundError, ConnectionRefusedError):
+        start_server()
+        return Client(INFERENCE_SOCKET, family="AF_UNIX")
+
+def _request(message, connection=None):
+    with connection or _connect() as connection:
+        connection.send(message)
+        response = connection.recv()
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+def _remove_input(message):
+    spec = message.get("input")
+    if spec is None:
+        return
+    for path in spec["parts"] if spec["kind"] == "csr" else [spec["path"]]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _send_predict(op, folder_name, model_file, X, artifact, **params):
+    message = {"op": op, "folder_name": folder_name, "model_file": model_file, "artifact": artifact, **params}
+    connection = _connect()
+    if not artifact:
+        message["input"] = _put_input(X)
+    try:
+        return _request(message, connection)
+    except (OSError, EOFError):
+        # the server went away before it took the input
+        _remove_input(message)
+        raise
+
+def predict(folder_name, model_file, X=None, artifact=None):
+    """
+    Predicted probabilities of the session model models/<folder_name>/<model_file> for X, or for the
+    session artifact named artifact (read by the server from disk, nothing is sent). Predictions run in
+    the inference server, which keeps the models resident and batches concurrent small requests; the
+    result comes back as a read-only array mapped from shared memory. With INFERENCE_SERVER=0 the model
+    is loaded and run in this process.
+    """
+    if not INFERENCE_SERVER:
+        X = load_artifact(folder_name, artifact) if artifact else X
+        return _load_model(folder_name, model_file).predict(X)
+    return _take_array(_send_predict("predict", folder_name, model_file, X, artifact)["path"])
+
+def predict_labels(folder_name, model_file, X=None, artifact=None, top_k=0):
+    """
+    Like predict, but only the argmax labels (int32) and, with top_k, the top_k_probabilities (class
+    indices and float16 probabilities) come back; the server predicts in CHUNK_ROWS chunks and never
+    holds the whole softmax matrix. Returns (labels, indices, values), indices/values are None without top_k.
+    """
+    if not INFERENCE_SERVER:
+        X = load_artifact(folder_name, artifact) if artifact else X
+        return _predict_labels(_load_model(folder_name, model_file).predict, X, top_k)
+    paths = _send_predict("predict_labels", folder_name, model_file, X, artifact, top_k=top_k)["paths"]
+    return tuple(None if path is None else _take_array(path) for path in paths)
+
+def server_stats():
+    return _request({"op": "stats"})["stats"]
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,88 @@
+import os
+import math
+
+import numpy as np
+import tensorflow as tf
+from scipy import sparse
+
+from label_store import LabelStore
+
+# Settings
+USE_PIPELINE = os.environ.get("NN_PIPELINE", "1") == "1"  # 0 passes the arrays to fit as before
+DEFAULT_BATCH_SIZE = int(os.environ.get("NN_BATCH_SIZE", 256))
+BASE_BATCH_SIZE = 32  # batch size the default learning rates were chosen for
+LR_SCALING = os.environ.get("NN_LR_SCALING", "sqrt")  # none, linear or sqrt scaling of the learning rate with the batch size
+SHUFFLE_BUFFER = int(os.environ.get("NN_SHUFFLE_BUFFER", 16384))  # rows
+READ_ROWS = 8192  # contiguous rows read from X (and its targets) at once
+CACHE = os.environ.get("NN_PIPELINE_CACHE", "")  # "" no cache, "memory", or a file prefix for tf.data's cache files
+
+
+def scaled_learning_rate(learning_rate, batch_size, lr_scaling=None):
+    """learning_rate (chosen for BASE_BATCH_SIZE) scaled to batch_size: linear, by the square root, or none."""
+    lr_scaling = lr_scaling or LR_SCALING
+    if lr_scaling == "linear":
+        return learning_rate * batch_size / BASE_BATCH_SIZE
+    if lr_scaling == "sqrt":
+        return learning_rate * math.sqrt(batch_size / BASE_BATCH_SIZE)
+    if lr_scaling == "none":
+        return learning_rate
+    raise ValueError(f"Unknown learning rate scaling {lr_scaling}")
+
+def _targets(y, start, end):
+    if isinstance(y, LabelStore):
+        return y.dense(slice(start, end))
+    return np.asarray(y[start:end], dtype=np.float32)
+
+def make_dataset(X, y, batch_size=None, shuffle=True, shuffle_buffer=None, cache=None):
+    """
+    tf.data pipeline of (X, y) batches for fit/evaluate. X is a dense (possibly memory-mapped) array
+    or a sparse matrix, y a dense target array or a LabelStore whose dense targets are built on the
+    fly. Contiguous blocks of READ_ROWS rows are read and cast to float32, in a new block order every
+    epoch; rows are mixed in a shuffle buffer of shuffle_buffer rows and batches are prefetched while
+    the model trains. cache ("memory"/True or a file prefix) keeps the decoded blocks after the first epoch.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    shuffle_buffer = shuffle_buffer or SHUFFLE_BUFFER
+    cache = CACHE if cache is None else cache
+    num_rows, num_features = X.shape
+    num_classes = y.num_classes if isinstance(y, LabelStore) else y.shape[1]
+    num_blocks = -(-num_rows // READ_ROWS)
+
+    if sparse.issparse(X):
+        X = X.tocsr()
+
+        def read(block):
+            start = int(block) * READ_ROWS
+            end = min(start + READ_ROWS, num_rows)
+            rows = X[start:end].tocoo()
+            indices = np.column_stack((rows.row, rows.col)).astype(np.int64)
+            return indices, rows.data.astype(np.float32), np.int64(end - start), _targets(y, start, end)
+
+        def to_tensors(block):
+            indices, values, rows, targets = tf.numpy_function(read, [block], (tf.int64, tf.float32, tf.int64, tf.float32))
+            indices.set_shape((None, 2))
+            values.set_shape((None,))
+            targets.set_shape((None, num_classes))
+            return tf.SparseTensor(indices, values, tf.stack([rows, tf.constant(num_features, dtype=tf.int64)])), targets
+    else:
+        def read(block):
+            start = int(block) * READ_ROWS
+            end = min(start + READ_ROWS, num_rows)
+            return np.asarray(X[start:end], dtype=np.float32), _targets(y, start, end)
+
+        def to_tensors(block):
+            inputs, targets = tf.numpy_function(read, [block], (tf.float32, tf.float32))
+            inputs.set_shape((None, num_features))
+            targets.set_shape((None, num_classes))
+            return inputs, targets
+
+    blocks = tf.data.Dataset.range(num_blocks).map(to_tensors, num_parallel_calls=tf.data.AUTOTUNE)
+    if cache:
+        blocks = blocks.cache("" if cache is True or cache == "memory" else cache)
+    if shuffle:
+        blocks = blocks.shuffle(num_blocks, reshuffle_each_iteration=True)
+    rows = blocks.unbatch()
+    if shuffle:
+        rows = rows.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    batches = rows.batch(batch_size).apply(tf.data.experimental.assert_cardinality(-(-num_rows // batch_size)))
+    return batches.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Settings
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))  # training processes per backend process
+DATA_FOLDER = "data"
+LOCK_GRACE_SECONDS = 10  # a lock younger than this whose job record can't be read is still being taken
+LOCK_RETRY_SECONDS = 0.05
+LOCK_ATTEMPTS = 100
+
+_executor = None
+_executor_lock = threading.Lock()
+_current_job = None  # (folder_name, job_id) of the job running in this worker process
+
+
+class JobConflictError(RuntimeError):
+    """A job of another type still holds the folder, the new job would race it on the folder's files."""
+
+    def __init__(self, job):
+        super().__init__(f"{job['job_type']} job {job['job_id']} is still {job['status']} for {job['folder_name']}")
+        self.job = job
+
+
+def _jobs_dir(folder_name):
+    return os.path.join(DATA_FOLDER, folder_name, "jobs")
+
+def _job_path(folder_name, job_id):
+    return os.path.join(_jobs_dir(folder_name), f"{job_id}.json")
+
+def _lock_path(folder_name):
+    # one lock per folder, all job types write the folder's models and artifacts
+    return os.path.join(_jobs_dir(folder_name), "folder.lock")
+
+def _write_job(record):
+    # write to a temp file and rename, so pollers never see a half written record
+    path = _job_path(record["folder_name"], record["job_id"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f, indent=4)
+    os.replace(tmp_path, path)
+
+def load_job(folder_name, job_id):
+    try:
+        with open(_job_path(folder_name, job_id), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def update_job(folder_name, job_id, **fields):
+    record = load_job(folder_name, job_id)
+    if record is None:
+        return None
+    record.update(fields)
+    _write_job(record)
+    return record
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _is_active(record):
+    return record is not None and record["status"] in ("queued", "running") and _is_alive(record["owner_pid"])
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, so workers don't inherit the TensorFlow/Flask state of the web process
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def submit_job(job_type, folder_name, data):
+    """
+    Queues the endpoint job_type with the request data and returns the job record immediately.
+    A job of the same type that is still queued or running for the folder is returned instead of a new one;
+    while a job of another type holds the folder JobConflictError is raised.
+    """
+    os.makedirs(_jobs_dir(folder_name), exist_ok=True)
+    lock_path = _lock_path(folder_name)
+    job_id = uuid.uuid4().hex
+    record = {
+        "job_id": job_id,
+        "job_type": job_type,
+        "folder_name": folder_name,
+        "status": "queued",
+        "progress": {},
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "owner_pid": os.getpid(),
+        "result": None,
+        "status_code": None,
+        "error": None,
+    }
+    # the record exists before the lock names it, so a concurrent submitter always finds the job of a lock
+    _write_job(record)
+
+    for _ in range(LOCK_ATTEMPTS):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(lock_path, "r") as f:
+                    existing = load_job(folder_name, f.read().strip())
+                lock_age = time.time() - os.path.getmtime(lock_path)
+            except FileNotFoundError:
+                continue  # released in the meantime
+            if _is_active(existing):
+                os.remove(_job_path(folder_name, job_id))
+                if existing["job_type"] != job_type:
+                    raise JobConflictError(existing)
+                return dict(existing, deduplicated=True)
+            if existing is None and lock_age < LOCK_GRACE_SECONDS:
+                # the lock was just created and its job id is not written yet
+                time.sleep(LOCK_RETRY_SECONDS)
+                continue
+            # the owner of the lock died or the job is done, take the lock over
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(job_id)
+        break
+    else:
+        os.remove(_job_path(folder_name, job_id))
+        raise RuntimeError(f"Could not acquire the job lock for {folder_name}")
+
+    future = _get_executor().submit(_run_job, job_type, folder_name, job_id, data)
+    future.add_done_callback(lambda f: _on_job_done(f, folder_name, job_id))
+    return dict(record, deduplicated=False)
+
+def _on_job_done(future, folder_name, job_id):
+    # only reached with an exception if the worker process itself died
+    exception = future.exception()
+    if exception is not None:
+        update_job(folder_name, job_id, status="failed", error=f"Job worker crashed: {exception}", finished_at=time.time())
+        _release_lock(folder_name, job_id)
+        global _executor
+        with _executor_lock:
+            _executor = None
+
+def _release_lock(folder_name, job_id):
+    lock_path = _lock_path(folder_name)
+    try:
+        with open(lock_path, "r") as f:
+            if f.read().strip() == job_id:
+                os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+def _run_job(job_type, folder_name, job_id, data):
+    """Runs inside a pool process: replays the endpoint under a request context and stores its response."""
+    global _current_job
+    _current_job = (folder_name, job_id)
+    update_job(folder_name, job_id, status="running", started_at=time.time(), owner_pid=os.getpid())
+    try:
+        from backend import app
+        with app.test_request_context(json=data):
+            response = app.make_response(app.view_functions[job_type]())
+        result = response.get_json()
+        failed = response.status_code >= 400
+        update_job(
+            folder_name, job_id,
+            status="failed" if failed else "finished",
+            result=result,
+            status_code=response.status_code,
+            error=result.get("error") if failed and isinstance(result, dict) else None,
+            finished_at=time.time(),
+        )
+    except Exception as e:
+        update_job(folder_name, job_id, status="failed", error=str(e), status_code=500, finished_at=time.time())
+    finally:
+        _current_job = None
+        _release_lock(folder_name, job_id)
+
+def report_progress(**progress):
+    """Merges progress fields into the record of the job running in this process, no-op outside of jobs."""
+    if _current_job is None:
+        return
+    folder_name, job_id = _current_job
+    record = load_job(folder_name, job_id)
+    if record is not None:
+        record["progress"].update(progress)
+        _write_job(record)
@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+
+from artifacts import save_artifact, load_artifact
+
+# Settings
+DISTILL_TOP_K = int(os.environ.get("DISTILL_TOP_K", 5))  # network probabilities kept per sample when distilling, 0 keeps only labels
+
+
+def label_dtype(num_classes):
+    return np.int16 if num_classes <= np.iinfo(np.int16).max else np.int32
+
+def top_k_probabilities(y, k):
+    """The k most probable classes of every row of y, most probable first, and their probabilities as float16."""
+    k = min(k, y.shape[1])
+    indices = np.argpartition(-y, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(y, indices, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1).astype(label_dtype(y.shape[1])), np.take_along_axis(values, order, axis=1).astype(np.float16)
+
+def soft_labels_to_dense(indices, values, num_classes):
+    """Dense float32 soft labels from top_k_probabilities, every row renormalized to the probability it kept."""
+    dense = np.zeros((len(indices), num_classes), dtype=np.float32)
+    np.put_along_axis(dense, np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=np.float32), axis=1)
+    totals = dense.sum(axis=1, keepdims=True)
+    return np.divide(dense, totals, out=dense, where=totals > 0)
+
+def labels_to_one_hot(labels, num_classes):
+    return np.eye(num_classes, dtype=np.float32)[np.asarray(labels, dtype=np.int64)]
+
+
+class LabelStore:
+    """
+    Training targets without the dense (samples x classes) matrix: one class id per row (int16 while
+    the classes fit) and, for soft labels, the top-k (class, float16 probability) pairs of every row.
+    Rows marked hard use the one-hot target of their class id even if soft labels exist. dense(rows)
+    builds the float32 targets of a batch.
+    """
+
+    def __init__(self, labels, num_classes, top_k_indices=None, top_k_values=None, hard=None):
+        self.labels = np.asarray(labels).astype(label_dtype(num_classes), copy=False)
+        self.num_classes = num_classes
+        self.top_k_indices = top_k_indices
+        self.top_k_values = top_k_values
+        self.hard = hard  # bool per row, None if no row is hard
+
+    @classmethod
+    def from_labels(cls, labels, num_classes):
+        return cls(labels, num_classes)
+
+    @classmethod
+    def from_probabilities(cls, y, top_k=DISTILL_TOP_K):
+        """Labels (argmax) and, unless top_k is 0, the top_k probabilities of a (samples x classes) matrix."""
+        if not top_k:
+            return cls(np.argmax(y, axis=1), y.shape[1])
+        indices, values = top_k_probabilities(y, top_k)
+        return cls(indices[:, 0], y.shape[1], indices, values)
+
+    @property
+    def soft(self):
+        return self.top_k_indices is not None
+
+    @property
+    def top_k(self):
+        return self.top_k_indices.shape[1] if self.soft else 0
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.labels, self.top_k_indices, self.top_k_values, self.hard) if array is not None)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, rows):
+        """The LabelStore of rows (an index array or slice), slices stay views of the stored arrays."""
+        return LabelStore(self.labels[rows], self.num_classes,
+                          None if self.top_k_indices is None else self.top_k_indices[rows],
+                          None if self.top_k_values is None else self.top_k_values[rows],
+                          None if self.hard is None else self.hard[rows])
+
+    def dense(self, rows=None):
+        """Dense float32 targets of rows (an index array or slice, all rows by default)."""
+        rows = slice(None) if rows is None else rows
+        labels = self.labels[rows]
+        if not self.soft:
+            return labels_to_one_hot(labels, self.num_classes)
+        dense = soft_labels_to_dense(self.top_k_indices[rows], self.top_k_values[rows], self.num_classes)
+        if self.hard is not None:
+            hard = np.flatnonzero(self.hard[rows])
+            dense[hard] = 0
+            dense[hard, labels[hard]] = 1
+        return dense
+
+    def with_hard_labels(self, rows, labels):
+        """A copy in which rows get the one-hot targets of labels, the other rows keep their targets."""
+        new_labels = np.array(self.labels)
+        new_labels[rows] = labels
+        hard = np.zeros(len(self), dtype=bool) if self.hard is None else np.array(self.hard)
+        hard[rows] = True
+        return LabelStore(new_labels, self.num_classes, self.top_k_indices, self.top_k_values, hard=hard)
+
+
+def as_label_store(y, num_classes):
+    """A LabelStore for y: a LabelStore, class ids or a dense (samples x classes) matrix whose rows are all kept."""
+    if isinstance(y, LabelStore):
+        return y
+    y = np.asarray(y)
+    if y.ndim == 1:
+        return LabelStore.from_labels(y, num_classes)
+    return LabelStore.from_probabilities(y, top_k=y.shape[1])
+
+def save_label_store(store, folder_name, name, save=save_artifact):
+    """Stores the arrays of store as the artifacts <name>_labels (and <name>_top_k_indices/_values), then its <name>_label_store entry."""
+    save(store.labels, folder_name, f"{name}_labels", dtype=None)
+    if store.soft:
+        save(store.top_k_indices, folder_name, f"{name}_top_k_indices", dtype=None)
+        save(store.top_k_values, folder_name, f"{name}_top_k_values", dtype=None)
+    # written last, a reader never finds it next to arrays of an older store
+    save({"num_classes": store.num_classes, "top_k": store.top_k}, folder_name, f"{name}_label_store", dtype=None)
+
+def load_label_store(folder_name, name, load=load_artifact):
+    """The LabelStore saved as name, its arrays memory-mapped."""
+    metadata = load(folder_name, f"{name}_label_store")
+    if not metadata["top_k"]:
+        return LabelStore(load(folder_name, f"{name}_labels"), metadata["num_classes"])
+    return LabelStore(load(folder_name, f"{name}_labels"), metadata["num_classes"],
+                      load(folder_name, f"{name}_top_k_indices"), load(folder_name, f"{name}_top_k_values"))
@@ -253,7 +253,7 @@ def plot_attributes(df: pd.DataFrame, rules: list, folder_name: str):
     img_folder = os.path.join("img", folder_name)
     os.makedirs(img_folder, exist_ok=True)
     # Group by case_id to ensure each case is only counted once
-    grouped = df.groupby('case_id')
+    grouped = df.groupby('case_id', observed=True)
 
     # Collect unique attributes and their rules
     attribute_rules = {}
@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Settings
+CACHE_MAX_MB = int(os.environ.get("SESSION_CACHE_MB", 2048))  # memory budget per worker process
+
+
+def estimate_size(value):
+    """Rough size in bytes of a cached value, used for the memory budget."""
+    if isinstance(value, np.memmap):
+        return sys.getsizeof(value)  # the pages belong to the OS page cache, shared between workers
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "indptr"):
+        # scipy sparse matrix
+        return sum(estimate_size(part) for part in (value.data, value.indices, value.indptr))
+    if hasattr(value, "memory_usage") and hasattr(value, "columns"):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, "count_params"):
+        # keras model: weights plus optimizer slots and graph overhead
+        return value.count_params() * 4 * 3
+    if hasattr(value, "count_nodes"):
+        return value.count_nodes() * 512
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # directories (CSR arrays, trees) are replaced by renaming a new one into place, the inode tells them apart
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class SessionCache:
+    """
+    Per-process LRU cache for the decoded artifacts of a session folder (arrays, keras models, trees).
+    Entries are keyed by (folder_name, file_name) and checked against the file's mtime/size on every
+    lookup, so files rewritten by another worker are reloaded.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()  # (folder_name, file_name) -> (value, size, file signature)
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, folder_name, file_name, path, loader):
+        """Returns the cached value for the file, calling loader() on a miss or when the file changed."""
+        key = (folder_name, file_name)
+        signature = _file_signature(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and signature is not None and entry[2] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            if entry is not None:
+                self._remove(key)
+
+        value = loader()
+        with self.lock:
+            self._insert(key, value, signature)
+        return value
+
+    def put(self, folder_name, file_name, path, value):
+        """Stores a value that was just written to path, so the next lookup does not reload it."""
+        with self.lock:
+            key = (folder_name, file_name)
+            if key in self.entries:
+                self._remove(key)
+            self._insert(key, value, _file_signature(path))
+
+    def invalidate(self, folder_name, file_name=None):
+        """Drops one file of a session, or the whole session if no file_name is given."""
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == folder_name and file_name in (None, key[1])]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "sessions": len({folder_name for folder_name, _ in self.entries}),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _insert(self, key, value, signature):
+        if signature is None:
+            return
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return  # never fits, don't flush everything else for it
+        self.entries[key] = (value, size, signature)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.current_bytes -= size
+
+
+session_cache = SessionCache(max_bytes=CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,87 @@
+import os
+import re
+import sys
+import time
+import argparse
+import importlib
+import threading
+import subprocess
+from collections import defaultdict
+
+# Settings
+HEAVY_PACKAGES = ("tensorflow", "keras", "sklearn", "scipy", "pm4py", "matplotlib", "seaborn")  # listed in the startup report
+
+_imports = {}  # module name -> cost of its first import in this process
+_imports_lock = threading.RLock()
+_started_at = time.time()
+
+
+def _top_level_packages():
+    return {name.partition(".")[0] for name in list(sys.modules)}
+
+def timed_import(name, trigger="startup"):
+    """
+    Imports a module (usually on the first request that needs it) and records how long the import took,
+    what triggered it and which top-level packages it pulled in, for the startup report.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    # one import at a time, so the packages that appeared belong to this one
+    with _imports_lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        before = _top_level_packages()
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        _imports[name] = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "trigger": trigger,
+            "pid": os.getpid(),
+            "packages": sorted(_top_level_packages() - before),
+        }
+    return module
+
+def startup_report():
+    """Lazy imports done by this process so far and which heavy packages it holds."""
+    with _imports_lock:
+        imports = dict(_imports)
+    return {
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "lazy_imports": imports,
+        "heavy_packages_loaded": [package for package in HEAVY_PACKAGES if package in sys.modules],
+    }
+
+
+def import_costs(module="backend"):
+    """
+    Self import time per top-level package of a cold `import module`, from python -X importtime run in a
+    fresh interpreter. Returns ({package: seconds}, total seconds).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    costs = defaultdict(float)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+\d+\s+\|\s*(\S+)", line)
+        if match:
+            costs[match.group(2).partition(".")[0]] += int(match.group(1)) / 1e6
+    return dict(costs), sum(costs.values())
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-package import cost of a cold backend start.")
+    parser.add_argument("module", nargs="?", default="backend")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    costs, total = import_costs(args.module)
+    print(f"import {args.module}: {total:.2f}s")
+    for package, seconds in sorted(costs.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<30} {seconds:8.3f}s {100 * seconds / total:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
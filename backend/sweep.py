@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import pickle
+import socket
+import hashlib
+import threading
+import multiprocessing
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, List
+
+# Settings
+SWEEP_FOLDER = os.environ.get("SWEEP_FOLDER", os.path.join("data", "sweep"))  # shared between all machines of a sweep
+HEARTBEAT_SECONDS = 30  # claimed tasks get their lock touched this often
+STALE_SECONDS = 600  # a lock that wasn't touched for this long belongs to a dead worker
+POLL_SECONDS = 5  # wait between checks for tasks claimed by other workers
+
+
+@dataclass(eq=False)
+class Task:
+    """
+    One unit of a sweep: function(*args, *results of deps). The cache key hashes the function name,
+    the repr of args, inputs (anything else the result depends on, e.g. a file signature) and the keys
+    of the dependencies, so args must have a stable repr and big data has to come in through deps.
+    """
+    name: str
+    function: Callable
+    args: tuple = ()
+    deps: List["Task"] = field(default_factory=list)
+    inputs: Any = None
+
+    @property
+    def key(self):
+        if not hasattr(self, "_key"):
+            content = repr((f"{self.function.__module__}.{self.function.__qualname__}", self.args, self.inputs,
+                            [dep.key for dep in self.deps]))
+            self._key = hashlib.sha256(content.encode()).hexdigest()
+        return self._key
+
+
+def _result_path(key):
+    return os.path.join(SWEEP_FOLDER, "results", key[:2], f"{key}.pkl")
+
+def _lock_path(key):
+    return os.path.join(SWEEP_FOLDER, "locks", f"{key}.lock")
+
+def has_result(task):
+    return os.path.exists(_result_path(task.key))
+
+def load_result(task):
+    with open(_result_path(task.key), "rb") as f:
+        return pickle.load(f)
+
+def _store_result(task, result):
+    # write to a temp file and rename, other machines only ever see complete results
+    path = _result_path(task.key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(result, f)
+    os.replace(tmp_path, path)
+
+
+def _claim(task):
+    """Creates the task's lock file, True if this process now owns the task. Stale locks are taken over."""
+    lock_path = _lock_path(task.key)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(lock_path)
+            except FileNotFoundError:
+                continue  # released in between
+            if age < STALE_SECONDS:
+                return False
+            # pids mean nothing across machines, a lock nobody touched for STALE_SECONDS is dead
+            print(f"Taking over stale lock of {task.name}")
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            json.dump({"task": task.name, "host": socket.gethostname(), "pid": os.getpid(), "claimed_at": time.time()}, f)
+        if has_result(task):
+            # finished by someone else between our check and the claim
+            _release(task)
+            return False
+        return True
+    return False
+
+def _release(task):
+    try:
+        os.remove(_lock_path(task.key))
+    except FileNotFoundError:
+        pass
+
+
+class _Heartbeat:
+    """Touches the locks of the tasks this process is running, so other workers don't take them over."""
+
+    def __init__(self):
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def add(self, task):
+        with self.lock:
+            self.tasks[task.key] = task
+
+    def remove(self, task):
+        with self.lock:
+            self.tasks.pop(task.key, None)
+
+    def _run(self):
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            with self.lock:
+                keys = list(self.tasks)
+            for key in keys:
+                try:
+                    os.utime(_lock_path(key))
+                except FileNotFoundError:
+                    pass
+
+
+def _expand(tasks):
+    """All tasks with their dependencies, dependencies first and every key once."""
+    ordered = {}
+    def visit(task):
+        if task.key in ordered:
+            return
+        for dep in task.deps:
+            visit(dep)
+        ordered[task.key] = task
+    for task in tasks:
+        visit(task)
+    return list(ordered.values())
+
+
+def run_sweep(tasks, num_workers=1, initializer=None, initargs=()):
+    """
+    Runs the tasks and their dependencies and returns the results of tasks in order. Finished tasks are
+    loaded from the result cache in SWEEP_FOLDER. Any number of processes, on this or other machines
+    sharing SWEEP_FOLDER, can run the same sweep at once: tasks are claimed with an exclusive lock file,
+    and tasks claimed elsewhere are waited for. With num_workers > 1 claimed tasks run in a spawn process
+    pool (initializer/initargs are passed to it), otherwise in this process.
+    """
+    pending = [task for task in _expand(tasks) if not has_result(task)]
+    print(f"Sweep: {len(_expand(tasks)) - len(pending)} tasks cached, {len(pending)} to run")
+    executor = None
+    if num_workers > 1 and pending:
+        executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=initializer, initargs=initargs)
+    running = {}  # future -> task
+
+    def finish(task, result):
+        _store_result(task, result)
+        heartbeat.remove(task)
+        _release(task)
+        print(f"Finished {task.name}")
+
+    try:
+        with _Heartbeat() as heartbeat:
+            while pending or running:
+                claimed_any = False
+                for task in list(pending):
+                    if has_result(task):
+                        pending.remove(task)
+                        continue
+                    if executor is not None and len(running) >= num_workers:
+                        break
+                    if not all(has_result(dep) for dep in task.deps) or not _claim(task):
+                        continue
+                    pending.remove(task)
+                    heartbeat.add(task)
+                    claimed_any = True
+                    print(f"Running {task.name}")
+                    args = task.args + tuple(load_result(dep) for dep in task.deps)
+                    try:
+                        if executor is None:
+                            finish(task, task.function(*args))
+                        else:
+                            running[executor.submit(task.function, *args)] = task
+                    except BaseException:
+                        heartbeat.remove(task)
+                        _release(task)
+                        raise
+
+                if running:
+                    done, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = running.pop(future)
+                        try:
+                            result = future.result()
+                        except BaseException:
+                            heartbeat.remove(task)
+                            _release(task)
+                            raise
+                        finish(task, result)
+                elif pending and not claimed_any:
+                    # everything left is claimed by other workers or waits for their results
+                    time.sleep(POLL_SECONDS)
+    finally:
+        if executor is not None:
+            for future, task in running.items():
+                future.cancel()
+                _release(task)
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return [load_result(task) for task in tasks]
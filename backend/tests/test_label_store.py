@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from label_store import LabelStore, as_label_store, save_label_store, load_label_store, soft_labels_to_dense
+
+NUM_SAMPLES = 500
+NUM_CLASSES = 7
+
+
+@pytest.fixture
+def labels():
+    """Network probabilities, the distilled tree's and the edited tree's one-hot predictions, as finetune_nn gets them."""
+    rng = np.random.default_rng(0)
+    logits = rng.normal(size=(NUM_SAMPLES, NUM_CLASSES)) * 3
+    y_distilled = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    tree_labels = np.argmax(y_distilled, axis=1)
+    disagree = rng.random(NUM_SAMPLES) < 0.1  # the tree doesn't reproduce the network everywhere
+    tree_labels[disagree] = rng.integers(0, NUM_CLASSES, size=disagree.sum())
+    modified_labels = tree_labels.copy()
+    edited = rng.random(NUM_SAMPLES) < 0.2
+    modified_labels[edited] = rng.integers(0, NUM_CLASSES, size=edited.sum())
+    one_hot = np.eye(NUM_CLASSES, dtype=np.float32)
+    return y_distilled.astype(np.float32), one_hot[tree_labels], one_hot[modified_labels]
+
+
+def _changed_complete_dense(y_distilled, y_distilled_tree, y_modified):
+    """The changed_complete targets as finetune_nn built them with dense matrices."""
+    changed = np.any(y_distilled_tree != y_modified, axis=1)
+    y_changed_complete = y_distilled.copy()
+    y_changed_complete[changed] = y_modified[changed]
+    return y_changed_complete, changed
+
+
+def _changed_complete_store(y_distilled, y_distilled_tree, y_modified, top_k):
+    """The changed_complete targets as finetune_nn builds them now."""
+    y_distilled = LabelStore.from_probabilities(y_distilled, top_k=top_k)
+    y_distilled_tree = as_label_store(y_distilled_tree, NUM_CLASSES)
+    y_modified = as_label_store(y_modified, NUM_CLASSES)
+    changed_indices = np.flatnonzero(y_distilled_tree.labels != y_modified.labels)
+    return y_distilled.with_hard_labels(changed_indices, y_modified.labels[changed_indices])
+
+
+def test_changed_complete_all_classes_kept(labels):
+    expected, changed = _changed_complete_dense(*labels)
+    assert 0 < changed.sum() < NUM_SAMPLES
+    targets = _changed_complete_store(*labels, top_k=NUM_CLASSES)
+
+    dense = targets.dense()
+    assert dense.dtype == np.float32 and dense.shape == expected.shape
+    np.testing.assert_array_equal(dense[changed], expected[changed])  # the edited labels are exact one-hot rows
+    np.testing.assert_allclose(dense, expected, atol=2e-3)  # the others lose only float16 precision
+    np.testing.assert_array_equal(targets.labels, np.argmax(expected, axis=1))
+
+
+def test_changed_complete_top_k(labels):
+    y_distilled = labels[0]
+    expected, changed = _changed_complete_dense(*labels)
+    targets = _changed_complete_store(*labels, top_k=3)
+    dense = targets.dense()
+
+    np.testing.assert_array_equal(dense[changed], expected[changed])
+    # unchanged rows keep their 3 most probable classes, renormalized to sum to 1
+    kept = np.argsort(-y_distilled, axis=1)[:, :3]
+    truncated = np.zeros_like(y_distilled)
+    np.put_along_axis(truncated, kept, np.take_along_axis(y_distilled, kept, axis=1), axis=1)
+    truncated /= truncated.sum(axis=1, keepdims=True)
+    np.testing.assert_allclose(dense[~changed], truncated[~changed], atol=2e-3)
+    np.testing.assert_allclose(dense.sum(axis=1), 1, atol=1e-5)
+
+
+def test_dense_rows_and_slices(labels):
+    targets = _changed_complete_store(*labels, top_k=3)
+    full = targets.dense()
+    rows = np.array([4, 0, 250, 499, 4])
+    np.testing.assert_array_equal(targets.dense(rows), full[rows])
+    np.testing.assert_array_equal(targets.dense(slice(100, 200)), full[100:200])
+    np.testing.assert_array_equal(targets[100:200].dense(), full[100:200])
+    assert len(targets[rows]) == len(rows)
+
+    # a second edit overrides the first one's hard labels and keeps the others
+    again = targets.with_hard_labels([0, 1], [6, 6])
+    np.testing.assert_array_equal(again.dense([0, 1]), np.eye(NUM_CLASSES, dtype=np.float32)[[6, 6]])
+    np.testing.assert_array_equal(again.dense(slice(2, None)), full[2:])
+    np.testing.assert_array_equal(targets.dense(), full)  # the original is unchanged
+
+
+def test_hard_only_store(labels):
+    _, _, y_modified = labels
+    store = as_label_store(y_modified, NUM_CLASSES)
+    assert store.soft  # a dense matrix keeps all its columns
+    np.testing.assert_array_equal(store.dense(), y_modified)
+    hard = LabelStore.from_labels(np.argmax(y_modified, axis=1), NUM_CLASSES)
+    assert not hard.soft and hard.labels.dtype == np.int16
+    np.testing.assert_array_equal(hard.dense(), y_modified)
+    np.testing.assert_array_equal(soft_labels_to_dense(np.zeros((2, 1)), np.zeros((2, 1)), NUM_CLASSES), np.zeros((2, NUM_CLASSES)))
+
+
+@pytest.mark.parametrize("top_k", [0, 3])
+def test_save_load_round_trip(labels, tmp_path, monkeypatch, top_k):
+    monkeypatch.chdir(tmp_path)
+    store = LabelStore.from_probabilities(labels[0], top_k=top_k)
+    save_label_store(store, "session", "y_distilled")
+    loaded = load_label_store("session", "y_distilled")
+    assert loaded.num_classes == NUM_CLASSES and loaded.top_k == store.top_k
+    np.testing.assert_array_equal(loaded.labels, store.labels)
+    np.testing.assert_array_equal(loaded.dense(), store.dense())
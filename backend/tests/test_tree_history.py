@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+import pytest
+
+import tree_history
+from decision_tree import train_dt, save_tree, calculate_metrics
+from tree_history import TreeHistory, tree_file_path
+
+FOLDER = "session"
+CLASS_NAMES = ["a", "b", "c"]
+FEATURE_NAMES = ["gender = female", "gender = male", "age", "time_delta"]
+FEATURE_INDICES = {"gender": [0, 1], "age": [2], "time_delta": [3]}  # attribute -> features, delete_node regrows without them
+
+
+def _data(num_samples, rng):
+    X = rng.random((num_samples, 4))
+    labels = (X[:, 0] > 0.5).astype(int) + (X[:, 1] > 0.3) * (X[:, 2] > 0.6)
+    # some label noise, so the tree has splits worth editing
+    noise = rng.random(num_samples) < 0.1
+    labels[noise] = rng.integers(0, len(CLASS_NAMES), size=noise.sum())
+    return X, np.eye(len(CLASS_NAMES), dtype=np.float32)[labels]
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """A distilled tree at version 0 of a fresh history, in a temporary models folder."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tree_history, "SNAPSHOT_EVERY", 2)  # replays from snapshots as well as from the base tree
+    rng = np.random.default_rng(0)
+    X_train, y_train = _data(600, rng)
+    X_test, y_test = _data(300, rng)
+    tree = train_dt(X_train, np.argmax(y_train, axis=1), feature_names=FEATURE_NAMES, class_names=CLASS_NAMES, feature_indices=FEATURE_INDICES)
+    os.makedirs(os.path.join("models", FOLDER))
+    save_tree(tree, tree_file_path(FOLDER))
+    return TreeHistory(FOLDER), X_train, y_train, X_test, y_test
+
+
+def _inner_nodes(tree):
+    nodes, stack = [], [tree.root]
+    while stack:
+        node = stack.pop()
+        if node.output is None:
+            nodes.append(node)
+            stack.extend([node.right, node.left])
+    return nodes
+
+
+def _full_metrics(tree, X_test, y_test):
+    return calculate_metrics(y_test, tree.predict(X_test))
+
+
+def _assert_metrics_equal(metrics, expected):
+    assert metrics.keys() == expected.keys()
+    for name in expected:
+        assert metrics[name] == pytest.approx(expected[name])
+
+
+def _edit(history, X_test, y_test, edit):
+    """Applies edit to the materialized head like the edit routes do and checks the tracked metrics after it."""
+    tree = history.materialize()
+    evaluation = tree.track_evaluation(X_test, y_test)
+    operation = edit(tree)
+    history.record(tree, operation)
+    _assert_metrics_equal(evaluation.metrics(), _full_metrics(tree, X_test, y_test))
+    return evaluation.metrics()
+
+
+def test_edit_undo_redo_checkout_metrics(session):
+    history, X_train, y_train, X_test, y_test = session
+    y_encoded = np.argmax(y_train, axis=1)
+    versions = {0: _full_metrics(history.materialize(), X_test, y_test)}
+
+    versions[1] = _edit(history, X_test, y_test, lambda tree: tree.delete_branch(_inner_nodes(tree)[2].node_id, "left"))
+    versions[2] = _edit(history, X_test, y_test, lambda tree: tree.change_feature(tree.root.node_id, 3, 0.5, flip=True))
+    versions[3] = _edit(history, X_test, y_test, lambda tree: tree.delete_node(X_train, y_encoded, _inner_nodes(tree)[1].node_id))
+    versions[4] = _edit(history, X_test, y_test, lambda tree: tree.modify_node(tree.root.node_id, threshold=0.4))
+
+    def check_head(expected_version):
+        tree = history.materialize()
+        assert tree.version == expected_version == history.head()
+        metrics = tree.track_evaluation(X_test, y_test).metrics()
+        _assert_metrics_equal(metrics, _full_metrics(tree, X_test, y_test))
+        _assert_metrics_equal(metrics, versions[expected_version])
+
+    assert history.undo() == 3
+    check_head(3)
+    assert history.undo() == 2
+    check_head(2)
+    assert history.redo() == 3
+    check_head(3)
+
+    # editing an older version starts a branch, redo follows the newest child
+    assert history.checkout(1) == 1
+    check_head(1)
+    versions[5] = _edit(history, X_test, y_test, lambda tree: tree.delete_branch(tree.root.node_id, "left"))
+    assert history.undo() == 1
+    assert history.redo() == 5
+    check_head(5)
+
+    for version in (4, 0, 2):
+        assert history.checkout(version) == version
+        check_head(version)
+    assert [record["version"] for record in history.versions()] == [1, 2, 3, 4, 5]
+
+
+def test_history_replays_from_disk(session):
+    history, X_train, y_train, X_test, y_test = session
+    _edit(history, X_test, y_test, lambda tree: tree.delete_branch(_inner_nodes(tree)[2].node_id, "left"))
+    _edit(history, X_test, y_test, lambda tree: tree.change_feature(tree.root.node_id, 2, 0.3))
+    _edit(history, X_test, y_test, lambda tree: tree.modify_node(tree.root.node_id, feature_index=1))
+    history.undo()
+
+    # another worker: nothing cached, versions come from the log, the snapshots and the base tree
+    reloaded = TreeHistory(FOLDER)
+    assert reloaded.head() == 2
+    for version in (0, 1, 2, 3):
+        expected = history.materialize(version)
+        tree = reloaded.materialize(version)
+        np.testing.assert_array_equal(tree.predict(X_test), expected.predict(X_test))
+        _assert_metrics_equal(tree.track_evaluation(X_test, y_test).metrics(), _full_metrics(expected, X_test, y_test))
+
+
+def test_invalid_edits(session):
+    history, _, _, _, _ = session
+    tree = history.materialize()
+    leaf = tree.root
+    while leaf.output is None:
+        leaf = leaf.left
+    with pytest.raises(ValueError):
+        tree.change_feature(10 ** 6, 0, 0.5)
+    with pytest.raises(ValueError):
+        tree.change_feature(leaf.node_id, 0, 0.5, flip=True)
+    with pytest.raises(ValueError):
+        history.checkout(7)
+    assert history.undo() is None
+    assert history.redo() is None
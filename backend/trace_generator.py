@@ -1,10 +1,18 @@
 import random
 import string
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Any, Optional, Tuple
 from tqdm import tqdm 
+from concurrent.futures import ProcessPoolExecutor
 import operator
+import numpy as np
+import pandas as pd
+
+# Settings
+SHARD_CASES = 5000  # cases simulated per shard, every shard gets its own RNG stream
+NAME_CHARACTERS = np.array(list(string.ascii_letters))
+ATTRIBUTE_CHARACTERS = np.array(list(string.ascii_letters + string.digits))
 
 @dataclass
 class Event:
@@ -97,6 +105,188 @@ class ProcessModel:
 
         return None
 
+    def compile(self) -> "CompiledProcessModel":
+        """Converts the transitions into arrays for the batch simulation in TraceGenerator."""
+        index = {activity: i for i, activity in enumerate(self.activities)}
+        atoms = []
+        for activity in self.activities:
+            for _, conditions in self.transitions[activity]:
+                for atom in conditions:
+                    if atom not in atoms:
+                        atoms.append(atom)
+
+        max_transitions = max([len(self.transitions[activity]) for activity in self.activities], default=0)
+        targets = np.full((len(self.activities), max(max_transitions, 1)), -1, dtype=np.int64)
+        factors = np.ones((len(self.activities), max(max_transitions, 1), len(atoms)))
+        for i, activity in enumerate(self.activities):
+            for j, (next_activity, conditions) in enumerate(self.transitions[activity]):
+                targets[i, j] = index[next_activity]
+                for atom, prob in conditions.items():
+                    factors[i, j, atoms.index(atom)] = prob
+
+        return CompiledProcessModel(
+            activities=list(self.activities),
+            start=index.get(self.start_activity, -1),
+            targets=targets,
+            factors=factors,
+            atoms=atoms,
+        )
+
+@dataclass
+class CompiledProcessModel:
+    """
+    Array form of a ProcessModel. Every distinct (attribute, condition) pair of the transitions is an
+    atom; a transition's probability is the product of factors[from, j, atom] over the atoms a case
+    satisfies, like get_next_activity. targets[from, j] is the activity of transition j (-1 = none).
+    """
+    activities: List[str]
+    start: int
+    targets: np.ndarray
+    factors: np.ndarray
+    atoms: List[Tuple[str, Any]]
+
+    def evaluate_atoms(self, categorical: Dict[str, np.ndarray], numerical: Dict[str, np.ndarray], num_cases: int) -> np.ndarray:
+        """Boolean matrix (cases x atoms) of the conditions every case satisfies."""
+        ops = {"==": operator.eq, ">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le}
+        truth = np.zeros((num_cases, len(self.atoms)), dtype=bool)
+        for k, (attr, cond) in enumerate(self.atoms):
+            if isinstance(cond, tuple) and len(cond) == 2:
+                operator_key, threshold = cond
+                values = numerical.get(attr, np.full(num_cases, float('inf')))
+                truth[:, k] = ops[operator_key](values, threshold)
+            elif attr in categorical:
+                truth[:, k] = categorical[attr] == cond
+            else:
+                truth[:, k] = cond is None
+        return truth
+
+    def transition_tables(self, truth: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Groups cases with the same atom values into buckets and returns the bucket of every case and
+        the transition probabilities per bucket (buckets x activities x transitions).
+        """
+        bucket_truth, buckets = np.unique(truth, axis=0, return_inverse=True)
+        probabilities = np.where(bucket_truth[:, None, None, :], self.factors[None], 1.0).prod(axis=-1)
+        probabilities[:, self.targets < 0] = 0
+        return buckets.ravel(), probabilities
+
+@dataclass
+class SimulatedLog:
+    """Columnar output of the batch simulation: one row per event, case attributes per case."""
+    start_time: datetime
+    case_ids: np.ndarray                          # case_id per case
+    event_cases: np.ndarray                       # case position per event, events grouped by case in order
+    event_activities: np.ndarray                  # activity code per event, index into activity_names
+    event_times: np.ndarray                       # int64 seconds since start_time per event
+    activity_names: List[str]
+    categorical_attributes: Dict[str, np.ndarray] = field(default_factory=dict)
+    numerical_attributes: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    def to_dataframe(self, time_column: str = "time") -> pd.DataFrame:
+        """
+        One row per event with case_id, activity, time and the case attributes, built straight from the
+        column arrays. case_id, activity and categorical attributes are categoricals.
+        """
+        # noise names may repeat, so map the codes onto the distinct names
+        name_codes, names = pd.factorize(np.array(self.activity_names, dtype=object))
+        columns = {
+            "case_id": pd.Categorical.from_codes(self.event_cases, categories=self.case_ids),
+            "activity": pd.Categorical.from_codes(name_codes[self.event_activities], categories=names),
+            time_column: pd.Timestamp(self.start_time) + pd.to_timedelta(self.event_times, unit="s"),
+        }
+        for attr, values in self.categorical_attributes.items():
+            codes, categories = pd.factorize(values)
+            columns[attr] = pd.Categorical.from_codes(codes[self.event_cases], categories=categories)
+        for attr, values in self.numerical_attributes.items():
+            columns[attr] = values[self.event_cases]
+        return pd.DataFrame(columns)
+
+    def to_cases(self) -> List["Case"]:
+        timestamps = (pd.Timestamp(self.start_time) + pd.to_timedelta(self.event_times, unit="s")).to_pydatetime()
+        names = np.array(self.activity_names, dtype=object)[self.event_activities]
+        bounds = np.searchsorted(self.event_cases, np.arange(len(self.case_ids) + 1))
+        cases = []
+        for i, case_id in enumerate(self.case_ids.tolist()):
+            cases.append(Case(
+                case_id=case_id,
+                categorical_attributes={attr: values[i] for attr, values in self.categorical_attributes.items()},
+                numerical_attributes={attr: values[i] for attr, values in self.numerical_attributes.items()},
+                events=[Event(activity=names[e], timestamp=timestamps[e]) for e in range(bounds[i], bounds[i + 1])],
+            ))
+        return cases
+
+def _random_strings(rng, characters, count, length=10):
+    return ["".join(chars) for chars in rng.choice(characters, size=(count, length))]
+
+def _simulate_shard(compiled, process_model, case_offsets, max_steps, noise, seed):
+    """Simulates one shard of cases, all active cases advance one step at a time."""
+    noise_transition, noise_event, noise_time, noise_attribute = noise
+    rng = np.random.default_rng(seed)
+    num_cases = len(case_offsets)
+    num_activities = len(compiled.activities)
+
+    categorical = {}
+    for attr, value_probs in process_model.categorical_attribute_distribution.items():
+        values, probabilities = zip(*value_probs)
+        probabilities = np.array(probabilities, dtype=float)
+        chosen = np.array(values, dtype=object)[rng.choice(len(values), size=num_cases, p=probabilities / probabilities.sum())]
+        noisy = np.flatnonzero(rng.random(num_cases) < noise_attribute)
+        chosen[noisy] = _random_strings(rng, ATTRIBUTE_CHARACTERS, len(noisy))
+        categorical[attr] = chosen
+    numerical = {}
+    for attr, (mean, stddev, min_val, max_val) in process_model.numerical_attribute_distribution.items():
+        values = rng.normal(mean, stddev, size=num_cases)
+        if min_val is not None:
+            values = np.maximum(min_val, values)
+        if max_val is not None:
+            values = np.minimum(max_val, values)
+        numerical[attr] = np.round(values).astype(np.int64)  # generate_case always rounds
+
+    buckets, probabilities = compiled.transition_tables(compiled.evaluate_atoms(categorical, numerical, num_cases))
+    cumulative = probabilities.cumsum(axis=-1)
+    totals = cumulative[..., -1]
+
+    current = np.full(num_cases, compiled.start, dtype=np.int64)
+    times = np.asarray(case_offsets, dtype=np.int64).copy()
+    steps = []
+    for _ in range(max_steps):
+        active = np.flatnonzero(current >= 0)
+        if active.size == 0:
+            break
+        activities = current[active]
+        noisy_event = rng.random(active.size) < noise_event
+        steps.append((active, np.where(noisy_event, -1, activities), times[active]))
+
+        # sample the next activity from the bucket's table, only transitions with probability > 0 count
+        case_buckets = buckets[active]
+        total = totals[case_buckets, activities]
+        r = rng.random(active.size) * total
+        candidates = (cumulative[case_buckets, activities] >= r[:, None]) & (probabilities[case_buckets, activities] > 0)
+        choice = candidates.argmax(axis=1)
+        next_activities = np.where(total > 0, compiled.targets[activities, choice], -1)
+        noisy_transition = rng.random(active.size) < noise_transition
+        next_activities[noisy_transition] = rng.integers(0, num_activities, size=noisy_transition.sum())
+        current[active] = next_activities
+
+        noisy_time = rng.random(active.size) < noise_time
+        offsets = rng.integers(1, 11, size=active.size) * 60
+        offsets[noisy_time] = (rng.integers(-2, 3, size=noisy_time.sum()) * 86400
+                               + rng.integers(-30, 31, size=noisy_time.sum()) * 60)
+        times[active] += offsets
+
+    if steps:
+        event_cases, event_activities, event_times = (np.concatenate(parts) for parts in zip(*steps))
+    else:
+        event_cases, event_activities, event_times = (np.empty(0, dtype=np.int64) for _ in range(3))
+    order = np.argsort(event_cases, kind="stable")  # steps are in time order, group them by case
+    event_cases, event_activities, event_times = event_cases[order], event_activities[order], event_times[order]
+
+    # noisy events get random names appended to the vocabulary
+    noisy = np.flatnonzero(event_activities < 0)
+    noise_names = _random_strings(rng, NAME_CHARACTERS, len(noisy))
+    event_activities[noisy] = num_activities + np.arange(len(noisy))
+    return event_cases, event_activities, event_times, noise_names, categorical, numerical
+
 @dataclass
 class TraceGenerator:
     process_model: ProcessModel
@@ -106,44 +296,62 @@ class TraceGenerator:
     noise_time: float = 0.00 
     noise_attribute: float = 0.000
 
-    def generate_traces(self, start_time: datetime = datetime(2025, 3, 18), num_cases: int = 1000, max_steps: int = 100) -> List[Case]:
-        cases = []
-        for _ in tqdm(range(num_cases), desc="generating data"):
-            case = self.generate_case()
-            current_activity = self.process_model.start_activity
-            current_time = start_time
-
-            for _ in range(max_steps):
-                if not current_activity:
-                    break
-
-                if random.random() < self.noise_event:
-                    event_name = ''.join(random.choices(string.ascii_letters, k=10))
-                else:
-                    event_name = current_activity
-
-                event = Event(activity=event_name, timestamp=current_time)
-                case.events.append(event)
-
-                if random.random() < self.noise_transition:
-                    current_activity = random.choice(self.process_model.activities)
-                else:
-                    current_activity = self.process_model.get_next_activity(
-                        current_activity, 
-                        case.categorical_attributes, 
-                        case.numerical_attributes
-                    )
-
-                if random.random() < self.noise_time:
-                    time_offset = timedelta(days=random.randint(-2, 2), minutes=random.randint(-30, 30))
-                    current_time += time_offset
-                else:
-                    current_time += timedelta(minutes=random.randint(1, 10))
-
-            cases.append(case)
-            start_time += timedelta(minutes=random.randint(1, 10))
-
-        return cases
+    def generate_traces(self, start_time: datetime = datetime(2025, 3, 18), num_cases: int = 1000, max_steps: int = 100, seed: Optional[int] = None, num_workers: int = 1) -> List[Case]:
+        return self.simulate(start_time=start_time, num_cases=num_cases, max_steps=max_steps, seed=seed, num_workers=num_workers).to_cases()
+
+    def simulate(self, start_time: datetime = datetime(2025, 3, 18), num_cases: int = 1000, max_steps: int = 100, seed: Optional[int] = None, num_workers: int = 1) -> SimulatedLog:
+        """
+        Batch version of the case-by-case simulation. Cases are split into shards of SHARD_CASES with
+        independent RNG streams spawned from seed, so the log only depends on the seed and not on
+        num_workers. Shards run in num_workers processes.
+        """
+        compiled = self.process_model.compile()
+        seed_sequence = np.random.SeedSequence(seed)
+        start_sequence, shard_sequence = seed_sequence.spawn(2)
+
+        # every case starts 1-10 minutes after the previous one
+        case_offsets = np.concatenate([[0], np.cumsum(np.random.default_rng(start_sequence).integers(1, 11, size=num_cases - 1) * 60)]) if num_cases else np.empty(0, dtype=np.int64)
+        bounds = list(range(0, num_cases, SHARD_CASES)) + [num_cases]
+        shard_seeds = shard_sequence.spawn(len(bounds) - 1)
+        noise = (self.noise_transition, self.noise_event, self.noise_time, self.noise_attribute)
+        args = [(compiled, self.process_model, case_offsets[start:end], max_steps, noise, shard_seed)
+                for start, end, shard_seed in zip(bounds[:-1], bounds[1:], shard_seeds)]
+
+        if num_workers > 1 and len(args) > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                shards = list(tqdm(executor.map(_simulate_shard, *zip(*args)), total=len(args), desc="generating data"))
+        else:
+            shards = [_simulate_shard(*shard_args) for shard_args in tqdm(args, desc="generating data")]
+
+        # merge the shards, shifting case positions and the codes of the noise names
+        activity_names = list(compiled.activities)
+        event_cases, event_activities, event_times = [], [], []
+        categorical = {attr: [] for attr in self.process_model.categorical_attribute_distribution}
+        numerical = {attr: [] for attr in self.process_model.numerical_attribute_distribution}
+        for start, (cases, activities, times, noise_names, shard_categorical, shard_numerical) in zip(bounds, shards):
+            noisy = activities >= len(compiled.activities)
+            activities[noisy] += len(activity_names) - len(compiled.activities)
+            activity_names.extend(noise_names)
+            event_cases.append(cases + start)
+            event_activities.append(activities)
+            event_times.append(times)
+            for attr in categorical:
+                categorical[attr].append(shard_categorical[attr])
+            for attr in numerical:
+                numerical[attr].append(shard_numerical[attr])
+
+        log = SimulatedLog(
+            start_time=start_time,
+            case_ids=np.arange(self.current_case_id, self.current_case_id + num_cases),
+            event_cases=np.concatenate(event_cases) if shards else np.empty(0, dtype=np.int64),
+            event_activities=np.concatenate(event_activities) if shards else np.empty(0, dtype=np.int64),
+            event_times=np.concatenate(event_times) if shards else np.empty(0, dtype=np.int64),
+            activity_names=activity_names,
+            categorical_attributes={attr: np.concatenate(values) for attr, values in categorical.items() if values},
+            numerical_attributes={attr: np.concatenate(values) for attr, values in numerical.items() if values},
+        )
+        self.current_case_id += num_cases
+        return log
 
     def generate_case(self) -> Case:
         case_id = self.current_case_id
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+from tensorflow.keras.callbacks import Callback
+from tensorflow.keras.models import load_model
+
+from artifacts import save_json, load_json
+from jobs import report_progress
+
+# Settings
+MODELS_FOLDER = "models"
+CHECKPOINT_FOLDER = "checkpoints"
+CHECKPOINT_EVERY = int(os.environ.get("NN_CHECKPOINT_EVERY", 1))  # epochs between checkpoints of a session's training
+PATIENCE = int(os.environ.get("NN_PATIENCE", 3))  # epochs without a better validation loss before stopping, 0 trains all epochs
+MIN_DELTA = 1e-4  # smallest validation loss decrease that counts as better
+VALIDATION_SPLIT = float(os.environ.get("NN_VALIDATION_SPLIT", 0.1))  # share of X_train's rows held out for early stopping, never the test set
+VALIDATION_SEED = 0  # picks the held out rows, the same rows for every run on the same data
+TRAINING_LOG = "training_log.json"  # per-epoch time and throughput, next to nn_evaluation.json
+
+
+def run_key(stage, config, arrays=()):
+    """Hash of a training configuration and its starting arrays (weights, targets), a resubmitted job resumes only with the same key."""
+    digest = hashlib.sha256(json.dumps([stage, config], sort_keys=True, default=str).encode())
+    for array in arrays:
+        if array is not None:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+def split_validation(X, y, validation_split=VALIDATION_SPLIT, seed=VALIDATION_SEED):
+    """
+    (X, y) without a seeded random validation_split of its rows, and those rows as the validation data
+    early stopping watches. X is in case order, its last rows would only be the latest cases.
+    """
+    num_rows = X.shape[0]
+    held_out = np.zeros(num_rows, dtype=bool)
+    held_out[np.random.default_rng(seed).choice(num_rows, size=num_rows - int(num_rows * (1 - validation_split)), replace=False)] = True
+    # sorted, both parts keep the case order of X
+    train_rows, validation_rows = np.flatnonzero(~held_out), np.flatnonzero(held_out)
+    return X[train_rows], y[train_rows], (X[validation_rows], y[validation_rows])
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class TrainingControl(Callback):
+    """
+    Controls one fit of train_nn/finetune_nn:
+    - early stopping once the validation loss did not improve for patience epochs, the best weights
+      are restored by finish;
+    - with a folder_name, a checkpoint every checkpoint_every epochs under
+      models/<folder>/checkpoints/<stage>_<key>/ (the model with its optimizer, the best weights and
+      state.json), from which a fit with the same key continues (resume) after a worker restart;
+    - wall-clock seconds and samples/s of every epoch, stored per stage in data/<folder>/TRAINING_LOG.
+    """
+
+    def __init__(self, stage, num_samples, folder_name=None, key=None, patience=PATIENCE, checkpoint_every=CHECKPOINT_EVERY):
+        super().__init__()
+        self.stage = stage
+        self.num_samples = num_samples
+        self.folder_name = folder_name
+        self.key = key
+        self.patience = patience
+        self.checkpoint_every = checkpoint_every
+        self.folder = os.path.join(MODELS_FOLDER, folder_name, CHECKPOINT_FOLDER, f"{stage}_{key}") if folder_name and key else None
+        self.state = {"epoch": 0, "best": None, "best_epoch": None, "wait": 0, "stopped_epoch": None, "model_file": None, "epochs": []}
+        self.best_weights = None
+        self.epoch_started_at = None
+
+    def _state_path(self):
+        return os.path.join(self.folder, "state.json")
+
+    def _best_path(self):
+        return os.path.join(self.folder, "best.weights.h5")
+
+    def resume(self):
+        """The checkpointed model (compiled, with its optimizer state) of an interrupted fit with the same key, else None."""
+        if self.folder is None:
+            return None
+        # checkpoints of other configurations of the stage can't be resumed anymore
+        parent = os.path.dirname(self.folder)
+        if os.path.isdir(parent):
+            for name in os.listdir(parent):
+                if name.startswith(f"{self.stage}_") and os.path.join(parent, name) != self.folder:
+                    shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+        try:
+            with open(self._state_path(), "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        model = load_model(os.path.join(self.folder, state["model_file"]))
+        self.state = state
+        print(f"Resuming {self.stage} after epoch {state['epoch']}")
+        return model
+
+    def initial_epoch(self, epochs):
+        """Epoch fit starts at, epochs if a resumed fit already stopped early."""
+        return epochs if self.state["stopped_epoch"] else self.state["epoch"]
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_started_at = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self.epoch_started_at
+        logs = {key: float(value) for key, value in (logs or {}).items()}
+        self.state["epochs"].append({"epoch": epoch + 1, "seconds": round(seconds, 3), "samples_per_second": round(self.num_samples / seconds, 1), **logs})
+        self.state["epoch"] = epoch + 1
+
+        monitor = logs.get("val_loss")
+        if self.patience and monitor is not None:
+            if self.state["best"] is None or monitor < self.state["best"] - MIN_DELTA:
+                self.state.update(best=monitor, best_epoch=epoch + 1, wait=0)
+                self.best_weights = self.model.get_weights()
+                if self.folder is not None:
+                    os.makedirs(self.folder, exist_ok=True)
+                    tmp_path = os.path.join(self.folder, "best.tmp.weights.h5")
+                    self.model.save_weights(tmp_path)
+                    os.replace(tmp_path, self._best_path())
+            else:
+                self.state["wait"] += 1
+                if self.state["wait"] >= self.patience:
+                    self.state["stopped_epoch"] = epoch + 1
+                    self.model.stop_training = True
+                    print(f"Early stopping {self.stage} after epoch {epoch + 1}, best epoch {self.state['best_epoch']}")
+
+        if self.folder is not None and ((epoch + 1) % self.checkpoint_every == 0 or self.state["stopped_epoch"]):
+            self._checkpoint()
+        self._write_log(finished=False)
+        report_progress(samples_per_second=self.state["epochs"][-1]["samples_per_second"])
+
+    def _checkpoint(self):
+        os.makedirs(self.folder, exist_ok=True)
+        previous = self.state["model_file"]
+        self.state["model_file"] = f"epoch_{self.state['epoch']}.keras"
+        # the state names the model file, so it is only replaced once the new model is complete
+        self.model.save(os.path.join(self.folder, self.state["model_file"]))
+        _write_json(self._state_path(), self.state)
+        if previous and previous != self.state["model_file"]:
+            os.remove(os.path.join(self.folder, previous))
+
+    def _write_log(self, finished):
+        if not self.folder_name:
+            return
+        try:
+            log = load_json(self.folder_name, TRAINING_LOG)
+        except FileNotFoundError:
+            log = {}
+        log[self.stage] = {
+            "run": self.key,
+            "samples": self.num_samples,
+            "best_epoch": self.state["best_epoch"],
+            "stopped_epoch": self.state["stopped_epoch"],
+            "finished": finished,
+            "epochs": self.state["epochs"],
+        }
+        save_json(log, self.folder_name, TRAINING_LOG)
+
+    def finish(self, model):
+        """Restores the best weights if early stopping watched a validation loss, and drops the checkpoints of the finished fit."""
+        if self.state["best_epoch"] is not None and self.state["best_epoch"] != self.state["epoch"]:
+            if self.best_weights is not None:
+                model.set_weights(self.best_weights)
+            elif self.folder is not None and os.path.exists(self._best_path()):
+                model.load_weights(self._best_path())  # best epoch was before the resume
+        self._write_log(finished=True)
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+        return model
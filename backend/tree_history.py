@@ -0,0 +1,237 @@
+import os
+import json
+import fcntl
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from decision_tree import DecisionTreeClassifier, save_tree, load_tree
+
+# Settings
+MODELS_FOLDER = "models"
+TREE_FILE = "tree.flat"  # distilled tree, in the flat tree format of decision_tree.save_tree
+LEGACY_TREE_FILE = "tree.json"  # sessions distilled before the flat format
+HISTORY_FOLDER = "tree_history"
+SNAPSHOT_EVERY = int(os.environ.get("TREE_SNAPSHOT_EVERY", 25))  # operations replayed at most to materialize a version
+CACHED_VERSIONS = 256  # materialized roots kept per session, they share all untouched nodes
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def _folder(folder_name):
+    return os.path.join(MODELS_FOLDER, folder_name, HISTORY_FOLDER)
+
+def tree_file_path(folder_name):
+    """Path of the session's distilled tree, the legacy JSON file if the session only has that."""
+    path = os.path.join(MODELS_FOLDER, folder_name, TREE_FILE)
+    legacy_path = os.path.join(MODELS_FOLDER, folder_name, LEGACY_TREE_FILE)
+    return legacy_path if not os.path.exists(path) and os.path.exists(legacy_path) else path
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class TreeHistory:
+    """
+    Edit history of the distilled tree of a session. Version 0 is the tree file written by distillation,
+    every edit appends its operation (see DecisionTreeClassifier.apply_operation) as one line to
+    log.jsonl with its version and parent version, and head.json points at the current version.
+    Undo/redo/checkout only move the head. A version is materialized from the closest snapshot (written
+    every SNAPSHOT_EVERY operations along a branch) by replaying the operations after it; edits copy
+    the nodes they touch, so materialized versions share all other nodes and stay cached in memory.
+    """
+
+    def __init__(self, folder_name):
+        self.folder_name = folder_name
+        self.tree_path = tree_file_path(folder_name)
+        self.folder = _folder(folder_name)
+        self.log_path = os.path.join(self.folder, "log.jsonl")
+        self.head_path = os.path.join(self.folder, "head.json")
+        self.lock = threading.RLock()
+        self.operations = {}  # version -> operation record
+        self.log_offset = 0
+        self.base_signature = None
+        self.roots = OrderedDict()  # version -> (root, id_counter), LRU
+        self.metadata = None
+
+    @contextmanager
+    def _file_lock(self):
+        # several gunicorn workers may edit the same session
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, "history.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Reads log lines appended since the last call, drops everything if the base tree was replaced."""
+        self.tree_path = tree_file_path(self.folder_name)
+        stat = os.stat(self.tree_path)
+        signature = (self.tree_path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature != self.base_signature:
+            self.operations, self.log_offset, self.roots, self.metadata = {}, 0, OrderedDict(), None
+            self.base_signature = signature
+        try:
+            with open(self.log_path, "r") as f:
+                f.seek(self.log_offset)
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # line still being written
+                    record = json.loads(line)
+                    self.operations[record["version"]] = record
+                    self.log_offset += len(line.encode())
+        except FileNotFoundError:
+            pass
+
+    def head(self):
+        try:
+            with open(self.head_path, "r") as f:
+                return json.load(f)["head"]
+        except FileNotFoundError:
+            return 0
+
+    def latest(self):
+        with self.lock:
+            self._refresh()
+            return max(self.operations, default=0)
+
+    def _snapshot_path(self, version):
+        return os.path.join(self.folder, f"snapshot_{version}.flat")
+
+    def _chain(self, version, use_cache=True):
+        """Operations from the closest cached (if use_cache) or stored version up to version, and that starting version."""
+        chain = []
+        while version != 0 and not (use_cache and version in self.roots) and not os.path.exists(self._snapshot_path(version)):
+            record = self.operations.get(version)
+            if record is None:
+                raise ValueError(f"Version {version} of the tree does not exist.")
+            chain.append(record)
+            version = record["parent"]
+        return version, chain[::-1]
+
+    def _base_root(self, version):
+        if version in self.roots:
+            self.roots.move_to_end(version)
+            return self.roots[version]
+        if version == 0:
+            tree = load_tree(self.tree_path)
+        else:
+            # snapshots are complete trees, they can be materialized without reading the base tree
+            tree = load_tree(self._snapshot_path(version))
+        self.metadata = self.metadata or (tree.feature_names, tree.feature_indices, tree.class_names, tree.splitter, tree.max_bins)
+        return tree.root, tree.id_counter
+
+    def _cache_root(self, version, root, id_counter):
+        self.roots[version] = (root, id_counter)
+        self.roots.move_to_end(version)
+        while len(self.roots) > CACHED_VERSIONS:
+            self.roots.popitem(last=False)
+
+    def _new_tree(self, root, id_counter):
+        if self.metadata is None:
+            base = load_tree(self.tree_path)
+            self.metadata = (base.feature_names, base.feature_indices, base.class_names, base.splitter, base.max_bins)
+        feature_names, feature_indices, class_names, splitter, max_bins = self.metadata
+        tree = DecisionTreeClassifier(id_counter=id_counter, feature_names=feature_names, feature_indices=feature_indices, class_names=class_names,
+                                      splitter=splitter, max_bins=max_bins)
+        tree.root = root
+        return tree
+
+    def materialize(self, version=None):
+        """A new DecisionTreeClassifier for version (the head by default), sharing nodes with the cached versions."""
+        with self.lock:
+            self._refresh()
+            version = self.head() if version is None else version
+            start, chain = self._chain(version)
+            root, id_counter = self._base_root(start)
+            if start == 0 and start not in self.roots:
+                self._cache_root(0, root, id_counter)
+            tree = self._new_tree(root, id_counter)
+            for record in chain:
+                # replayed with the split search the edit was made with
+                tree.splitter, tree.max_bins = record.get("splitter", tree.splitter), record.get("max_bins", tree.max_bins)
+                tree.apply_operation(record["operation"])
+                self._cache_root(record["version"], tree.root, tree.id_counter)
+            tree.version = version
+            return tree
+
+    def record(self, tree, operation):
+        """Appends an operation that was just applied to tree (a materialized head) as a new version and moves the head to it."""
+        with self.lock, self._file_lock():
+            self._refresh()
+            parent = tree.version if tree.version is not None else self.head()
+            version = max(self.operations, default=0) + 1
+            record = {"version": version, "parent": parent, "operation": operation, "splitter": tree.splitter, "max_bins": tree.max_bins}
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self._refresh()
+
+            # other workers have nothing cached, count the replay from the last snapshot on disk
+            _, chain = self._chain(parent, use_cache=False)
+            if len(chain) + 1 >= SNAPSHOT_EVERY:
+                save_tree(tree, self._snapshot_path(version))
+            self._cache_root(version, tree.root, tree.id_counter)
+            _write_json(self.head_path, {"head": version})
+            tree.version = version
+            return version
+
+    def checkout(self, version):
+        with self.lock, self._file_lock():
+            self._refresh()
+            if version != 0 and version not in self.operations:
+                raise ValueError(f"Version {version} of the tree does not exist.")
+            _write_json(self.head_path, {"head": version})
+            return version
+
+    def undo(self):
+        """Moves the head to the parent version, None if the head is the distilled tree."""
+        with self.lock:
+            self._refresh()
+            head = self.head()
+            if head == 0:
+                return None
+            return self.checkout(self.operations[head]["parent"])
+
+    def redo(self):
+        """Moves the head to its most recent child version, None if there is none."""
+        with self.lock:
+            self._refresh()
+            head = self.head()
+            children = [version for version, record in self.operations.items() if record["parent"] == head]
+            if not children:
+                return None
+            return self.checkout(max(children))
+
+    def versions(self):
+        """(version, parent, op, node_id) of every recorded edit, in order."""
+        with self.lock:
+            self._refresh()
+            return [
+                {"version": version, "parent": record["parent"], "op": record["operation"]["op"], "node_id": record["operation"]["node_id"]}
+                for version, record in sorted(self.operations.items())
+            ]
+
+
+def get_tree_history(folder_name):
+    with _histories_lock:
+        if folder_name not in _histories:
+            _histories[folder_name] = TreeHistory(folder_name)
+        return _histories[folder_name]
+
+def reset_tree_history(folder_name):
+    """Drops the history of a session, called when a new tree is distilled."""
+    shutil.rmtree(_folder(folder_name), ignore_errors=True)
+    with _histories_lock:
+        _histories.pop(folder_name, None)
+
+def tree_cache_path(folder_name):
+    """The file whose mtime tracks the current tree: the head pointer once the tree was edited, else the tree file."""
+    head_path = os.path.join(_folder(folder_name), "head.json")
+    return head_path if os.path.exists(head_path) else tree_file_path(folder_name)
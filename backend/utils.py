@@ -5,6 +5,9 @@ import numpy as np
 import sys
 import json
 import argparse
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from flask import jsonify
 
 print("importing tensorflow")
@@ -16,31 +19,25 @@ from tensorflow.keras.layers import Layer
 from tensorflow.keras.layers import Dense, Input
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.utils import to_categorical
-print("importing sklearn")
-from sklearn.tree import DecisionTreeClassifier as SklearnDecisionTreeClassifier
-from sklearn.metrics import (
-    accuracy_score,
-    f1_score,
-    precision_score,
-    recall_score
-)
+from tensorflow.keras.callbacks import Callback
+from scipy import sparse
 print("importing own modules")
 from trace_generator import *
 from data_processing import *
 from decision_tree import *
 from plotting import *
-
-def save_json(data, folder_name, filename):
-    folder_path = os.path.join("data", folder_name)
-    os.makedirs(folder_path, exist_ok=True)
-    file_path = os.path.join(folder_path, filename)
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=4)
-
-def load_json(folder_name, filename):
-    file_path = os.path.join("data", folder_name, filename)
-    with open(file_path, "r") as f:
-        return json.load(f)
+from session_cache import session_cache
+from jobs import report_progress
+from sweep import Task, run_sweep
+from fairness import fairness_metrics, get_fairness_metrics, create_fairness_dataframe, iter_fairness_dataframe
+from artifacts import save_json, load_json
+from label_store import DISTILL_TOP_K, LabelStore, as_label_store
+from input_pipeline import USE_PIPELINE, DEFAULT_BATCH_SIZE, LR_SCALING, SHUFFLE_BUFFER, make_dataset, scaled_learning_rate
+from training import PATIENCE, VALIDATION_SPLIT, TrainingControl, run_key, split_validation
+
+# Settings
+FOLD_WORKERS = int(os.environ.get("FOLD_WORKERS", 1))  # processes for k_fold_evaluation
+FOLD_DETERMINISM = os.environ.get("FOLD_DETERMINISM", "0") == "1"  # deterministic TF ops for folds run in this process, fold workers always use them
 
 def generate_data(num_cases, model_name, prefix_length):
     process_model = build_process_model(model_name)
@@ -49,10 +46,23 @@ def generate_data(num_cases, model_name, prefix_length):
     X, y, class_names, feature_names, feature_indices = generate_processed_data(process_model, categorical_attributes=categorical_attributes, numerical_attributes=numerical_attributes, num_cases=num_cases, prefix_length=prefix_length, folder_name=folder_name)
     return X, y, class_names, feature_names, feature_indices
 
+class JobProgressCallback(Callback):
+    """Reports the per-epoch progress of a fit to the background job running in this process."""
+    def __init__(self, stage, epochs):
+        super().__init__()
+        self.stage = stage
+        self.epochs = epochs
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = {key: float(value) for key, value in (logs or {}).items()}
+        report_progress(stage=self.stage, epoch=epoch + 1, epochs=self.epochs, logs=logs)
+
 # define neural network architecture
-def build_nn(input_dim, output_dim, hidden_units=[512, 256, 128, 64], learning_rate=1e-3):
+def build_nn(input_dim, output_dim, hidden_units=[512, 256, 128, 64], learning_rate=1e-3, sparse_input=False):
     model = Sequential()
-    model.add(Input(shape=(input_dim,)))
+    # with a sparse input the first Dense layer is a sparse-dense matmul, i.e. it sums the weight rows
+    # of the active one-hot features like an embedding lookup, the dense one-hot block is never built
+    model.add(Input(shape=(input_dim,), sparse=sparse_input))
     for units in hidden_units:
         model.add(Dense(units, activation='relu'))
     model.add(Dense(output_dim, activation='softmax'))
@@ -63,53 +73,55 @@ def build_nn(input_dim, output_dim, hidden_units=[512, 256, 128, 64], learning_r
     return model
 
 # train and save neural network
-def train_nn(X_train, y_train, folder_name=None, hidden_units=[512, 256, 128, 64], model_name="nn.keras", epochs=10, batch_size=32, learning_rate=1e-3):
+def train_nn(X_train, y_train, folder_name=None, hidden_units=[512, 256, 128, 64], model_name="nn.keras", epochs=10, batch_size=None, learning_rate=1e-3,
+             pipeline=None, lr_scaling=None, shuffle_buffer=None, cache=None, validation_data=None, patience=None):
+    """
+    Trains a network on X_train/y_train. With the input pipeline (USE_PIPELINE unless pipeline says
+    otherwise) the batches come from make_dataset and learning_rate is scaled to batch_size (see
+    scaled_learning_rate), without it the arrays are passed to fit. Training stops early once the loss
+    on validation_data (by default a random VALIDATION_SPLIT of X_train's rows) stops improving; with a
+    folder_name it is checkpointed and resumed by a later call with the same configuration (see TrainingControl).
+    """
+    pipeline = USE_PIPELINE if pipeline is None else pipeline
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    patience = PATIENCE if patience is None else patience
+    if patience and validation_data is None and VALIDATION_SPLIT:
+        X_train, y_train, validation_data = split_validation(X_train, y_train)
     input_dim = X_train.shape[1]  # Number of input features (attributes + events)
     output_dim = y_train.shape[1]  # Number of possible events (classes)
     print("training neural network:")
     print(f"input dimension: {input_dim}")
     print(f"output dimension: {output_dim}")
-    model = build_nn(input_dim, output_dim, hidden_units=hidden_units, learning_rate=learning_rate)
-    model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size)
+    if pipeline:
+        learning_rate = scaled_learning_rate(learning_rate, batch_size, lr_scaling)
+    config = {"model_name": model_name, "hidden_units": hidden_units, "epochs": epochs, "batch_size": batch_size, "learning_rate": learning_rate,
+              "pipeline": pipeline, "patience": patience, "shape": X_train.shape}
+    key = run_key("train", config, arrays=[y_train]) if folder_name else None
+    control = TrainingControl("train", X_train.shape[0], folder_name=folder_name, key=key, patience=patience)
+    model = control.resume()
+    if model is None:
+        model = build_nn(input_dim, output_dim, hidden_units=hidden_units, learning_rate=learning_rate, sparse_input=sparse.issparse(X_train))
+    callbacks = [JobProgressCallback("train", epochs), control]
+    if pipeline:
+        validation = make_dataset(*validation_data, batch_size, shuffle=False) if validation_data is not None else None
+        model.fit(make_dataset(X_train, y_train, batch_size, shuffle_buffer=shuffle_buffer, cache=cache), epochs=epochs,
+                  initial_epoch=control.initial_epoch(epochs), validation_data=validation, callbacks=callbacks)
+    else:
+        model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size, initial_epoch=control.initial_epoch(epochs),
+                  validation_data=validation_data, callbacks=callbacks)
+    model = control.finish(model)
     print("--------------------------------------------------------------------------------------------------")
     if folder_name:
         save_nn(model, folder_name, model_name)
     return model
 
-def train_sklearn_dt(X_train, y_train, ccp_alpha=0.001, max_depth=None, min_samples_split=2, min_samples_leaf=1):
-    print("training decision tree:")
-    dt = SklearnDecisionTreeClassifier(ccp_alpha=ccp_alpha, max_depth=max_depth, 
-                                       min_samples_split=min_samples_split, 
-                                       min_samples_leaf=min_samples_leaf)
-    dt.fit(X_train, y_train)
-    print("--------------------------------------------------------------------------------------------------")
-    return dt
-
-def train_dt(X_train, y_train, ccp_alpha=0.001, max_depth=None, min_samples_split=2, min_samples_leaf=1, folder_name=None, model_name=None, feature_names=None, feature_indices=None, class_names=None):
-    dt = train_sklearn_dt(X_train, y_train, ccp_alpha=ccp_alpha, max_depth=max_depth, min_samples_split=min_samples_split, min_samples_leaf=min_samples_leaf)
-    dt = sklearn_to_custom_tree(dt, feature_names=feature_names, class_names=class_names, feature_indices=feature_indices)
-    num_nodes = dt.count_nodes()
-    dt.id_counter = num_nodes
-    if model_name and folder_name:
-        save_dt(dt, folder_name, model_name)
-    print("--------------------------------------------------------------------------------------------------")
-    return dt
-
-def train_custom_dt(X_train, y_train, folder_name=None, model_name=None, feature_names=None, feature_indices=None, class_names=None):
-    print("training decision tree:")
-    dt = DecisionTreeClassifier(class_names=class_names, feature_names=feature_names, feature_indices=feature_indices)
-    dt.fit(X_train, y_train)
-    if model_name and folder_name:
-        save_dt(dt, folder_name, model_name)
-    print("--------------------------------------------------------------------------------------------------")
-    return dt
-
 def save_nn(model, folder_name, file_name):
     #print(f"saving {file_name}...")
     full_path = os.path.join('models', folder_name)
     os.makedirs(full_path, exist_ok=True)
     file_path = os.path.join(full_path, file_name)
     model.save(file_path)
+    session_cache.invalidate(folder_name, file_name)
 
 def load_nn(folder_name, file_name):
     #print(f"loading {file_name}...")
@@ -117,133 +129,24 @@ def load_nn(folder_name, file_name):
     model = load_model(file_name)
     return model
     
-def save_dt(dt, folder_name, file_name):
-    #print(f"saving {file_name}...")
-    full_path = os.path.join('models', folder_name)
-    os.makedirs(full_path, exist_ok=True)
-    file_path = os.path.join(full_path, file_name)
-    save_tree_to_json(dt, file_path)
-
-def load_dt(folder_name, file_name):
-    #print(f"loading {file_name}...")
-    file_path = os.path.join('models', folder_name, file_name)
-    return load_tree_from_json(file_path)
-
 def evaluate_nn(model, X_test, y_test):
     print("testing nn:")
-    test_loss, test_accuracy = model.evaluate(X_test, y_test)
+    if USE_PIPELINE:
+        test_loss, test_accuracy = model.evaluate(make_dataset(X_test, y_test, shuffle=False))
+    else:
+        test_loss, test_accuracy = model.evaluate(X_test, y_test)
     print(f'accuracy: {test_accuracy:.3f}, loss: {test_loss:.3f}')
     print("--------------------------------------------------------------------------------------------------")
     return test_accuracy
 
-def calculate_metrics(y_true, y_pred):
-    y_true = np.argmax(y_true, axis=1)
-    if y_pred.ndim == 2:
-        y_pred = np.argmax(y_pred, axis=1)
-    metrics = {
-        "accuracy": accuracy_score(y_true, y_pred),
-        "precision": precision_score(y_true, y_pred, average="weighted", zero_division=0),
-        "recall": recall_score(y_true, y_pred, average="weighted", zero_division=0),
-        "f1_score": f1_score(y_true, y_pred, average="weighted", zero_division=0)
-    }
-    return metrics
-
-
 def calculate_comparable_fairness(nn_base, nn_enriched, nn_modified, X, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds):
-    networks = {
-        "base": nn_base,
-        "enriched": nn_enriched,
-        "modified": nn_modified,
-    }
-    disp_imp_results = {}
-    stat_par_results = {}
-    y = {}
     X_adjusted = remove_attribute_features(X, feature_indices, base_attributes)
-
-    for name, nn in networks.items():
-        if name == "base":
-            y[name] = nn.predict(X_adjusted)
-        else:
-            y[name] = nn.predict(X)
-
-    for decision in critical_decisions:
-        if isinstance(decision.previous, list):
-            previous_indices = [feature_names.index("-1. Event = " + prev) for prev in decision.previous]
-        else:
-            previous_indices = [feature_names.index("-1. Event = " + decision.previous)]
-        for attribute in decision.attributes:
-            feature_indices_to_use = feature_indices.get(attribute, [])
-            for feature_index in feature_indices_to_use:
-                for event in decision.possible_events:
-                    outer_key = (feature_names[feature_index], event)
-                    disp_imp_results[outer_key] = {}
-                    stat_par_results[outer_key] = {}
-                    for name, nn in networks.items():
-                        if event not in class_names:
-                            raise ValueError(f"Event '{event}' not found in class_names.")
-                        if isinstance(class_names, list):
-                            event_index = class_names.index(event)
-                        elif isinstance(class_names, np.ndarray):
-                            event_index = np.where(class_names == event)[0][0]
-                        
-                        # Adjust filter_mask to check for any of the previous features being 1
-                        filter_mask = np.any(X[:, previous_indices] == 1, axis=1)
-                        
-                        X_filtered = X[filter_mask]
-                        y_filtered = y[name][filter_mask]
-                        protected_attribute = X_filtered[:, feature_index]
-
-                        stat_par, disp_imp = get_fairness_metrics(y_filtered, protected_attribute, event_index, feature_names[feature_index], numerical_thresholds)
-
-                        disp_imp_results[outer_key][name] = disp_imp
-                        stat_par_results[outer_key][name] = stat_par
-                        print(f"Statistical Parity for {feature_names[feature_index]}, {event}, {name}: {stat_par}")
- 
-    return stat_par_results, disp_imp_results
-
-def create_fairness_dataframe(X, y, class_names, feature_names, feature_indices):
-    df_data = {
-        "prev_act": [],
-        "next_act": []
+    predictions = {
+        "base": nn_base.predict(X_adjusted),
+        "enriched": nn_enriched.predict(X),
+        "modified": nn_modified.predict(X),
     }
-
-    binary_attribute_columns = []
-
-    for attr, indices in feature_indices.items():
-        if len(indices) == 1:
-            df_data[attr] = []
-        else:
-            for idx in indices:
-                col_name = feature_names[idx]
-                binary_attribute_columns.append((attr, col_name, idx))
-                df_data[col_name] = []
-
-    event_indices = [i for i, name in enumerate(feature_names) if "-1. Event =" in name]
-
-    for i in range(X.shape[0]):
-        x_row = X[i]
-        y_val = y[i]
-        next_act = class_names[y_val]
-
-        last_event_values = x_row[event_indices]
-
-        try:
-            act_idx = np.where(last_event_values == 1)[0][0]
-            prev_act = class_names[act_idx]
-        except IndexError:
-            prev_act = "<UNK>"
-
-        df_data["prev_act"].append(prev_act)
-        df_data["next_act"].append(next_act)
-
-        for attr, indices in feature_indices.items():
-            if len(indices) == 1:
-                df_data[attr].append(x_row[indices[0]])
-
-        for attr, col_name, idx in binary_attribute_columns:
-            df_data[col_name].append(int(x_row[idx]))
-
-    return pd.DataFrame(df_data)
+    return fairness_metrics(predictions, X, critical_decisions, feature_indices, class_names, feature_names, numerical_thresholds)
 
 def calculate_statistical_parity(df: pd.DataFrame, next_act: str, attribute: str) -> float:
     if attribute not in df.columns:
@@ -263,47 +166,6 @@ def remove_attribute_features(X, feature_indices, base_attributes):
     remove_indices = [idx for attr, indices in feature_indices.items() if attr not in base_attributes for idx in indices]
     return np.delete(X, remove_indices, axis=1)
 
-def get_fairness_metrics(y, protected_attribute, event_index, feature_name, numerical_thresholds):
-    if y.ndim == 2:
-        y = np.argmax(y, axis=1)
-
-    y_binary = np.zeros_like(y)
-    y_binary[y == event_index] = 1
-    total_amount = np.sum(y_binary == 1)
-    amount = np.sum((y_binary == 1) & (protected_attribute == 1))
-    if total_amount < 1:
-        return 0, 1
-
-    if feature_name in numerical_thresholds:
-        # Use threshold to separate groups for numerical attributes
-        threshold = numerical_thresholds[feature_name]
-        unprivileged_mask = protected_attribute <= threshold
-        privileged_mask = protected_attribute > threshold
-    else:
-        # Default handling for binary attributes
-        unprivileged_mask = protected_attribute == 0
-        privileged_mask = protected_attribute == 1
-
-    if np.any(unprivileged_mask):
-        selection_rate_unprivileged = np.mean(y_binary[unprivileged_mask])
-    else:
-        selection_rate_unprivileged = 0
-    if np.any(privileged_mask):
-        selection_rate_privileged = np.mean(y_binary[privileged_mask])
-    else:
-        selection_rate_privileged = 0
-
-    if selection_rate_privileged == 0:
-        disp_impact = float("inf") if selection_rate_unprivileged != 0 else 0
-    else:
-        disp_impact = selection_rate_unprivileged / selection_rate_privileged
-
-    stat_parity = abs(selection_rate_unprivileged - selection_rate_privileged)
-    #print(f"stat. parity: {stat_parity}, amount: {amount} out of {total_amount}, privileged: {np.sum(protected_attribute == 1)}, unprivileged: {np.sum(protected_attribute == 1)}")
-    #print(f"selection_rate_unprivileged: {selection_rate_unprivileged}, selection_rate_privileged: {selection_rate_privileged}")
-    return stat_parity, disp_impact
-
-
 def evaluate_dt(dt, X_test, y_test):
     print("testing dt:")
     y_argmax = np.argmax(y_test, axis=1)
@@ -323,40 +185,9 @@ def distill_nn(nn, X):
     return y
 
 def calculate_comparable_fairness_single(nn_model, X, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds):
-    stat_par_results = {}
-    disp_imp_results = {}
-    
-    y = nn_model.predict(X)
-    
-    for decision in critical_decisions:
-        if isinstance(decision.previous, list):
-            previous_indices = [feature_names.index("-1. Event = " + prev) for prev in decision.previous]
-        else:
-            previous_indices = [feature_names.index("-1. Event = " + decision.previous)]
-        
-        for attribute in decision.attributes:
-            feature_indices_to_use = feature_indices.get(attribute, [])
-            for feature_index in feature_indices_to_use:
-                for event in decision.possible_events:
-                    key = (feature_names[feature_index], event)
-                    
-                    if event not in class_names:
-                        raise ValueError(f"Event '{event}' not found in class_names.")
-                    
-                    event_index = class_names.index(event) if isinstance(class_names, list) else np.where(class_names == event)[0][0]
-                    filter_mask = np.any(X[:, previous_indices] == 1, axis=1)
-                    X_filtered = X[filter_mask]
-                    y_filtered = y[filter_mask]
-                    protected_attribute = X_filtered[:, feature_index]
-                    
-                    stat_par, disp_imp = get_fairness_metrics(y_filtered, protected_attribute, event_index, feature_names[feature_index], numerical_thresholds)
-                    
-                    stat_par_results[key] = stat_par
-                    disp_imp_results[key] = disp_imp 
-                    
-                    print(f"Statistical Parity for {feature_names[feature_index]}, {event}, model: {stat_par}")
-    
-    return stat_par_results, disp_imp_results
+    stat_par_results, disp_imp_results = fairness_metrics({"model": nn_model.predict(X)}, X, critical_decisions, feature_indices, class_names, feature_names, numerical_thresholds)
+    return ({key: value["model"] for key, value in stat_par_results.items()},
+            {key: value["model"] for key, value in disp_imp_results.items()})
 
 
 def finetune_all(nn, X_train, y_modified, y_distilled_tree, y_distilled, X_test, y_test, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds):
@@ -395,33 +226,57 @@ def finetune_all(nn, X_train, y_modified, y_distilled_tree, y_distilled, X_test,
 
 
 
-def finetune_nn(nn, X_train, y_modified, y_distilled_tree=None, y_distilled=None, X_test=None, y_test=None, epochs=5, batch_size=32, learning_rate=1e-3, mode="changed_complete"):
-    # if mode is simple, just train with y_modified
+def finetune_nn(nn, X_train, y_modified, y_distilled_tree=None, y_distilled=None, X_test=None, y_test=None, epochs=5, batch_size=None, learning_rate=1e-3, mode="changed_complete",
+                lr_scaling=None, shuffle_buffer=None, cache=None, folder_name=None, patience=None):
+    """
+    Fine-tunes nn on the outputs of the modified tree. The targets can be LabelStores, class ids or
+    dense (samples x classes) arrays; they are kept compact and densified per batch by make_dataset.
+    Like train_nn it stops early on a random VALIDATION_SPLIT of X_train's rows; X_test/y_test are only
+    monitored, so the test results stay unbiased. With a folder_name it is checkpointed and resumed
+    (for the same starting weights and targets). Returns the fine-tuned network.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    patience = PATIENCE if patience is None else patience
     print(f"Finetuning with mode: {mode}")
+    num_classes = int(nn.outputs[0].shape[-1])
+    y_modified = as_label_store(y_modified, num_classes)
+    callbacks = [JobProgressCallback(f"finetune_{mode}", epochs)]
+    # if mode is simple, just train with y_modified
     if mode == "simple":
-        nn.compile(optimizer=Adam(learning_rate=learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
-        if X_test is None:
-            nn.fit(X_train, y_modified, epochs=epochs, batch_size=batch_size)
-        else:
-            nn.fit(X_train, y_modified, epochs=epochs, batch_size=batch_size, validation_data=(X_test, y_test))
+        targets = y_modified
 
     # if mode is changed complete, use the samples that changed value
     elif mode == "changed_complete":
-        changed_rows = np.any(y_distilled_tree != y_modified, axis=1)
-        changed_indices = np.where(changed_rows)[0]
-        y_changed_complete = y_distilled.copy()
-        y_changed_complete[changed_indices] = y_modified[changed_indices]
-        nn.compile(optimizer=Adam(learning_rate=learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
-        print(f"Changed {len(changed_indices)} out of {len(X_train)} samples")
-        if X_test is None:
-            nn.fit(X_train, y_changed_complete, epochs=epochs, batch_size=batch_size)
-        else:
-            nn.fit(X_train, y_changed_complete, epochs=epochs, batch_size=batch_size, validation_data=(X_test, y_test))
+        y_distilled = as_label_store(y_distilled, num_classes)
+        y_distilled_tree = as_label_store(y_distilled_tree, num_classes)
+        changed_indices = np.flatnonzero(y_distilled_tree.labels != y_modified.labels)
+        targets = y_distilled.with_hard_labels(changed_indices, y_modified.labels[changed_indices])
+        print(f"Changed {len(changed_indices)} out of {X_train.shape[0]} samples")
 
     else:
-        raise(f"mode {mode} doesn't exist!")
+        raise ValueError(f"mode {mode} doesn't exist!")
+
+    if patience and VALIDATION_SPLIT:
+        X_train, targets, validation_data = split_validation(X_train, targets)
+    else:
+        # only monitored, no weights are chosen by their test loss
+        validation_data = (X_test, y_test) if X_test is not None else None
+    stage = f"finetune_{mode}"
+    learning_rate = scaled_learning_rate(learning_rate, batch_size, lr_scaling)
+    config = {"epochs": epochs, "batch_size": batch_size, "learning_rate": learning_rate, "patience": patience, "shape": X_train.shape}
+    key = run_key(stage, config, arrays=nn.get_weights() + [targets.labels, targets.hard]) if folder_name else None
+    control = TrainingControl(stage, X_train.shape[0], folder_name=folder_name, key=key, patience=patience)
+    resumed = control.resume()
+    if resumed is not None:
+        nn = resumed
+    else:
+        nn.compile(optimizer=Adam(learning_rate=learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+    callbacks.append(control)
+    dataset = make_dataset(X_train, targets, batch_size, shuffle_buffer=shuffle_buffer, cache=cache)
+    validation = make_dataset(*validation_data, batch_size, shuffle=False) if validation_data is not None else None
+    nn.fit(dataset, epochs=epochs, initial_epoch=control.initial_epoch(epochs), validation_data=validation, callbacks=callbacks)
 
-    return nn
+    return control.finish(nn)
 
 
 def find_missing_ids(dt_distilled, dt_modified):
@@ -558,189 +413,291 @@ def run_demo():
     #mine_bpm("hospital_billing.xes", "hb")
     #ablation_experiment("bias", "ablation_bias", np.arange(0.6, 0.8, 0.1), ["time_delta", "age"], ["time_delta", "age"], num_cases=1000, folds=3)
 
-def k_fold_evaluation(df, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys, folds=5, prefix_length=3, modify_mode="retrain", finetuning_mode=None, folder_name=None):
-    results = []
-    class_names = sorted(df["activity"].unique().tolist() + ["<PAD>"])
-    attribute_pools = create_attribute_pools(df, categorical_attributes)
-    feature_names = create_feature_names(class_names, attribute_pools, numerical_attributes, prefix_length)
-    feature_indices = create_feature_indices(class_names, attribute_pools, numerical_attributes, prefix_length)
+def _init_fold_worker(threads):
+    # pin TensorFlow's thread pools before the worker runs its first op, so workers don't oversubscribe the cores
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+    # the process only evaluates folds, deterministic ops can stay on for its lifetime
+    tf.config.experimental.enable_op_determinism()
+
+def _training_config():
+    """The settings of train_nn/finetune_nn that change fold results."""
+    return (USE_PIPELINE, DEFAULT_BATCH_SIZE, LR_SCALING, SHUFFLE_BUFFER, PATIENCE, VALIDATION_SPLIT, DISTILL_TOP_K, FOLD_DETERMINISM)
+
+def _fold_config_key(df, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys, folds, prefix_length, modify_mode, finetuning_mode, seed):
+    """Hash of everything that determines the fold results, finished folds are only reused for the same key."""
+    config = repr((list(df.columns), critical_decisions, sorted(categorical_attributes), sorted(numerical_attributes),
+                   sorted(base_attributes), sorted(parity_keys), folds, prefix_length, modify_mode, finetuning_mode, seed, _training_config()))
+    digest = hashlib.sha256(config.encode())
+    # the log's content, so a regenerated or edited log of the same size gets a new key
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+def _fold_path(folder_name, config_key, fold_id):
+    return os.path.join("data", folder_name, "folds", config_key, f"fold_{fold_id}.json")
+
+def _evaluate_fold(i, X_train, y_train, X_test, y_test, numerical_thresholds, critical_decisions, categorical_attributes, numerical_attributes,
+                   base_attributes, parity_keys, class_names, feature_names, feature_indices, modify_mode, finetuning_mode, seed):
+    """Runs one fold of k_fold_evaluation and returns its results row."""
+    tf.keras.utils.set_random_seed(seed + i)  # python, numpy and tensorflow, per fold so the order of folds doesn't matter
+    if FOLD_DETERMINISM:
+        # can't be switched off again, every later training of this process stays deterministic (and slower)
+        tf.config.experimental.enable_op_determinism()
+    X_train_base = remove_attribute_features(X_train, feature_indices, base_attributes)
+    X_test_base = remove_attribute_features(X_test, feature_indices, base_attributes)
+    nn_base = train_nn(X_train_base, y_train)
+    base_accuracy = evaluate_nn(nn_base, X_test_base, y_test)
+
+    nn_enriched = train_nn(X_train, y_train)
+    y_distilled = LabelStore.from_probabilities(nn_enriched.predict(X_train), top_k=DISTILL_TOP_K)
+    y_encoded = y_distilled.labels
     
-    folds = k_fold_cross_validation(df, categorical_attributes, numerical_attributes, critical_decisions, prefix_length=3, k=folds)
+    dt_distilled, y_distilled_tree = train_dt(X_train, y_encoded, class_names=class_names, feature_names=feature_names, feature_indices=feature_indices, return_train_predictions=True)
+    enriched_accuracy = evaluate_nn(nn_enriched, X_test, y_test)
     
-    for i, (X_train, y_train, X_test, y_test, numerical_thresholds) in tqdm(enumerate(folds), desc="evaluating model:"):
-        X_train_base = remove_attribute_features(X_train, feature_indices, base_attributes)
-        X_test_base = remove_attribute_features(X_test, feature_indices, base_attributes)
-        nn_base = train_nn(X_train_base, y_train)
-        base_accuracy = evaluate_nn(nn_base, X_test_base, y_test)
-
-        nn_enriched = train_nn(X_train, y_train)
-        y_distilled = nn_enriched.predict(X_train)
-        y_encoded = np.argmax(y_distilled, axis=1)
-        
-        dt_distilled = train_dt(X_train, y_encoded, class_names=class_names, feature_names=feature_names, feature_indices=feature_indices)
-        enriched_accuracy = evaluate_nn(nn_enriched, X_test, y_test)
-        
-        modified_tree_accuracy = evaluate_dt(dt_distilled, X_test, y_test)
-        num_nodes = dt_distilled.count_nodes()
-        nodes_to_remove = dt_distilled.find_nodes_to_remove(critical_decisions)
-        removed_nodes = 0
-        depth = get_max_depth(dt_distilled.root)
-        
-        y_distilled_tree = dt_distilled.predict(X_train)
-        y_distilled_tree = to_categorical(y_distilled_tree, num_classes=len(dt_distilled.class_names))
-        
-        nn_modified = clone_model(nn_enriched)
-        nn_modified.set_weights(nn_enriched.get_weights())
-        
-        if nodes_to_remove:
-            if modify_mode == "retrain":
-                y_encoded = np.argmax(y_train, axis=1)
-                iterations = len(categorical_attributes + numerical_attributes) - len(base_attributes)
-                for _ in range(iterations):
-                    nodes_to_remove = dt_distilled.find_nodes_to_remove(critical_decisions)
-                    print(f"Nodes to remove: {nodes_to_remove}")
-                    if not nodes_to_remove:
-                        break
-                    removed_nodes += len(nodes_to_remove)
-                    for node_id in nodes_to_remove:
-                        dt_distilled.delete_node(X_train, y_encoded, node_id)
-            else:
+    modified_tree_accuracy = evaluate_dt(dt_distilled, X_test, y_test)
+    num_nodes = dt_distilled.count_nodes()
+    nodes_to_remove = dt_distilled.find_nodes_to_remove(critical_decisions)
+    removed_nodes = 0
+    depth = get_max_depth(dt_distilled.root)
+    
+    y_distilled_tree = LabelStore.from_labels(y_distilled_tree, len(class_names))
+    
+    nn_modified = clone_model(nn_enriched)
+    nn_modified.set_weights(nn_enriched.get_weights())
+    
+    if nodes_to_remove:
+        if modify_mode == "retrain":
+            y_encoded = np.argmax(y_train, axis=1)
+            iterations = len(categorical_attributes + numerical_attributes) - len(base_attributes)
+            for _ in range(iterations):
+                nodes_to_remove = dt_distilled.find_nodes_to_remove(critical_decisions)
                 print(f"Nodes to remove: {nodes_to_remove}")
+                if not nodes_to_remove:
+                    break
                 removed_nodes += len(nodes_to_remove)
                 for node_id in nodes_to_remove:
-                    dt_distilled.delete_branch(node_id)
-            
-            modified_tree_accuracy = evaluate_dt(dt_distilled, X_test, y_test)
-            y_modified = dt_distilled.predict(X_train)
-            y_modified = to_categorical(y_modified, num_classes=len(dt_distilled.class_names))
-            
-            if finetuning_mode is not None:
-                nn_modified = finetune_nn(nn_modified, X_train, y_modified, y_distilled=y_distilled, y_distilled_tree=y_distilled_tree, X_test=X_test, y_test=y_test, mode=finetuning_mode)
-                best_mode = finetuning_mode
-            else:
-                nn_modified, best_mode = finetune_all(nn_modified, X_train, y_modified, y_distilled_tree, y_distilled, X_test, y_test, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds)
-            modified_accuracy = evaluate_nn(nn_modified, X_test, y_test)
+                    dt_distilled.delete_node(X_train, y_encoded, node_id)
         else:
-            modified_accuracy = enriched_accuracy
-            best_mode = None
-        
-        stat_par_result, _ = calculate_comparable_fairness(nn_base, nn_enriched, nn_modified, X_test, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds)
-        
-        row = {
-            "fold_id": i,
-            "base_accuracy": base_accuracy,
-            "modified_accuracy": modified_accuracy,
-            "enriched_accuracy": enriched_accuracy,
-            "modified_tree_accuracy": modified_tree_accuracy,
-            "num_nodes": num_nodes,
-            "removed_nodes": removed_nodes,
-            "depth": depth,
-            "best_mode": best_mode
-        }
+            print(f"Nodes to remove: {nodes_to_remove}")
+            removed_nodes += len(nodes_to_remove)
+            for node_id in nodes_to_remove:
+                dt_distilled.delete_branch(node_id)
         
-        for outer_key, outer_value in stat_par_result.items():
-            for inner_key, inner_value in outer_value.items():
-                if outer_key in parity_keys:
-                    row[f"dp_{outer_key}_{inner_key}"] = inner_value
+        modified_tree_accuracy = evaluate_dt(dt_distilled, X_test, y_test)
+        y_modified = LabelStore.from_labels(dt_distilled.predict(X_train), len(class_names))
         
+        if finetuning_mode is not None:
+            nn_modified = finetune_nn(nn_modified, X_train, y_modified, y_distilled=y_distilled, y_distilled_tree=y_distilled_tree, X_test=X_test, y_test=y_test, mode=finetuning_mode)
+            best_mode = finetuning_mode
+        else:
+            nn_modified, best_mode = finetune_all(nn_modified, X_train, y_modified, y_distilled_tree, y_distilled, X_test, y_test, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds)
+        modified_accuracy = evaluate_nn(nn_modified, X_test, y_test)
+    else:
+        modified_accuracy = enriched_accuracy
+        best_mode = None
+    
+    stat_par_result, _ = calculate_comparable_fairness(nn_base, nn_enriched, nn_modified, X_test, critical_decisions, feature_indices, class_names, feature_names, base_attributes, numerical_thresholds)
+    
+    row = {
+        "fold_id": i,
+        "base_accuracy": base_accuracy,
+        "modified_accuracy": modified_accuracy,
+        "enriched_accuracy": enriched_accuracy,
+        "modified_tree_accuracy": modified_tree_accuracy,
+        "num_nodes": num_nodes,
+        "removed_nodes": removed_nodes,
+        "depth": depth,
+        "best_mode": best_mode
+    }
+    
+    for outer_key, outer_value in stat_par_result.items():
+        for inner_key, inner_value in outer_value.items():
+            if outer_key in parity_keys:
+                row[f"dp_{outer_key}_{inner_key}"] = inner_value
+    
+    return row
+
+def k_fold_evaluation(df, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys, folds=5, prefix_length=3, modify_mode="retrain", finetuning_mode=None, folder_name=None, num_workers=FOLD_WORKERS, seed=0):
+    """
+    Evaluates the pipeline on k folds, in num_workers processes if more than one. Every fold is seeded
+    with seed + fold_id. With a folder_name finished folds are stored on disk and skipped when the
+    same evaluation runs again.
+    """
+    results = {}
+    class_names = sorted(df["activity"].unique().tolist() + ["<PAD>"])
+    attribute_pools = create_attribute_pools(df, categorical_attributes)
+    feature_names = create_feature_names(class_names, attribute_pools, numerical_attributes, prefix_length)
+    feature_indices = create_feature_indices(class_names, attribute_pools, numerical_attributes, prefix_length)
+    context = (critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys,
+               class_names, feature_names, feature_indices, modify_mode, finetuning_mode, seed)
+
+    config_key = _fold_config_key(df, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys, folds, prefix_length, modify_mode, finetuning_mode, seed)
+    if folder_name:
+        for i in range(folds):
+            if os.path.exists(_fold_path(folder_name, config_key, i)):
+                with open(_fold_path(folder_name, config_key, i), "r") as f:
+                    results[i] = json.load(f)
+                print(f"Fold {i} already finished, skipping")
+
+    def store(row):
         print(row)
-        results.append(row)
-        
-    results_df = pd.DataFrame(results)
+        results[row["fold_id"]] = row
+        if folder_name:
+            path = _fold_path(folder_name, config_key, row["fold_id"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(row, f, indent=4, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+
+    folds = k_fold_cross_validation(df, categorical_attributes, numerical_attributes, critical_decisions, prefix_length=prefix_length, k=folds)
+    pending = ((i, fold) for i, fold in enumerate(folds) if i not in results)
+
+    if num_workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // num_workers)
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_fold_worker, initargs=(threads,)) as executor:
+            futures = [executor.submit(_evaluate_fold, i, *fold, *context) for i, fold in pending]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="evaluating model:"):
+                store(future.result())
+    else:
+        for i, fold in tqdm(pending, desc="evaluating model:"):
+            store(_evaluate_fold(i, *fold, *context))
+
+    results_df = pd.DataFrame([results[i] for i in sorted(results)])
     if folder_name:
         save_data(results_df, folder_name, "results_df.pkl")
         run_results(folder_name)
     return results_df
 
-def ablation_experiment(experiment_type, folder_name, num_range, numerical_attributes, base_attributes, bias=0.7, num_cases=10000, folds=5):
-    all_results = []
-    for param in num_range:
-        if param == 0:
-            param = 1
-        print(f"Analyzing {experiment_type}: {param}")
-        process_model = build_process_model(f"ablation_{experiment_type}")
-        critical_decisions = []
-
-        if experiment_type == "decisions":
-            categorical_attributes = ["a_0"]
-            parity_keys = [("a_0 = A", "A_0")]
-            process_model.add_categorical_attribute("a_0", [("A", 0.5), ("B", 0.5)])
-            process_model.add_activity("A_0")
-            process_model.add_activity("B_0")
-            process_model.add_activity("C_0")
-            process_model.add_activity("D_0")
-            
-            conditions_top = {("a_0", "A"): bias, ("a_0", "B"): 1 - bias}
-            conditions_bottom = {("a_0", "A"): 1 - bias, ("a_0", "B"): bias}
-            process_model.add_transition("start", "A_0", conditions=conditions_top)
-            process_model.add_transition("start", "B_0", conditions=conditions_bottom)
-            process_model.add_transition("A_0", "C_0", conditions=conditions_top)
-            process_model.add_transition("A_0", "D_0", conditions=conditions_bottom)
-            process_model.add_transition("B_0", "C_0", conditions=conditions_top)
-            process_model.add_transition("B_0", "D_0", conditions=conditions_bottom)
-
-            critical_decisions.append(Decision(attributes=["a_0"], possible_events=["A_0", "B_0"], to_remove=True, previous="start"))
-            
-            for n in range(1, param):
-                attr, prev_c, prev_d = f"a_{n}", f"C_{n-1}", f"D_{n-1}"
-                conditions_top = {(attr, "A"): bias, (attr, "B"): 1 - bias}
-                conditions_bottom = {(attr, "A"): 1 - bias, (attr, "B"): bias}
-                process_model.add_categorical_attribute(attr, [("A", 0.5), ("B", 0.5)])
-                categorical_attributes.append(attr)
-                parity_keys.append((f"{attr} = A", f"A_{n}"))
-                critical_decisions.append(Decision(attributes=[attr], possible_events=[f"A_{n}", f"B_{n}"], to_remove=True, previous=[prev_c, prev_d]))
-                
-                for act in ["A", "B", "C", "D"]:
-                    process_model.add_activity(f"{act}_{n}")
-                
-                for prev in [prev_c, prev_d]:
-                    process_model.add_transition(prev, f"A_{n}", conditions=conditions_top)
-                    process_model.add_transition(prev, f"B_{n}", conditions=conditions_bottom)
-
-                for act in ["A", "B"]:
-                    process_model.add_transition(f"{act}_{n}", f"C_{n}", conditions=conditions_top)
-                    process_model.add_transition(f"{act}_{n}", f"D_{n}", conditions=conditions_bottom)
-
-            process_model.add_transition(f"C_{param-1}", "end", conditions={})
-            process_model.add_transition(f"D_{param-1}", "end", conditions={})
+def build_ablation_model(experiment_type, param, bias=0.7):
+    """Process model of one ablation setting with its categorical attributes, parity keys and critical decisions."""
+    process_model = build_process_model(f"ablation_{experiment_type}")
+    critical_decisions = []
+
+    if experiment_type == "decisions":
+        categorical_attributes = ["a_0"]
+        parity_keys = [("a_0 = A", "A_0")]
+        process_model.add_categorical_attribute("a_0", [("A", 0.5), ("B", 0.5)])
+        process_model.add_activity("A_0")
+        process_model.add_activity("B_0")
+        process_model.add_activity("C_0")
+        process_model.add_activity("D_0")
         
-        elif experiment_type == "attributes":
-            categorical_attributes = []
-            parity_keys = []
-            for n in range(param):
-                attr = f"a_{n}"
-                process_model.add_categorical_attribute(attr, [("A", 0.5), ("B", 0.5)])
-                categorical_attributes.append(attr)
-                parity_keys.append((f"{attr} = A", "collect history"))
-                critical_decisions.append(Decision(attributes=[attr], possible_events=["collect history", "refuse screening"], to_remove=True, previous="asses eligibility"))
-                
-                process_model.add_transition("asses eligibility", "collect history", conditions={(attr, "A"): bias, (attr, "B"): 1 - bias})
-                process_model.add_transition("asses eligibility", "refuse screening", conditions={(attr, "A"): 1 - bias, (attr, "B"): bias})
-                if n % 2 == 1:
-                    bias_2 = 1 - bias
-                else:
-                    bias_2 = bias
-                process_model.add_transition("collect history", "prostate screening", conditions={(attr, "A"): bias_2, (attr, "B"): 1 - bias_2})
-                process_model.add_transition("collect history", "mammary screening", conditions={(attr, "A"): 1 - bias_2, (attr, "B"): bias_2})
+        conditions_top = {("a_0", "A"): bias, ("a_0", "B"): 1 - bias}
+        conditions_bottom = {("a_0", "A"): 1 - bias, ("a_0", "B"): bias}
+        process_model.add_transition("start", "A_0", conditions=conditions_top)
+        process_model.add_transition("start", "B_0", conditions=conditions_bottom)
+        process_model.add_transition("A_0", "C_0", conditions=conditions_top)
+        process_model.add_transition("A_0", "D_0", conditions=conditions_bottom)
+        process_model.add_transition("B_0", "C_0", conditions=conditions_top)
+        process_model.add_transition("B_0", "D_0", conditions=conditions_bottom)
+
+        critical_decisions.append(Decision(attributes=["a_0"], possible_events=["A_0", "B_0"], to_remove=True, previous="start"))
         
-        elif experiment_type == "bias":
-            bias = param
-            categorical_attributes = ["gender"]
-            parity_keys = [("gender = male", "collect history")]
-            critical_decisions.append(Decision(attributes=["gender"], possible_events=["collect history", "refuse screening"], to_remove=True, previous="asses eligibility"))
-            process_model.add_transition("asses eligibility", "collect history", conditions={("gender", "male"): bias, ("gender", "female"): 1 - bias})
-            process_model.add_transition("asses eligibility", "refuse screening", conditions={("gender", "male"): 1 - bias, ("gender", "female"): bias})
-        
-        trace_generator = TraceGenerator(process_model=process_model)
-        df = cases_to_dataframe(trace_generator.generate_traces(num_cases=num_cases))
-        results_df = k_fold_evaluation(df, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys, folds=folds, prefix_length=3, modify_mode="cut", folder_name=None)
-        if experiment_type == "decisions":
-            results_df["param"] = param * 2
-        else:
-            results_df["param"] = param
-        all_results.append(results_df)
+        for n in range(1, param):
+            attr, prev_c, prev_d = f"a_{n}", f"C_{n-1}", f"D_{n-1}"
+            conditions_top = {(attr, "A"): bias, (attr, "B"): 1 - bias}
+            conditions_bottom = {(attr, "A"): 1 - bias, (attr, "B"): bias}
+            process_model.add_categorical_attribute(attr, [("A", 0.5), ("B", 0.5)])
+            categorical_attributes.append(attr)
+            parity_keys.append((f"{attr} = A", f"A_{n}"))
+            critical_decisions.append(Decision(attributes=[attr], possible_events=[f"A_{n}", f"B_{n}"], to_remove=True, previous=[prev_c, prev_d]))
+            
+            for act in ["A", "B", "C", "D"]:
+                process_model.add_activity(f"{act}_{n}")
+            
+            for prev in [prev_c, prev_d]:
+                process_model.add_transition(prev, f"A_{n}", conditions=conditions_top)
+                process_model.add_transition(prev, f"B_{n}", conditions=conditions_bottom)
+
+            for act in ["A", "B"]:
+                process_model.add_transition(f"{act}_{n}", f"C_{n}", conditions=conditions_top)
+                process_model.add_transition(f"{act}_{n}", f"D_{n}", conditions=conditions_bottom)
 
-    final_results_df = pd.concat(all_results, ignore_index=True)
+        process_model.add_transition(f"C_{param-1}", "end", conditions={})
+        process_model.add_transition(f"D_{param-1}", "end", conditions={})
+    
+    elif experiment_type == "attributes":
+        categorical_attributes = []
+        parity_keys = []
+        for n in range(param):
+            attr = f"a_{n}"
+            process_model.add_categorical_attribute(attr, [("A", 0.5), ("B", 0.5)])
+            categorical_attributes.append(attr)
+            parity_keys.append((f"{attr} = A", "collect history"))
+            critical_decisions.append(Decision(attributes=[attr], possible_events=["collect history", "refuse screening"], to_remove=True, previous="asses eligibility"))
+            
+            process_model.add_transition("asses eligibility", "collect history", conditions={(attr, "A"): bias, (attr, "B"): 1 - bias})
+            process_model.add_transition("asses eligibility", "refuse screening", conditions={(attr, "A"): 1 - bias, (attr, "B"): bias})
+            if n % 2 == 1:
+                bias_2 = 1 - bias
+            else:
+                bias_2 = bias
+            process_model.add_transition("collect history", "prostate screening", conditions={(attr, "A"): bias_2, (attr, "B"): 1 - bias_2})
+            process_model.add_transition("collect history", "mammary screening", conditions={(attr, "A"): 1 - bias_2, (attr, "B"): bias_2})
+    
+    elif experiment_type == "bias":
+        bias = param
+        categorical_attributes = ["gender"]
+        parity_keys = [("gender = male", "collect history")]
+        critical_decisions.append(Decision(attributes=["gender"], possible_events=["collect history", "refuse screening"], to_remove=True, previous="asses eligibility"))
+        process_model.add_transition("asses eligibility", "collect history", conditions={("gender", "male"): bias, ("gender", "female"): 1 - bias})
+        process_model.add_transition("asses eligibility", "refuse screening", conditions={("gender", "male"): 1 - bias, ("gender", "female"): bias})
+    return process_model, categorical_attributes, parity_keys, critical_decisions
+
+def _simulate_ablation_log(experiment_type, param, bias, num_cases, seed):
+    process_model, _, _, _ = build_ablation_model(experiment_type, param, bias)
+    trace_generator = TraceGenerator(process_model=process_model)
+    return simulated_log_to_dataframe(trace_generator.simulate(num_cases=num_cases, seed=seed))
+
+def _load_experiment_log(folder_name):
+    return load_data(folder_name, "df.pkl")
+
+def _run_fold_task(fold_id, folds, prefix_length, critical_decisions, categorical_attributes, numerical_attributes, base_attributes,
+                   parity_keys, modify_mode, finetuning_mode, seed, df):
+    """Sweep task: encodes one fold of the log and evaluates it like k_fold_evaluation does."""
+    class_names = sorted(df["activity"].unique().tolist() + ["<PAD>"])
+    attribute_pools = create_attribute_pools(df, categorical_attributes)
+    feature_names = create_feature_names(class_names, attribute_pools, numerical_attributes, prefix_length)
+    feature_indices = create_feature_indices(class_names, attribute_pools, numerical_attributes, prefix_length)
+    train_case_ids, test_case_ids = k_fold_case_splits(df, folds)[fold_id]
+    fold = encode_fold(df, train_case_ids, test_case_ids, categorical_attributes, numerical_attributes, critical_decisions, prefix_length=prefix_length)
+    row = _evaluate_fold(fold_id, *fold, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys,
+                         class_names, feature_names, feature_indices, modify_mode, finetuning_mode, seed)
+    row["seed"] = seed
+    return row
+
+def _fold_tasks(name, log_task, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys,
+                folds, prefix_length, modify_mode, finetuning_mode, seed):
+    config = (folds, prefix_length, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys,
+              modify_mode, finetuning_mode, seed)
+    # the training settings come from the environment, results of other settings must not be reused
+    return [Task(f"{name} fold {i} seed {seed}", _run_fold_task, (i, *config), deps=[log_task], inputs=_training_config()) for i in range(folds)]
+
+def _sweep_threads(num_workers):
+    return (max(1, (os.cpu_count() or 1) // num_workers),)
+
+def ablation_experiment(experiment_type, folder_name, num_range, numerical_attributes, base_attributes, bias=0.7, num_cases=10000, folds=5, seeds=(0,), num_workers=FOLD_WORKERS):
+    """
+    Runs the ablation as a sweep: one log per (param, seed) and one task per fold on top of it. Results are
+    cached by content hash in the sweep folder, so a rerun or a crashed sweep only computes what's missing,
+    and several machines can work on the same sweep (see sweep.run_sweep).
+    """
+    tasks, params = [], []
+    for param in num_range:
+        param = param.item() if hasattr(param, "item") else param
+        if param == 0:
+            param = 1
+        _, categorical_attributes, parity_keys, critical_decisions = build_ablation_model(experiment_type, param, bias)
+        for seed in seeds:
+            log_task = Task(f"{folder_name} log param {param} seed {seed}", _simulate_ablation_log, (experiment_type, param, bias, num_cases, seed))
+            fold_tasks = _fold_tasks(f"{folder_name} param {param}", log_task, critical_decisions, categorical_attributes, numerical_attributes,
+                                     base_attributes, parity_keys, folds, 3, "cut", None, seed)
+            tasks += fold_tasks
+            params += [param * 2 if experiment_type == "decisions" else param] * len(fold_tasks)
+
+    rows = run_sweep(tasks, num_workers=num_workers, initializer=_init_fold_worker, initargs=_sweep_threads(num_workers))
+    final_results_df = pd.DataFrame([dict(row, param=param) for row, param in zip(rows, params)])
     dp_base_cols = [col for col in final_results_df.columns if col.startswith("dp_") and col.endswith("_base")]
     dp_modified_cols = [col for col in final_results_df.columns if col.startswith("dp_") and col.endswith("_modified")]
     dp_enriched_cols = [col for col in final_results_df.columns if col.startswith("dp_") and col.endswith("_enriched")]
@@ -756,22 +713,36 @@ def ablation_experiment(experiment_type, folder_name, num_range, numerical_attri
 
 
 
-def run_evaluation(folder_name, folds=5, prefix_length=3):
+def run_evaluation(folder_name, folds=5, prefix_length=3, seeds=(0,), num_workers=FOLD_WORKERS):
     if folder_name is None:
         folder_names = ["cs", "hb_-age_-gender", "hb_-age_+gender", "hb_+age_-gender", "hb_+age_+gender", "bpi_2012"]
     else:
         folder_names = [folder_name]
 
+    # one sweep over all experiments, so workers move on to the next experiment instead of idling at the end of one
+    tasks = {}
     for folder_name in folder_names:
-        df = load_data(folder_name, "df.pkl")
+        log_path = os.path.join("data", folder_name, "df.pkl")
+        log_task = Task(f"{folder_name} log", _load_experiment_log, (folder_name,), inputs=(os.path.getsize(log_path), os.path.getmtime(log_path)))
         categorical_attributes, numerical_attributes = get_attributes(folder_name)
         categorical_attributes_base, numerical_attributes_base = get_base_attributes(folder_name)
         base_attributes = categorical_attributes_base + numerical_attributes_base
         critical_decisions = get_critical_decisions(folder_name)
         parity_keys = get_parity_key(folder_name)
-        k_fold_evaluation(df, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys, folds=folds, prefix_length=prefix_length, folder_name=folder_name)
+        tasks[folder_name] = [task for seed in seeds for task in _fold_tasks(
+            folder_name, log_task, critical_decisions, categorical_attributes, numerical_attributes, base_attributes, parity_keys,
+            folds, prefix_length, "retrain", None, seed)]
+
+    rows = run_sweep([task for folder_tasks in tasks.values() for task in folder_tasks], num_workers=num_workers,
+                     initializer=_init_fold_worker, initargs=_sweep_threads(num_workers))
+    offset = 0
+    for folder_name, folder_tasks in tasks.items():
+        results_df = pd.DataFrame(rows[offset:offset + len(folder_tasks)])
+        offset += len(folder_tasks)
+        save_data(results_df, folder_name, "results_df.pkl")
+        run_results(folder_name)
 
-def run_ablation(folder_name):
+def run_ablation(folder_name, seeds=(0,), num_workers=FOLD_WORKERS):
     if folder_name is None:
         folder_names = ["ablation_bias", "ablation_attributes", "ablation_decisions"]
     else:
@@ -779,11 +750,11 @@ def run_ablation(folder_name):
 
     for folder_name in folder_names:
         if folder_name == "ablation_bias":
-            ablation_experiment("bias", "ablation_bias", np.arange(0.5, 1.05, 0.05), ["time_delta", "age"], ["time_delta", "age"])
+            ablation_experiment("bias", "ablation_bias", np.arange(0.5, 1.05, 0.05), ["time_delta", "age"], ["time_delta", "age"], seeds=seeds, num_workers=num_workers)
         elif folder_name == "ablation_attributes":
-            ablation_experiment("attributes", "ablation_attributes", np.arange(0, 11, 2), ["time_delta", "age"], ["time_delta", "age"])
+            ablation_experiment("attributes", "ablation_attributes", np.arange(0, 11, 2), ["time_delta", "age"], ["time_delta", "age"], seeds=seeds, num_workers=num_workers)
         elif folder_name == "ablation_decisions":
-            ablation_experiment("decisions", "ablation_decisions", np.arange(0, 11, 2), ["time_delta"], ["time_delta"])
+            ablation_experiment("decisions", "ablation_decisions", np.arange(0, 11, 2), ["time_delta"], ["time_delta"], seeds=seeds, num_workers=num_workers)
 
 def run_load(folder_name):
     if folder_name is None:
@@ -795,8 +766,7 @@ def run_load(folder_name):
         if "cs" in folder_name:
             process_model = build_process_model("cs")
             trace_generator = TraceGenerator(process_model=process_model)
-            cases = trace_generator.generate_traces(num_cases=10000)
-            df = cases_to_dataframe(cases)
+            df = simulated_log_to_dataframe(trace_generator.simulate(num_cases=10000))
             print(df.head(20))
             save_data(df, "cs", "df.pkl")
         elif "hb" in folder_name:
@@ -826,7 +796,7 @@ def run_results(folder_name):
             print(df)
         if "param" in df.columns:
             #process_and_plot_ablation(df, folder_name)
-            numeric_columns = df.drop(columns=["fold_id", "param"], errors="ignore").select_dtypes(include=[np.number]).columns
+            numeric_columns = df.drop(columns=["fold_id", "param", "seed"], errors="ignore").select_dtypes(include=[np.number]).columns
             for param_value, group in df.groupby("param"):
                 print(f"\nStatistics for param = {param_value}:")
                 for col in numeric_columns:
@@ -835,7 +805,7 @@ def run_results(folder_name):
                     print(f"{col}: Mean = {mean_val:.3f}, Std = {std_val:.3f}")
         else:
             #plot_metrics(df, folder_name)
-            numeric_columns = df.drop(columns=["fold_id"], errors="ignore").select_dtypes(include=[np.number]).columns
+            numeric_columns = df.drop(columns=["fold_id", "seed"], errors="ignore").select_dtypes(include=[np.number]).columns
             for col in numeric_columns:
                 mean_val = df[col].mean()
                 std_val = df[col].std()
@@ -0,0 +1,228 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from lxml import etree
+
+# Settings
+CHUNK_EVENTS = 200000  # events held in memory before a chunk is flushed to disk
+
+CATEGORICAL_COLUMNS = ["case_id", "activity"]
+RENAMED_COLUMNS = {"case:concept:name": "case_id", "concept:name": "activity"}
+TIME_COLUMN = "time:timestamp"
+DERIVED_COLUMNS = {"time_delta": pa.float64(), "time_of_day": pa.float64(), "day_of_week": pa.int32()}
+
+
+def _local_name(tag):
+    return etree.QName(tag).localname
+
+def _read_attributes(element):
+    """Key/value/type of the flat attributes of an XES element, nested lists and containers are skipped."""
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue  # comments and processing instructions
+        key = child.get("key")
+        value = child.get("value")
+        if key is not None and value is not None:
+            yield key, value, _local_name(child.tag)
+
+def _convert_chunk(df, types):
+    """Casts the raw string values of a chunk to the XES types."""
+    for column in df.columns:
+        xes_type = types.get(column)
+        if xes_type == "date":
+            df[column] = pd.to_datetime(df[column], utc=True, format="ISO8601")
+        elif xes_type in ("int", "float"):
+            df[column] = pd.to_numeric(df[column])
+        elif xes_type == "boolean":
+            df[column] = df[column].map(lambda value: None if value is None else value.lower() == "true")
+    return df
+
+def _add_time_features(df):
+    """Sorts every trace of the chunk by time and adds time_delta/time_of_day/day_of_week like process_df_timestamps."""
+    if TIME_COLUMN not in df.columns:
+        return df
+    df = df.sort_values(by=["_trace", TIME_COLUMN], kind="stable").reset_index(drop=True)
+    time = df[TIME_COLUMN]
+    df["time_delta"] = time.groupby(df["_trace"]).diff().dt.total_seconds().fillna(0)
+    df["time_of_day"] = time.dt.hour / 24 + time.dt.minute / 1440 + time.dt.second / 86400
+    df["day_of_week"] = time.dt.dayofweek
+    return df
+
+def _arrow_type(column, xes_type, has_nulls):
+    if column in CATEGORICAL_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if column in DERIVED_COLUMNS:
+        return DERIVED_COLUMNS[column]
+    if xes_type == "date":
+        return pa.timestamp("ns", tz="UTC")
+    if xes_type == "int":
+        return pa.float64() if has_nulls else pa.int64()
+    if xes_type == "float":
+        return pa.float64()
+    if xes_type == "boolean":
+        return pa.bool_()
+    return pa.string()
+
+
+class _ChunkSpiller:
+    """Collects event rows and spills them as parquet chunks with their own schema to a temp directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.rows = []
+        self.paths = []
+        self.types = {}
+        self.columns = {}  # column -> has nulls, in first-seen order
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def flush(self):
+        if not self.rows:
+            return
+        df = pd.DataFrame.from_records(self.rows)
+        self.rows = []
+        df = _add_time_features(_convert_chunk(df, self.types))
+        df = df.rename(columns=RENAMED_COLUMNS)
+        for column in df.columns:
+            self.columns[column] = self.columns.get(column, False) or bool(df[column].isna().any())
+        path = os.path.join(self.directory, f"chunk_{len(self.paths)}.parquet")
+        df.to_parquet(path, index=False)
+        self.paths.append(path)
+
+    def schema(self):
+        names = [column for column in self.columns if column != "_trace"]
+        ordered = CATEGORICAL_COLUMNS + [c for c in names if c not in CATEGORICAL_COLUMNS and c not in DERIVED_COLUMNS]
+        ordered += [c for c in DERIVED_COLUMNS if c in self.columns]
+        types = {RENAMED_COLUMNS.get(key, key): xes_type for key, xes_type in self.types.items()}
+        return pa.schema([
+            pa.field(column, _arrow_type(column, types.get(column), self.columns.get(column, True)))
+            for column in ordered
+        ])
+
+
+def stream_xes_to_parquet(xes_path, parquet_path, num_cases=None, chunk_events=CHUNK_EVENTS):
+    """
+    Reads an XES log trace by trace with iterparse and writes it as a parquet event log, without ever
+    holding more than one chunk of events in memory. Columns follow pm4py's naming (trace attributes get
+    a 'case:' prefix), concept:name columns become case_id/activity (categorical), events are sorted by
+    time within each trace and get time_delta/time_of_day/day_of_week. Traces keep their order in the file.
+    If num_cases is given, only the last num_cases traces are kept.
+    Returns a summary with num_cases, num_events and the columns of the written log.
+    """
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(parquet_path)))
+    try:
+        spiller = _ChunkSpiller(tmp_dir)
+        num_traces = 0
+
+        for _, trace in etree.iterparse(xes_path, events=("end",), tag="{*}trace", huge_tree=True):
+            trace_attributes = {"_trace": num_traces}
+            for key, value, xes_type in _read_attributes(trace):
+                trace_attributes[f"case:{key}"] = value
+                spiller.types.setdefault(f"case:{key}", xes_type)
+            for event in trace:
+                if not isinstance(event.tag, str) or _local_name(event.tag) != "event":
+                    continue
+                row = dict(trace_attributes)
+                for key, value, xes_type in _read_attributes(event):
+                    row[key] = value
+                    spiller.types.setdefault(key, xes_type)
+                spiller.add(row)
+            num_traces += 1
+
+            # free the parsed trace and everything before it
+            trace.clear()
+            while trace.getprevious() is not None:
+                del trace.getparent()[0]
+            if len(spiller.rows) >= chunk_events:
+                spiller.flush()
+        spiller.flush()
+
+        # rewrite the chunks into one file with a unified schema
+        schema = spiller.schema()
+        first_trace = num_traces - num_cases if num_cases else 0
+        num_events = 0
+        num_kept_traces = 0
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            for path in spiller.paths:
+                df = pd.read_parquet(path)
+                df = df[df["_trace"] >= first_trace]
+                if df.empty:
+                    continue
+                num_events += len(df)
+                num_kept_traces += df["_trace"].nunique()  # traces never span two chunks
+                df = df.reindex(columns=schema.names)
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                writer.write_table(table.replace_schema_metadata(None))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        "num_cases": int(num_kept_traces),
+        "num_events": num_events,
+        "columns": schema.names,
+    }
+
+def read_event_log(parquet_path):
+    """Reads an event log written by stream_xes_to_parquet, case_id and activity come back as categoricals."""
+    return pd.read_parquet(parquet_path)
+
+def _xes_columns(df, case_column, activity_column, time_column):
+    """(key, xes type, string values, present mask) per written column, formatted for all rows at once."""
+    columns = []
+    for column in df.columns:
+        if column == case_column:
+            continue
+        series = df[column]
+        key = {activity_column: "concept:name", time_column: TIME_COLUMN}.get(column, column)
+        present = series.notna().to_numpy()
+        if pd.api.types.is_datetime64_any_dtype(series):
+            xes_type = "date"
+            values = series.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3]
+            if series.dt.tz is not None:
+                values = values + series.dt.strftime("%z").str.replace(r"(\d\d)$", r":\1", regex=True)
+        elif pd.api.types.is_bool_dtype(series):
+            xes_type = "boolean"
+            values = series.map({True: "true", False: "false"})
+        elif pd.api.types.is_integer_dtype(series):
+            xes_type = "int"
+            values = series.astype(str)
+        elif pd.api.types.is_float_dtype(series):
+            xes_type = "float"
+            values = series.astype(str)
+        else:
+            xes_type = "string"
+            values = series.astype(str)
+        columns.append((key, xes_type, values.to_numpy(dtype=object), present))
+    return columns
+
+def write_xes(df, xes_path, case_column="case_id", activity_column="activity", time_column="time"):
+    """
+    Streams an event log dataframe into an XES file trace by trace with lxml's incremental writer.
+    Values are formatted column-wise up front, every other column becomes an event attribute.
+    """
+    if time_column not in df.columns and TIME_COLUMN in df.columns:
+        time_column = TIME_COLUMN
+    sort_columns = [case_column] + ([time_column] if time_column in df.columns else [])
+    df = df.sort_values(by=sort_columns, kind="stable")
+    case_values = df[case_column].astype(str).to_numpy(dtype=object)
+    bounds = np.flatnonzero(np.r_[True, df[case_column].to_numpy()[1:] != df[case_column].to_numpy()[:-1], True]) if len(df) else np.array([0])
+    columns = _xes_columns(df, case_column, activity_column, time_column)
+
+    with etree.xmlfile(xes_path, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element("log", {"xes.version": "1.0", "xes.features": "nested-attributes"}):
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                trace = etree.Element("trace")
+                etree.SubElement(trace, "string", key="concept:name", value=case_values[start])
+                for row in range(start, end):
+                    event = etree.SubElement(trace, "event")
+                    for key, xes_type, values, present in columns:
+                        if present[row]:
+                            etree.SubElement(event, xes_type, key=key, value=values[row])
+                xf.write(trace)